@@ -0,0 +1,218 @@
+import functools
+import hashlib
+import inspect
+import json
+import os
+import pickle
+import weakref
+
+import numpy as np
+import pandas as pd
+
+from data_loader import HAS_PYARROW
+
+ANALYSIS_CACHE_DIR = 'cache/analysis'
+ANALYSIS_CACHE_MAX_BYTES = 2 * 1024 ** 3
+
+
+def file_fingerprint(paths):
+    """Return a SHA-256 digest over the contents of the given files."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def data_fingerprint(data):
+    """SHA-256 of an input; frames and arrays are hashed by content, anything else by pickle."""
+    digest = hashlib.sha256()
+    if isinstance(data, (pd.DataFrame, pd.Series)):
+        digest.update(pd.util.hash_pandas_object(data, index=True).to_numpy().tobytes())
+        digest.update(repr(list(data.columns) if isinstance(data, pd.DataFrame) else data.name).encode())
+    elif isinstance(data, np.ndarray):
+        digest.update(repr((data.dtype.str, data.shape)).encode())
+        digest.update(np.ascontiguousarray(data).tobytes())
+    elif isinstance(data, dict):
+        for key in sorted(data, key=repr):
+            digest.update(repr(key).encode())
+            digest.update(data_fingerprint(data[key]).encode())
+    else:
+        digest.update(pickle.dumps(data))
+    return digest.hexdigest()
+
+
+def function_fingerprint(func):
+    """Name of `func` plus a hash of the source of its whole defining module.
+
+    Hashing the module rather than the function alone means editing a helper
+    defined next to it (e.g. bootstrap_filter_bubble_counts for
+    calculate_filter_bubble_parallel) also invalidates its entries. Helpers
+    imported from other modules are not covered; pass a `version` to
+    AnalysisCache.cached when changing those.
+    """
+    module = inspect.getmodule(func)
+    try:
+        source = inspect.getsource(module if module is not None else func)
+    except (OSError, TypeError):
+        try:
+            source = inspect.getsource(func)
+        except (OSError, TypeError):
+            source = ''
+    return f'{func.__module__}.{func.__qualname__}|{hashlib.sha256(source.encode()).hexdigest()}'
+
+
+### Storage ###
+
+def _write(result, path_stem):
+    """Store `result` next to `path_stem` and return the file path.
+
+    DataFrames/Series go to Parquet (pickle without pyarrow), arrays to .npy,
+    dicts of str -> float to JSON and anything else to pickle. JSON is only
+    used where it round-trips: int keys or int values would come back as
+    str / float on a hit.
+    """
+    if isinstance(result, pd.Series):
+        result = result.to_frame()
+    if isinstance(result, pd.DataFrame):
+        if HAS_PYARROW:
+            path = path_stem + '.parquet'
+            result.to_parquet(path + '.tmp')
+        else:
+            path = path_stem + '.pkl'
+            result.to_pickle(path + '.tmp')
+    elif isinstance(result, np.ndarray):
+        path = path_stem + '.npy'
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, result)
+    elif (isinstance(result, dict) and all(isinstance(k, str) for k in result)
+          and all(isinstance(v, float) for v in result.values())):
+        path = path_stem + '.json'
+        with open(path + '.tmp', 'w') as f:
+            json.dump({k: float(v) for k, v in result.items()}, f)
+    else:
+        path = path_stem + '.pkl'
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump(result, f)
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def _read(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path)
+    if path.endswith('.npy'):
+        return np.load(path)
+    if path.endswith('.json'):
+        with open(path) as f:
+            return json.load(f)
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+class AnalysisCache:
+    """Content-addressed on-disk cache for intermediate analysis results.
+
+    Entries are keyed by the function (including the source of its module, see
+    function_fingerprint), an optional `version`, the fingerprints of its
+    arguments and its parameters (with defaults filled in). String
+    arguments naming an existing file are keyed by the file's contents.
+    Frames returned by the cache remember their key, so passing one straight
+    into the next cached step costs no re-hashing; this assumes the frame is
+    not modified in place in between. The directory is kept under `max_bytes`
+    by evicting the least recently used entries (hits refresh the file mtime).
+    """
+
+    def __init__(self, cache_dir=ANALYSIS_CACHE_DIR, max_bytes=ANALYSIS_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.stats = {}
+        self._lineage = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _fingerprint(self, value):
+        known = self._lineage.get(id(value))
+        if known is not None and known[0]() is value:
+            return known[1]
+        if isinstance(value, str) and os.path.isfile(value):
+            return 'file:' + file_fingerprint([value])
+        return data_fingerprint(value)
+
+    def _remember(self, value, key):
+        try:
+            self._lineage[id(value)] = (weakref.ref(value), key)
+        except TypeError:
+            pass
+
+    def key(self, func, arguments, ignore=(), version=None):
+        parts = [function_fingerprint(func)]
+        if version is not None:
+            parts.append(f'version={version!r}')
+        for name, value in arguments.items():
+            if name not in ignore:
+                parts.append(f'{name}={self._fingerprint(value)}')
+        return hashlib.sha256('|'.join(parts).encode()).hexdigest()[:24]
+
+    def _find(self, name, key):
+        stem = os.path.join(self.cache_dir, f'{name}-{key}')
+        for extension in ('.parquet', '.npy', '.json', '.pkl'):
+            if os.path.exists(stem + extension):
+                return stem + extension
+        return None
+
+    def get_or_compute(self, func, *args, ignore=(), version=None, **kwargs):
+        """Return func(*args, **kwargs) from the cache, computing and storing it on a miss."""
+        bound = inspect.signature(func).bind(*args, **kwargs)
+        bound.apply_defaults()
+        key = self.key(func, bound.arguments, ignore, version)
+        name = func.__name__
+        counts = self.stats.setdefault(name, {'hits': 0, 'misses': 0})
+
+        path = self._find(name, key)
+        if path is not None:
+            counts['hits'] += 1
+            os.utime(path)
+            result = _read(path)
+        else:
+            counts['misses'] += 1
+            result = func(*args, **kwargs)
+            path = _write(result, os.path.join(self.cache_dir, f'{name}-{key}'))
+            self.evict(keep=path)
+            if isinstance(result, pd.Series):
+                result = _read(path)
+        self._remember(result, key)
+        return result
+
+    def cached(self, func, ignore=(), version=None):
+        """Wrap `func` so calls go through get_or_compute.
+
+        `ignore` names arguments left out of the key; bump `version` to
+        invalidate entries after editing code in another module that `func`
+        depends on (e.g. data_loader.merge_and_label).
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return self.get_or_compute(func, *args, ignore=ignore, version=version, **kwargs)
+        return wrapper
+
+    def evict(self, keep=None):
+        """Delete least recently used entries until the cache fits in max_bytes."""
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.is_file() and not entry.name.endswith('.tmp'):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                os.remove(path)
+                total -= size
+
+    def report(self):
+        """Hit/miss counts per function as a DataFrame."""
+        report = pd.DataFrame.from_dict(self.stats, orient='index', columns=['hits', 'misses'])
+        report.index.name = 'function'
+        return report
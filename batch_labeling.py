@@ -0,0 +1,129 @@
+import argparse
+import functools
+import pickle
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from data_loader import GENDER_CODES, HAS_PYARROW, MODEL_FEATURES
+
+SOFT_MODEL_PATH = './addict1_xgboost/soft_criteria_xgboost_model_best.pkl'
+HARD_MODEL_PATH = './addict1_xgboost/hard_criteria_xgboost_model_severely_mildly_best.pkl'
+
+ID_COLUMNS = ['user_id', 'month']
+PREDICTION_COLUMNS = ['preds_soft', 'preds_hard', 'preds_3_label_criteria']
+
+
+@functools.lru_cache(maxsize=None)
+def load_models(soft_model_path=SOFT_MODEL_PATH, hard_model_path=HARD_MODEL_PATH):
+    """Unpickle the soft and hard criteria boosters once per process."""
+    with open(soft_model_path, 'rb') as model_file:
+        soft_model = pickle.load(model_file)
+    with open(hard_model_path, 'rb') as model_file:
+        hard_model = pickle.load(model_file)
+    return soft_model, hard_model
+
+
+def feature_matrix(df):
+    """Return the MODEL_FEATURES columns as a float32 array, encoding string genders."""
+    features = df[MODEL_FEATURES]
+    if not pd.api.types.is_numeric_dtype(features['gender']):
+        features = features.assign(gender=features['gender'].map(GENDER_CODES))
+    return features.to_numpy(dtype=np.float32)
+
+
+def predict_probabilities(features, soft_model, hard_model, threshold=0.5):
+    """Soft and hard criteria probabilities for an (n, 13) feature array.
+
+    The hard model only scores rows whose soft probability reaches
+    `threshold`; the others get a NaN hard probability.
+    """
+    soft_probs = soft_model.predict(xgb.DMatrix(features, feature_names=MODEL_FEATURES))
+
+    hard_probs = np.full(len(features), np.nan, dtype=np.float32)
+    addicted = np.flatnonzero(soft_probs >= threshold)
+    if len(addicted):
+        hard_probs[addicted] = hard_model.predict(xgb.DMatrix(features[addicted], feature_names=MODEL_FEATURES))
+    return soft_probs, hard_probs
+
+
+def predict_labels(features, soft_model, hard_model, threshold=0.5):
+    """Run both models on an (n, 13) feature array.
+
+    The hard model only scores rows the soft model labels addicted, so
+    preds_3_label_criteria is simply preds_soft + preds_hard (0, 1 or 2).
+    Returns three int8 arrays: preds_soft, preds_hard, preds_3_label_criteria.
+    """
+    soft_probs, hard_probs = predict_probabilities(features, soft_model, hard_model, threshold)
+    preds_soft = (soft_probs >= threshold).astype(np.int8)
+    preds_hard = (hard_probs >= threshold).astype(np.int8)
+    return preds_soft, preds_hard, preds_soft + preds_hard
+
+
+def label_frame(df, soft_model=None, hard_model=None, survey_month=0):
+    """Label one chunk and return its id columns plus the three prediction columns.
+
+    For `survey_month` rows that carry survey answers (soft_criteria /
+    hard_criteria), the survey labels replace the predictions, as in
+    xgboost_models.ipynb.
+    """
+    if soft_model is None or hard_model is None:
+        soft_model, hard_model = load_models()
+    preds_soft, preds_hard, _ = predict_labels(feature_matrix(df), soft_model, hard_model)
+
+    if survey_month is not None and {'month', 'soft_criteria', 'hard_criteria'} <= set(df.columns):
+        survey = ((df['month'] == survey_month) & df['soft_criteria'].notna()).to_numpy()
+        preds_soft[survey] = df['soft_criteria'].to_numpy()[survey]
+        preds_hard[survey] = df['hard_criteria'].fillna(0).to_numpy()[survey]
+
+    labeled = df[[c for c in ID_COLUMNS if c in df.columns]].reset_index(drop=True)
+    labeled['preds_soft'] = preds_soft
+    labeled['preds_hard'] = preds_hard
+    labeled['preds_3_label_criteria'] = preds_soft + preds_hard
+    return labeled
+
+
+def label_file(input_path, output_path, chunksize=1_000_000, passthrough=(),
+               soft_model_path=SOFT_MODEL_PATH, hard_model_path=HARD_MODEL_PATH):
+    """Stream a feature CSV through both models and append labels to a Parquet file.
+
+    Only the id, feature, survey and `passthrough` columns are read, one chunk of
+    `chunksize` rows at a time; each labeled chunk is written as its own row
+    group, so memory stays bounded by the chunk size. Returns the rows labeled.
+    """
+    if not HAS_PYARROW:
+        raise ImportError('label_file requires pyarrow for the Parquet output')
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    soft_model, hard_model = load_models(soft_model_path, hard_model_path)
+    wanted = set(ID_COLUMNS + MODEL_FEATURES + ['soft_criteria', 'hard_criteria'] + list(passthrough))
+
+    writer, rows = None, 0
+    try:
+        for chunk in pd.read_csv(input_path, usecols=lambda column: column in wanted, chunksize=chunksize):
+            labeled = label_frame(chunk, soft_model, hard_model)
+            for column in passthrough:
+                labeled[column] = chunk[column].to_numpy()
+            table = pa.Table.from_pandas(labeled, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, table.schema)
+            writer.write_table(table)
+            rows += len(labeled)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Label user-months with the soft and hard criteria models.')
+    parser.add_argument('input', help='CSV with user_id, month and the model feature columns')
+    parser.add_argument('output', help='Parquet file to write')
+    parser.add_argument('--chunksize', type=int, default=1_000_000)
+    parser.add_argument('--passthrough', nargs='*', default=[], help='extra input columns to copy to the output')
+    args = parser.parse_args()
+
+    num_rows = label_file(args.input, args.output, chunksize=args.chunksize, passthrough=args.passthrough)
+    print(f'labeled {num_rows} rows -> {args.output}')
@@ -0,0 +1,335 @@
+import argparse
+import datetime
+import json
+import os
+import pickle
+import platform
+import resource
+import subprocess
+import tempfile
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from data_loader import ADDICTION_LABELS, GENDER_CODES, HOUR_COLUMNS, MODEL_FEATURES, merge_and_label
+from instrumentation import current_rss
+
+SAMPLE_PATH = 'dataset.csv'
+HISTORY_PATH = 'benchmark_history.json'
+NUM_MONTHS = 10
+
+STAGES = ['load_and_merge_data', 'calculate_coverage_ratios', 'calculate_filter_bubble_with_bootstrap',
+          'calculate_filter_bubble_parallel', 'cv_training', 'batch_labeling']
+
+# dataset.csv stores watch time in minutes (*_min); the model features are in seconds
+MINUTE_FEATURES = ['watch_all_per_day', 'midnight_wt', 'morning_wt', 'noon_wt', 'afternoon_wt', 'evening_wt']
+
+
+### Synthetic data ###
+
+def generate_synthetic_tables(num_users, sample_path=SAMPLE_PATH, seed=0):
+    """Build monthly_user_data / addiction_data frames for `num_users` users x 10 months.
+
+    Feature rows are resampled from dataset.csv and labels follow its label mix.
+    dataset.csv has no level coverage columns, so they are derived from
+    category_count_unique with per-level random shares.
+    """
+    rng = np.random.default_rng(seed)
+    sample = pd.read_csv(sample_path)
+    num_rows = num_users * NUM_MONTHS
+
+    rows = rng.integers(0, len(sample), num_rows)
+    user_id = np.repeat(np.arange(num_users, dtype=np.int32), NUM_MONTHS)
+    window_id = np.tile(np.arange(NUM_MONTHS, dtype=np.int8), num_users)
+
+    monthly_user_data = pd.DataFrame({'user_id': user_id, 'window_id': window_id})
+    categories = sample['category_count_unique'].to_numpy(dtype=np.float32)[rows]
+    for level, share in zip((1, 2, 3), (0.05, 0.3, 1.0)):
+        coverage = np.ceil(categories * share * rng.uniform(0.5, 1.0, num_rows)).astype(np.float32)
+        monthly_user_data[f'level_{level}_coverage'] = coverage
+        monthly_user_data[f'level_{level}_coverage_norm'] = coverage / coverage.max()
+    monthly_user_data[HOUR_COLUMNS] = sample[HOUR_COLUMNS].to_numpy(dtype=np.float32)[rows]
+    monthly_user_data['month_chronological_order'] = window_id + 1
+
+    label_shares = sample['preds_3_label_criteria_label'].value_counts(normalize=True).reindex(ADDICTION_LABELS).fillna(0)
+    addiction_status = pd.DataFrame({
+        'user_id': user_id,
+        'month_chronological_order': (window_id + 1).astype(np.int8),
+        'preds_3_label_criteria': rng.choice(3, size=num_rows, p=label_shares.to_numpy()).astype(np.int8),
+    })
+
+    # Shuffle so neither side arrives pre-sorted
+    return (monthly_user_data.sample(frac=1, random_state=seed).reset_index(drop=True),
+            addiction_status.sample(frac=1, random_state=seed + 1).reset_index(drop=True))
+
+
+def generate_synthetic_dataset(num_rows, sample_path=SAMPLE_PATH, seed=0):
+    """Labeled model-feature rows shaped like dataset.csv, for the training and labeling stages.
+
+    Rows are resampled from dataset.csv with +-10% multiplicative jitter on the
+    continuous features, so the feature distributions and the soft / hard label
+    mix follow the sample. soft_criteria / hard_criteria are taken from the
+    sampled row's labels.
+    """
+    rng = np.random.default_rng(seed)
+    sample = pd.read_csv(sample_path)
+    for feature in MINUTE_FEATURES:
+        sample[feature] = sample[f'{feature}_min'] * 60
+    sample['pid_SHUA_all_per_day'] = sample['pid_exposed_all_per_day']
+    sample['gender'] = sample['gender'].map(GENDER_CODES)
+
+    rows = rng.integers(0, len(sample), num_rows)
+    dataset = pd.DataFrame({
+        'user_id': np.arange(num_rows, dtype=np.int64) // NUM_MONTHS,
+        'month': (np.arange(num_rows) % NUM_MONTHS).astype(np.int8),
+    })
+    for feature in MODEL_FEATURES:
+        values = sample[feature].to_numpy(dtype=np.float32)[rows]
+        if feature not in ('age', 'gender'):
+            values = values * rng.uniform(0.9, 1.1, num_rows).astype(np.float32)
+        dataset[feature] = values
+    dataset['soft_criteria'] = (sample['preds_soft_label'] == 'Addicted').to_numpy(dtype=np.int8)[rows]
+    dataset['hard_criteria'] = (sample['preds_3_label_criteria_label'] == 'Severely Addicted').to_numpy(dtype=np.int8)[rows]
+    return dataset
+
+
+### Stages ###
+
+def legacy_merge_and_label(monthly_user_data, addiction_status):
+    """The original load_and_merge_data body: unindexed pd.merge plus a row-wise apply."""
+    merged_df = pd.merge(
+        monthly_user_data,
+        addiction_status,
+        on=['user_id', 'month_chronological_order'],
+        how='inner'
+    )
+
+    def get_addiction_group(row):
+        if row['preds_3_label_criteria'] == 2:
+            return 'Hard Addicted'
+        elif row['preds_3_label_criteria'] == 1:
+            return 'Soft Addicted'
+        else:
+            return 'Non-Addicted'
+
+    merged_df['addiction_group'] = merged_df.apply(get_addiction_group, axis=1)
+    return merged_df
+
+
+def time_call(func, *args, repeat=1):
+    """Return (best wall time in seconds, result of the last call)."""
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def benchmark_merge(num_users, repeat=1):
+    """Time the legacy merge/label path against merge_and_label and check they agree."""
+    monthly_user_data, addiction_status = generate_synthetic_tables(num_users)
+    legacy_time, legacy = time_call(legacy_merge_and_label, monthly_user_data, addiction_status, repeat=repeat)
+    new_time, merged = time_call(merge_and_label, monthly_user_data, addiction_status, repeat=repeat)
+
+    keys = ['user_id', 'month_chronological_order']
+    legacy = legacy.sort_values(keys).reset_index(drop=True)
+    assert (legacy['addiction_group'].to_numpy() == merged['addiction_group'].astype(str).to_numpy()).all()
+    assert np.allclose(legacy['level_1_coverage'], merged['level_1_coverage'])
+
+    return {
+        'rows': len(merged),
+        'legacy_seconds': legacy_time,
+        'merge_and_label_seconds': new_time,
+        'speedup': legacy_time / new_time,
+    }
+
+
+### Stage suite ###
+
+def measure(func, *args, interval=0.01, **kwargs):
+    """Run func once and return (metrics, result).
+
+    metrics holds the wall time and the peak RSS seen by a sampling thread
+    during the call (falling back to the process's lifetime peak without /proc).
+    """
+    peak = [current_rss()]
+    done = threading.Event()
+
+    def sample():
+        while not done.wait(interval):
+            peak[0] = max(peak[0], current_rss())
+
+    sampler = threading.Thread(target=sample, daemon=True)
+    sampler.start()
+    start = time.perf_counter()
+    try:
+        result = func(*args, **kwargs)
+    finally:
+        seconds = time.perf_counter() - start
+        done.set()
+        sampler.join()
+    peak_rss = max(peak[0], current_rss()) or resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return {'seconds': seconds, 'peak_rss_mb': peak_rss / 1024 ** 2}, result
+
+
+def run_stages(num_rows, stages=STAGES, num_bootstrap=100, seed=0, workdir=None):
+    """Time each pipeline stage on `num_rows` synthetic user-months.
+
+    Returns one dict per stage with rows, seconds, peak RSS and rows per second.
+    Inputs are written as CSV to `workdir` (a temporary directory by default)
+    so load_and_merge_data and batch labeling include parsing.
+    """
+    # Imported here so the merge benchmark does not need matplotlib / xgboost
+    from batch_labeling import label_file
+    from coverage_computations_and_plotting import calculate_coverage_ratios, load_and_merge_data
+    from filter_bubble_computations_and_plotting import (calculate_filter_bubble_parallel,
+                                                         calculate_filter_bubble_with_bootstrap, calculate_quantiles)
+    from model_training import train_criteria_model
+
+    num_users = max(1, num_rows // NUM_MONTHS)
+    results = []
+
+    def record(stage, metrics, rows):
+        metrics.update(stage=stage, rows=rows, rows_per_second=rows / metrics['seconds'] if metrics['seconds'] else None)
+        results.append(metrics)
+        print(f"{stage:<40} rows={rows:>11,}  {metrics['seconds']:8.3f}s  "
+              f"peak_rss={metrics['peak_rss_mb']:8.1f}MB  {metrics['rows_per_second'] or 0:>12,.0f} rows/s")
+
+    with tempfile.TemporaryDirectory(dir=workdir) as tmp:
+        merged = None
+        if any(stage in stages for stage in STAGES[:4]):
+            monthly_user_data, addiction_status = generate_synthetic_tables(num_users, seed=seed)
+            monthly_path = os.path.join(tmp, 'monthly_user_data.csv')
+            addiction_path = os.path.join(tmp, 'addiction_data.csv')
+            monthly_user_data.drop(columns='month_chronological_order').to_csv(monthly_path, index=False)
+            addiction_status.to_csv(addiction_path, index=False)
+            del monthly_user_data, addiction_status
+
+            metrics, merged = measure(load_and_merge_data, monthly_path, addiction_path,
+                                      cache_dir=os.path.join(tmp, 'parquet'))
+            if 'load_and_merge_data' in stages:
+                record('load_and_merge_data', metrics, len(merged))
+
+        if 'calculate_coverage_ratios' in stages:
+            metrics, _ = measure(calculate_coverage_ratios, merged)
+            record('calculate_coverage_ratios', metrics, len(merged))
+
+        if 'calculate_filter_bubble_with_bootstrap' in stages:
+            quantiles = calculate_quantiles(merged)
+            group_size = int(merged.groupby('addiction_group', observed=True)['user_id'].nunique().min())
+            metrics, _ = measure(calculate_filter_bubble_with_bootstrap, merged, 'All', quantiles, group_size,
+                                 num_bootstrap=num_bootstrap, seed=seed)
+            record('calculate_filter_bubble_with_bootstrap', metrics, len(merged))
+
+        if 'calculate_filter_bubble_parallel' in stages:
+            metrics, _ = measure(calculate_filter_bubble_parallel, merged, num_bootstrap=num_bootstrap, seed=seed)
+            record('calculate_filter_bubble_parallel', metrics, len(merged))
+        del merged
+
+        if 'cv_training' in stages or 'batch_labeling' in stages:
+            dataset = generate_synthetic_dataset(num_rows, seed=seed)
+            metrics, soft_result = measure(train_criteria_model, dataset, 'soft_criteria')
+            if 'cv_training' in stages:
+                record('cv_training', metrics, len(dataset))
+
+            if 'batch_labeling' in stages:
+                hard_result = train_criteria_model(dataset, 'hard_criteria')
+                model_paths = []
+                for name, result in [('soft', soft_result), ('hard', hard_result)]:
+                    model_paths.append(os.path.join(tmp, f'{name}.pkl'))
+                    with open(model_paths[-1], 'wb') as model_file:
+                        pickle.dump(result.boosters[0], model_file)
+                dataset_path = os.path.join(tmp, 'dataset.csv')
+                dataset.to_csv(dataset_path, index=False)
+                metrics, num_labeled = measure(label_file, dataset_path, os.path.join(tmp, 'labels.parquet'),
+                                               soft_model_path=model_paths[0], hard_model_path=model_paths[1])
+                record('batch_labeling', metrics, num_labeled)
+
+    return results
+
+
+### History ###
+
+def run_metadata():
+    """Environment details stored with every run so results are comparable."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'commit': commit,
+        'host': platform.node(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+    }
+
+
+def load_history(path=HISTORY_PATH):
+    if os.path.exists(path):
+        with open(path) as history_file:
+            return json.load(history_file)
+    return []
+
+
+def append_history(run, path=HISTORY_PATH):
+    """Add a run to the JSON history file and return the previous runs."""
+    history = load_history(path)
+    with open(path + '.tmp', 'w') as history_file:
+        json.dump(history + [run], history_file, indent=1)
+    os.replace(path + '.tmp', path)
+    return history
+
+
+def compare_to_history(results, history, threshold=1.2):
+    """Compare each stage with the latest earlier run at the same row count on the same host.
+
+    Returns (stage, rows, previous seconds, seconds, ratio) tuples for stages
+    that got slower by more than `threshold`x.
+    """
+    host = platform.node()
+    previous = {}
+    for run in history:
+        if run.get('host') == host:
+            for result in run['results']:
+                previous[(result['stage'], result['rows'])] = result['seconds']
+    regressions = []
+    for result in results:
+        before = previous.get((result['stage'], result['rows']))
+        if before and result['seconds'] > threshold * before:
+            regressions.append((result['stage'], result['rows'], before, result['seconds'],
+                                result['seconds'] / before))
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Benchmark the analysis pipeline on synthetic data.')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10_000, 100_000],
+                        help='synthetic user-months per run (10^4 - 10^7)')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--num-bootstrap', type=int, default=100)
+    parser.add_argument('--history', default=HISTORY_PATH, help='JSON file runs are appended to')
+    parser.add_argument('--merge-users', type=int, nargs='*', default=[],
+                        help='also compare merge_and_label with the legacy merge for these user counts')
+    parser.add_argument('--repeat', type=int, default=1)
+    args = parser.parse_args()
+
+    for num_users in args.merge_users:
+        result = benchmark_merge(num_users, repeat=args.repeat)
+        print(f"merge_and_label  rows={result['rows']:>10,}  legacy={result['legacy_seconds']:.3f}s  "
+              f"new={result['merge_and_label_seconds']:.3f}s  speedup={result['speedup']:.1f}x")
+
+    results = []
+    for num_rows in args.rows:
+        results += run_stages(num_rows, stages=args.stages, num_bootstrap=args.num_bootstrap)
+
+    run = dict(run_metadata(), num_bootstrap=args.num_bootstrap, results=results)
+    history = append_history(run, args.history)
+    for stage, rows, before, seconds, ratio in compare_to_history(results, history):
+        print(f'REGRESSION {stage} rows={rows:,}: {before:.3f}s -> {seconds:.3f}s ({ratio:.2f}x)')
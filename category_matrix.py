@@ -0,0 +1,266 @@
+import argparse
+import glob
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+from event_log_aggregation import NUM_MONTHS, add_month, build_root_interactions
+from instrumentation import instrument
+
+CATEGORY_BANK_PATH = 'data/video_category_IDtoName_bank.csv'
+# Optional hierarchy columns of the bank (one id per category at each level); levels missing from the bank are skipped
+CATEGORY_LEVEL_COLUMNS = {1: 'level_1_id', 2: 'level_2_id', 3: 'level_3_id'}
+
+
+def load_category_bank(path=CATEGORY_BANK_PATH):
+    """Read the category id -> name bank with int64 `root_id` as in the notebook."""
+    bank = pd.read_csv(path, encoding='utf-8')
+    bank['root_id'] = bank['root_id'].astype(np.int64)
+    return bank.drop_duplicates('root_id').reset_index(drop=True)
+
+
+def _row_key(user_id, month):
+    return (np.asarray(user_id, dtype=np.int64) << 8) | np.asarray(month, dtype=np.int64)
+
+
+### Matrix ###
+
+@dataclass
+class InteractionMatrix:
+    """User-month x category interaction counts in CSR form.
+
+    `interactions[i, j]` is the number of interactions of row i (a user-month,
+    see `rows`) with category `categories[j]`, summed over days; `active_days`
+    has the same layout and counts the days with at least one interaction,
+    i.e. the rows of the notebook's long (user_id, root_id, p_date) table.
+    """
+    interactions: sparse.csr_matrix
+    active_days: sparse.csr_matrix
+    rows: pd.DataFrame
+    categories: np.ndarray
+    category_names: np.ndarray
+
+    @property
+    def shape(self):
+        return self.interactions.shape
+
+    def labels(self, labeled, columns, month_column='month'):
+        """Look up `columns` of a per user-month table for every row (NaN where it has no row).
+
+        This replaces the notebook's left merge on (user_id, month); with
+        month_column='month_chronological_order' the rows' chronological
+        month is used instead.
+        """
+        keys = _row_key(labeled['user_id'], labeled[month_column])
+        order = np.argsort(keys, kind='stable')
+        sorted_keys = keys[order]
+        row_keys = _row_key(self.rows['user_id'], self.rows[month_column])
+        position = np.minimum(np.searchsorted(sorted_keys, row_keys), max(len(sorted_keys) - 1, 0))
+        found = sorted_keys[position] == row_keys if len(sorted_keys) else np.zeros(len(row_keys), dtype=bool)
+        result = {}
+        for column in [columns] if isinstance(columns, str) else columns:
+            values = labeled[column].to_numpy(dtype=np.float64)[order][position]
+            result[column] = np.where(found, values, np.nan)
+        return pd.DataFrame(result)
+
+
+def _coo_parts(interactions):
+    """(row keys, category ids, interaction counts) of a long (user_id, root_id, month) table."""
+    return (_row_key(interactions['user_id'], interactions['month']),
+            interactions['root_id'].to_numpy(dtype=np.int64),
+            interactions['num_interactions'].to_numpy(dtype=np.float64))
+
+
+def _assemble(row_keys, category_ids, values, bank=None):
+    """Build the CSR matrices; duplicate (row, category) entries (one per day) are summed."""
+    unique_keys, row_index = np.unique(row_keys, return_inverse=True)
+    categories = np.unique(category_ids)
+    if bank is not None:
+        categories = np.union1d(bank['root_id'].to_numpy(dtype=np.int64), categories)
+    column_index = np.searchsorted(categories, category_ids)
+
+    shape = (len(unique_keys), len(categories))
+    interactions = sparse.csr_matrix((values, (row_index, column_index)), shape=shape)
+    active_days = sparse.csr_matrix(((values > 0).astype(np.float64), (row_index, column_index)), shape=shape)
+    for matrix in (interactions, active_days):
+        matrix.sum_duplicates()
+        matrix.eliminate_zeros()
+
+    month = (unique_keys & 0xFF).astype(np.int8)
+    rows = pd.DataFrame({'user_id': unique_keys >> 8, 'month': month,
+                         'month_chronological_order': (NUM_MONTHS - month).astype(np.int8)})
+    names = np.full(len(categories), None, dtype=object)
+    if bank is not None and 'root_name' in bank.columns:
+        position = np.searchsorted(categories, bank['root_id'].to_numpy(dtype=np.int64))
+        names[position] = bank['root_name'].to_numpy()
+    return InteractionMatrix(interactions, active_days, rows, categories, names)
+
+
+@instrument
+def build_interaction_matrix(interactions, bank=None):
+    """CSR matrix from a long (user_id, root_id, month, num_interactions) table.
+
+    `interactions` is the output of build_root_interactions / load_store (one
+    row per user, category and day). With a `bank`, every bank category gets a
+    column even if nobody interacted with it, so coverage denominators are
+    the full category set.
+    """
+    return _assemble(*_coo_parts(interactions), bank=bank)
+
+
+def interaction_matrix_from_store(store_dir, bank=None, start=None, end=None):
+    """Build the matrix from the day-partitioned interaction store one partition at a time.
+
+    Each day is reduced to three compact arrays before the next one is read, so
+    the long table is never materialized for the whole period.
+    """
+    parts = []
+    for path in sorted(glob.glob(os.path.join(store_dir, 'p_date=*.parquet'))):
+        p_date = int(os.path.basename(path)[len('p_date='):-len('.parquet')])
+        if (start is None or p_date >= start) and (end is None or p_date <= end):
+            day = add_month(pd.read_parquet(path))
+            if len(day):
+                parts.append(_coo_parts(day))
+    if not parts:
+        return _assemble(np.empty(0, np.int64), np.empty(0, np.int64), np.empty(0), bank=bank)
+    return _assemble(*(np.concatenate(arrays) for arrays in zip(*parts)), bank=bank)
+
+
+### Coverage and diversity ###
+
+def level_matrix(categories, bank, level_column):
+    """(categories x level groups) 0/1 matrix mapping every category to its group at one level.
+
+    Categories missing from the bank (or without a group) map to nothing, and
+    bank categories that are not matrix columns are skipped; the group count
+    still covers the whole bank.
+    Returns (matrix, number of groups at that level).
+    """
+    groups = bank.dropna(subset=[level_column])
+    group_ids, group_index = np.unique(groups[level_column].to_numpy(), return_inverse=True)
+    root_ids = groups['root_id'].to_numpy(dtype=np.int64)
+    position = np.minimum(np.searchsorted(categories, root_ids), max(len(categories) - 1, 0))
+    found = categories[position] == root_ids if len(categories) else np.zeros(len(root_ids), dtype=bool)
+    matrix = sparse.csr_matrix((np.ones(found.sum()), (position[found], group_index[found])),
+                               shape=(len(categories), len(group_ids)))
+    return matrix, len(group_ids)
+
+
+def unique_category_counts(matrix):
+    """Number of distinct categories per row (stored entries of the CSR matrix)."""
+    return np.diff(matrix.interactions.indptr)
+
+
+@instrument
+def category_coverage(matrix, bank=None, levels=CATEGORY_LEVEL_COLUMNS):
+    """Per user-month category_count_unique and level_k_coverage.
+
+    level_k_coverage is the share of the level-k groups of the bank the user
+    touched in that month: the touched-category indicator times the level's
+    category -> group matrix, counted per row. Without a bank (or without
+    hierarchy columns in it) only the leaf coverage over all matrix columns is
+    returned, as `category_coverage`.
+    """
+    touched = matrix.interactions.copy()
+    touched.data = np.ones_like(touched.data)
+    result = matrix.rows.copy()
+    result['category_count_unique'] = unique_category_counts(matrix)
+    result['category_coverage'] = result['category_count_unique'] / max(matrix.shape[1], 1)
+    if bank is not None:
+        for level, column in levels.items():
+            if column in bank.columns:
+                mapping, num_groups = level_matrix(matrix.categories, bank, column)
+                result[f'level_{level}_coverage'] = np.diff((touched @ mapping).tocsr().indptr) / max(num_groups, 1)
+    return result
+
+
+@instrument
+def category_diversity(matrix):
+    """Per user-month Shannon entropy (nats) and Gini-Simpson index of interaction shares.
+
+    Shares are computed on the stored entries only (p = x / row sum), so the
+    cost is linear in the number of non-zeros. Rows without interactions get 0.
+    """
+    counts = matrix.interactions
+    totals = np.asarray(counts.sum(axis=1)).ravel()
+    row_of_entry = np.repeat(np.arange(counts.shape[0]), np.diff(counts.indptr))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        shares = counts.data / totals[row_of_entry]
+    entropy = np.bincount(row_of_entry, weights=-shares * np.log(shares), minlength=counts.shape[0])
+    concentration = np.bincount(row_of_entry, weights=shares ** 2, minlength=counts.shape[0])
+
+    result = matrix.rows.copy()
+    result['num_interactions'] = totals
+    result['entropy'] = entropy
+    num_categories = unique_category_counts(matrix)
+    result['normalized_entropy'] = np.where(num_categories > 1, entropy / np.log(np.maximum(num_categories, 2)), 0.0)
+    result['gini_simpson'] = np.where(totals > 0, 1 - concentration, 0.0)
+    return result
+
+
+### Group rankings ###
+
+def group_indicator(groups):
+    """(groups x rows) 0/1 CSR matrix and the group values; NaN rows belong to no group."""
+    groups = np.asarray(groups, dtype=np.float64)
+    labeled = np.flatnonzero(~np.isnan(groups))
+    values, group_index = np.unique(groups[labeled], return_inverse=True)
+    indicator = sparse.csr_matrix((np.ones(len(labeled)), (group_index, labeled)), shape=(len(values), len(groups)))
+    return indicator, values
+
+
+@instrument
+def group_category_stats(matrix, groups):
+    """Per (group, category) interactions, active days, user-months and interactions per active day.
+
+    One sparse product per quantity replaces the notebook's per-label
+    groupby('root_name')['num_interactions'].agg(['sum', 'count']);
+    interactions_per_day is its 'divided' column.
+    """
+    indicator, values = group_indicator(groups)
+    touched = matrix.interactions.copy()
+    touched.data = np.ones_like(touched.data)
+    interactions = (indicator @ matrix.interactions).tocoo()
+    active_days = (indicator @ matrix.active_days).tocsr()
+    user_months = (indicator @ touched).tocsr()
+
+    row, column = interactions.row, interactions.col
+    stats = pd.DataFrame({
+        'group': values[row],
+        'root_id': matrix.categories[column],
+        'root_name': matrix.category_names[column],
+        'interactions': interactions.data,
+        'active_days': np.asarray(active_days[row, column]).ravel(),
+        'user_months': np.asarray(user_months[row, column]).ravel(),
+    })
+    stats['interactions_per_day'] = stats['interactions'] / stats['active_days']
+    stats['user_month_share'] = stats['user_months'] / np.asarray(indicator.sum(axis=1)).ravel()[row]
+    return stats.sort_values(['group', 'root_id']).reset_index(drop=True)
+
+
+def top_categories(stats, k=5, by='interactions_per_day'):
+    """The `k` categories with the highest `by` in every group of group_category_stats."""
+    return (stats.sort_values(['group', by], ascending=[True, False], kind='stable')
+            .groupby('group', sort=False).head(k).reset_index(drop=True))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Category coverage, diversity and top categories per label.')
+    parser.add_argument('log', help='ks_output.csv / user_root.csv style event log')
+    parser.add_argument('--labels', required=True, help='per user-month labels, e.g. the batch_labeling output')
+    parser.add_argument('--label-column', default='preds_soft')
+    parser.add_argument('--month-column', default='month_chronological_order')
+    parser.add_argument('--bank', default=CATEGORY_BANK_PATH)
+    parser.add_argument('--output', default='category_analytics.csv')
+    args = parser.parse_args()
+
+    bank = load_category_bank(args.bank) if os.path.exists(args.bank) else None
+    matrix = build_interaction_matrix(build_root_interactions(args.log), bank=bank)
+    analytics = category_coverage(matrix, bank).merge(category_diversity(matrix), on=list(matrix.rows.columns))
+    labels = matrix.labels(pd.read_csv(args.labels), args.label_column, month_column=args.month_column)
+    analytics[args.label_column] = labels[args.label_column]
+    analytics.to_csv(args.output, index=False)
+    print(top_categories(group_category_stats(matrix, labels[args.label_column])).to_string(index=False))
@@ -1,41 +1,39 @@
+import os
+
+import numpy as np
 import pandas as pd
 import matplotlib.pyplot as plt
 from matplotlib.lines import Line2D
 
+from analysis_cache import AnalysisCache
+from data_loader import PARQUET_CACHE_DIR, load_addiction_data, load_monthly_user_data, merge_and_label
+from figure_rendering import FigureSpec, render_figures
+from instrumentation import instrument
+
+MONTHLY_USER_DATA_PATH = 'path/to/monthly_user_data.csv'
+ADDICTION_DATA_PATH = 'path/to/addiction_data.csv'
+
+COVERAGE_NORM_COLUMNS = ['level_1_coverage_norm', 'level_2_coverage_norm', 'level_3_coverage_norm']
+
 # Function to load and preprocess data
-def load_and_merge_data():
+@instrument
+def load_and_merge_data(monthly_user_data_path=MONTHLY_USER_DATA_PATH, addiction_data_path=ADDICTION_DATA_PATH,
+                        cache_dir=PARQUET_CACHE_DIR):
     """Load datasets and merge them based on user_id and month."""
-    monthly_user_data = pd.read_csv('path/to/monthly_user_data.csv')
-    addiction_status = pd.read_csv('path/to/addiction_data.csv')
-
-    # Add chronological month order
-    monthly_user_data['month_chronological_order'] = monthly_user_data['window_id'] + 1
-
-    # Merge data on user_id and month
-    merged_df = pd.merge(
-        monthly_user_data,
-        addiction_status,
-        on=['user_id', 'month_chronological_order'],
-        how='inner'
-    )
-
-    # Add addiction group labels
-    def get_addiction_group(row):
-        if row['preds_3_label_criteria'] == 2:
-            return 'Hard Addicted'
-        elif row['preds_3_label_criteria'] == 1:
-            return 'Soft Addicted'
-        else:
-            return 'Non-Addicted'
-
-    merged_df['addiction_group'] = merged_df.apply(get_addiction_group, axis=1)
+    # Typed, column-pruned loads (also adds chronological month order)
+    monthly_user_data = load_monthly_user_data(monthly_user_data_path, cache_dir=cache_dir)
+    addiction_status = load_addiction_data(addiction_data_path, cache_dir=cache_dir)
+
+    # Sorted key join plus a vectorized addiction_group lookup
+    merged_df = merge_and_label(monthly_user_data, addiction_status)
 
     return merged_df
 
 # Function to calculate coverage ratios
+@instrument
 def calculate_coverage_ratios(merged_df):
     """Calculate average coverage ratios and user counts per month and group."""
-    coverage_df = merged_df.groupby(['month_chronological_order', 'addiction_group']).agg({
+    coverage_df = merged_df.groupby(['month_chronological_order', 'addiction_group'], observed=True).agg({
         'level_1_coverage_norm': 'mean',
         'level_2_coverage_norm': 'mean',
         'level_3_coverage_norm': 'mean',
@@ -52,127 +50,111 @@ def calculate_coverage_ratios(merged_df):
 
     return coverage_df
 
-# Function to plot bootstrap coverage ratios (Figure 1)
-def plot_bootstrap_coverage(bootstrap_df):
-    """Plot bootstrap-normalized coverage ratios for each level and group."""
-    bootstrap_df['addiction_group'] = bootstrap_df['addiction_group'].replace(
-        {'Non-Addicted': 'Non-Addicted',
-         'Soft Addicted': 'Mildly Addicted',
-         'Hard Addicted': 'Severely Addicted'}
-    )
-    group_order = ['Non-Addicted', 'Mildly Addicted', 'Severely Addicted']
-    colors = ['#22974F', '#25B1E8', '#E8335A']
-    linestyles = [':', '--', '-']
-    alphas = [0.35, 0.55, 0.9]
-
-    # Pivot data for plotting
-    bootstrap_pivot = bootstrap_df.pivot(index='month_chronological_order', 
-                                         columns='addiction_group',
-                                         values=['level_1_coverage_normalized',
-                                                 'level_2_coverage_normalized',
-                                                 'level_3_coverage_normalized'])
-
-    fig, ax = plt.subplots(figsize=(9, 6))
-    for i, level in enumerate(['level_1_coverage_normalized', 
-                               'level_2_coverage_normalized', 
-                               'level_3_coverage_normalized']):
-        for group in group_order:
-            ax.plot(
-                bootstrap_pivot.index,
-                bootstrap_pivot[level][group],
-                label=f'L{i + 1} {group}',
-                color=colors[i],
-                linestyle=linestyles[group_order.index(group)],
-                linewidth=4,
-                alpha=alphas[group_order.index(group)]
-            )
-    
-    # Customize and add legends
-    ax.set_xlabel('Month', fontsize=24)
-    ax.set_ylabel('Coverage Ratio', fontsize=24)
-    ax.tick_params(axis='y', labelsize=22)
-    ax.tick_params(axis='x', labelsize=22)
-    ax.spines[['right', 'top']].set_visible(False)
-
-    # Custom legends
-    color_handles = [Line2D([0], [0], color=color, lw=4, label=f'L{i + 1}') for i, color in enumerate(colors)]
-    linestyle_handles = [Line2D([0], [0], color='black', linestyle=linestyle, lw=4, label=label) 
-                         for linestyle, label in zip(linestyles, group_order)]
-
-    color_legend = ax.legend(handles=color_handles, title='Levels', loc='upper left', fontsize=18, title_fontsize=18)
-    ax.add_artist(color_legend)
-    ax.legend(handles=linestyle_handles, title='Groups', loc='upper right', fontsize=18, title_fontsize=18)
-
-    plt.tight_layout()
-    plt.show()
-
-# Function to plot average bootstrap coverage per group (Figure 2)
-def plot_average_coverage(bootstrap_df):
-    """Plot average coverage across levels for each addiction group."""
-    bootstrap_df['average_coverage_normalized'] = (
-        bootstrap_df[['level_1_coverage_normalized', 
-                      'level_2_coverage_normalized', 
-                      'level_3_coverage_normalized']].mean(axis=1)
-    )
-    group_order = ['Non-Addicted', 'Mildly Addicted', 'Severely Addicted']
+# Function to compute bootstrap-normalized coverage ratios
+@instrument
+def bootstrap_normalized_coverage(merged_df, group_size=None, num_bootstrap=1000, seed=42, ci=0.95,
+                                  max_batch_elements=2**22):
+    """Bootstrap mean coverage per month and group, resampling every group to the same size.
+
+    `group_size` defaults to the smallest group's unique user count. Replicates are
+    drawn as seeded index matrices in batches of at most `max_batch_elements`
+    sampled rows, and reduced to the mean plus percentile CI columns.
+    """
+    rng = np.random.default_rng(seed)
+    if group_size is None:
+        group_size = merged_df.groupby('addiction_group', observed=True)['user_id'].nunique().min()
+    batch_size = max(1, max_batch_elements // group_size)
+    percentiles = [50 * (1 - ci), 50 * (1 + ci)]
+
+    coverage = merged_df[COVERAGE_NORM_COLUMNS].to_numpy(dtype=np.float64)
+    rows = []
+    for (month, group), index in merged_df.groupby(['month_chronological_order', 'addiction_group'], observed=True).indices.items():
+        values = coverage[index]
+
+        # Draw bootstrap replicates in batches of index matrices
+        means = np.empty((num_bootstrap, len(COVERAGE_NORM_COLUMNS)))
+        for start in range(0, num_bootstrap, batch_size):
+            stop = min(start + batch_size, num_bootstrap)
+            sample = rng.integers(0, len(values), size=(stop - start, group_size))
+            means[start:stop] = values[sample].mean(axis=1)
+
+        lower, upper = np.percentile(means, percentiles, axis=0)
+        row = {'month_chronological_order': month, 'addiction_group': group}
+        for i in range(3):
+            row[f'level_{i + 1}_coverage_normalized'] = means[:, i].mean()
+            row[f'level_{i + 1}_coverage_normalized_ci_lower'] = lower[i]
+            row[f'level_{i + 1}_coverage_normalized_ci_upper'] = upper[i]
+        rows.append(row)
+
+    return pd.DataFrame(rows).sort_values(['month_chronological_order', 'addiction_group']).reset_index(drop=True)
+
+def load_or_compute_bootstrap_coverage(monthly_user_data_path=MONTHLY_USER_DATA_PATH,
+                                       addiction_data_path=ADDICTION_DATA_PATH,
+                                       cache=None, **bootstrap_kwargs):
+    """Return the bootstrap-normalized coverage table, reusing cached results when possible.
+
+    Both the merged table and the bootstrap are cached by an AnalysisCache keyed
+    on the input file contents and the bootstrap parameters, so changing either
+    recomputes only what depends on it.
+    """
+    cache = cache or AnalysisCache()
+    merged_df = cache.cached(load_and_merge_data)(monthly_user_data_path, addiction_data_path)
+    return cache.cached(bootstrap_normalized_coverage)(merged_df, **bootstrap_kwargs)
+
+### Shared pivots ###
+
+LEVEL_COLUMNS = ['level_1_coverage_normalized', 'level_2_coverage_normalized', 'level_3_coverage_normalized']
+GROUP_DISPLAY_NAMES = {'Non-Addicted': 'Non-Addicted',
+                       'Soft Addicted': 'Mildly Addicted',
+                       'Hard Addicted': 'Severely Addicted'}
 
-    # Pivot data for plotting
-    average_pivot = bootstrap_df.pivot(index='month_chronological_order', 
-                                       columns='addiction_group',
-                                       values='average_coverage_normalized')
+def preprocess_combined_addicted_group(bootstrap_df):
+    """Combine 'Mildly Addicted' and 'Severely Addicted' into one group called 'Addicted'.
+
+    Returns a new frame with the mean of every numeric column per month and group;
+    the input is left unchanged.
+    """
+    combined_df = bootstrap_df.assign(addiction_group=bootstrap_df['addiction_group'].astype(str).replace(
+        {'Mildly Addicted': 'Addicted', 'Severely Addicted': 'Addicted',
+         'Soft Addicted': 'Addicted', 'Hard Addicted': 'Addicted'}
+    ))
+    numeric_columns = combined_df.select_dtypes('number').columns.drop('month_chronological_order')
+    return combined_df.groupby(
+        ['month_chronological_order', 'addiction_group']
+    )[numeric_columns].mean().reset_index()
 
-    fig, ax = plt.subplots(figsize=(9, 6))
-    colors = ['#2A5580']
-    linestyles = [':', '--', '-']
-    alphas = [0.35, 0.55, 0.9]
+@instrument
+def coverage_pivots(bootstrap_df):
+    """Compute every pivot the coverage figures need, once.
 
-    for group in group_order:
-        ax.plot(
-            average_pivot.index,
-            average_pivot[group],
-            label=group,
-            color=colors[0],
-            linestyle=linestyles[group_order.index(group)],
-            linewidth=4,
-            alpha=alphas[group_order.index(group)]
-        )
+    Returns a dict of month-indexed frames: 'levels' (level x group columns),
+    'average' (mean over levels per group), and the same two for the combined
+    Non-Addicted / Addicted grouping.
+    """
+    display_df = bootstrap_df.assign(
+        addiction_group=bootstrap_df['addiction_group'].astype(str).replace(GROUP_DISPLAY_NAMES))
+    combined_df = preprocess_combined_addicted_group(display_df)
 
-    # Customize and add legend
-    ax.set_xlabel('Month', fontsize=24)
-    ax.set_ylabel('Coverage Ratio', fontsize=24)
-    ax.tick_params(axis='y', labelsize=22)
-    ax.tick_params(axis='x', labelsize=22)
-    ax.legend(loc='upper left', fontsize=18)
-    ax.spines[['right', 'top']].set_visible(False)
+    pivots = {}
+    for prefix, df in [('', display_df), ('combined_', combined_df)]:
+        levels = df.pivot(index='month_chronological_order', columns='addiction_group', values=LEVEL_COLUMNS)
+        pivots[prefix + 'levels'] = levels
+        pivots[prefix + 'average'] = levels.T.groupby(level='addiction_group').mean().T
+    return pivots
 
-    plt.tight_layout()
-    plt.show()
+### Figures ###
 
-# Function to plot combined coverage of Addicted vs Non-Addicted (Figure 3)
 # Function to plot bootstrap coverage ratios (Figure 1)
-def plot_bootstrap_coverage(bootstrap_df):
+@instrument
+def plot_bootstrap_coverage(bootstrap_pivot, path='figure_bootstrap_coverage.pdf'):
     """Plot bootstrap-normalized coverage ratios for each level and group."""
-    bootstrap_df['addiction_group'] = bootstrap_df['addiction_group'].replace(
-        {'Non-Addicted': 'Non-Addicted',
-         'Soft Addicted': 'Mildly Addicted',
-         'Hard Addicted': 'Severely Addicted'}
-    )
     group_order = ['Non-Addicted', 'Mildly Addicted', 'Severely Addicted']
     colors = ['#22974F', '#25B1E8', '#E8335A']
     linestyles = [':', '--', '-']
     alphas = [0.35, 0.55, 0.9]
 
-    # Pivot data for plotting
-    bootstrap_pivot = bootstrap_df.pivot(index='month_chronological_order', 
-                                         columns='addiction_group',
-                                         values=['level_1_coverage_normalized',
-                                                 'level_2_coverage_normalized',
-                                                 'level_3_coverage_normalized'])
-
     fig, ax = plt.subplots(figsize=(9, 6))
-    for i, level in enumerate(['level_1_coverage_normalized', 
-                               'level_2_coverage_normalized', 
-                               'level_3_coverage_normalized']):
+    for i, level in enumerate(LEVEL_COLUMNS):
         for group in group_order:
             ax.plot(
                 bootstrap_pivot.index,
@@ -183,7 +165,7 @@ def plot_bootstrap_coverage(bootstrap_df):
                 linewidth=4,
                 alpha=alphas[group_order.index(group)]
             )
-    
+
     # Customize and add legends
     ax.set_xlabel('Month', fontsize=24)
     ax.set_ylabel('Coverage Ratio', fontsize=24)
@@ -202,24 +184,15 @@ def plot_bootstrap_coverage(bootstrap_df):
 
     plt.tight_layout()
     # Save as PDF
-    plt.savefig('figure_bootstrap_coverage.pdf', format='pdf', dpi=300, bbox_inches='tight')
-    plt.close()  # Close the figure to save memory
+    fig.savefig(path, format='pdf', dpi=300, bbox_inches='tight')
+    plt.close(fig)  # Close the figure to save memory
 
 # Function to plot average bootstrap coverage per group (Figure 2)
-def plot_average_coverage(bootstrap_df):
+@instrument
+def plot_average_coverage(average_pivot, path='figure_average_coverage.pdf'):
     """Plot average coverage across levels for each addiction group."""
-    bootstrap_df['average_coverage_normalized'] = (
-        bootstrap_df[['level_1_coverage_normalized', 
-                      'level_2_coverage_normalized', 
-                      'level_3_coverage_normalized']].mean(axis=1)
-    )
     group_order = ['Non-Addicted', 'Mildly Addicted', 'Severely Addicted']
 
-    # Pivot data for plotting
-    average_pivot = bootstrap_df.pivot(index='month_chronological_order', 
-                                       columns='addiction_group',
-                                       values='average_coverage_normalized')
-
     fig, ax = plt.subplots(figsize=(9, 6))
     colors = ['#2A5580']
     linestyles = [':', '--', '-']
@@ -246,51 +219,13 @@ def plot_average_coverage(bootstrap_df):
 
     plt.tight_layout()
     # Save as PDF
-    plt.savefig('figure_average_coverage.pdf', format='pdf', dpi=300, bbox_inches='tight')
-    plt.close()  # Close the figure to save memory
-
-
-def preprocess_combined_addicted_group(bootstrap_df):
-    """Combine 'Mildly Addicted' and 'Severely Addicted' into one group called 'Addicted'."""
-    # Replace group names
-    bootstrap_df['addiction_group'] = bootstrap_df['addiction_group'].replace(
-        {'Mildly Addicted': 'Addicted', 'Severely Addicted': 'Addicted'}
-    )
-
-    # Debugging: Check the replacement
-    print("Unique groups after replacement:", bootstrap_df['addiction_group'].unique())
-    print(bootstrap_df['addiction_group'].value_counts())
-
-    # Group by month and addiction group, and calculate the mean for all numeric columns
-    aggregated_df = bootstrap_df.groupby(
-        ['month_chronological_order', 'addiction_group']
-    ).mean().reset_index()
-
-    # Debugging: Check the aggregated data
-    print("Aggregated DataFrame (first rows):")
-    print(aggregated_df.head())
+    fig.savefig(path, format='pdf', dpi=300, bbox_inches='tight')
+    plt.close(fig)  # Close the figure to save memory
 
-    return aggregated_df
-
-
-
-def plot_combined_coverage(bootstrap_df):
+# Function to plot combined coverage of Addicted vs Non-Addicted (Figure 3)
+@instrument
+def plot_combined_coverage(combined_pivot, path='figure_combined_coverage.pdf'):
     """Plot combined coverage for Addicted and Non-Addicted groups."""
-    # Preprocess data to combine "Mildly Addicted" and "Severely Addicted" into "Addicted"
-    combined_data = preprocess_combined_addicted_group(bootstrap_df)
-
-    # Pivot the data for plotting
-    combined_pivot = combined_data.pivot(
-        index='month_chronological_order',
-        columns='addiction_group',
-        values=['level_1_coverage_normalized',
-                'level_2_coverage_normalized',
-                'level_3_coverage_normalized']
-    )
-
-    # Debugging: Check pivot table columns
-    print("Pivot table columns:", combined_pivot.columns)
-
     # Plot settings
     group_order = ['Non-Addicted', 'Addicted']
     colors = ['#22974F', '#25B1E8', '#E8335A']
@@ -300,9 +235,7 @@ def plot_combined_coverage(bootstrap_df):
     # Create the plot
     fig, ax = plt.subplots(figsize=(9, 6))
 
-    for i, level in enumerate(['level_1_coverage_normalized',
-                               'level_2_coverage_normalized',
-                               'level_3_coverage_normalized']):
+    for i, level in enumerate(LEVEL_COLUMNS):
         for group in group_order:
             if group in combined_pivot[level].columns:  # Ensure group exists in the pivot table
                 ax.plot(
@@ -327,33 +260,13 @@ def plot_combined_coverage(bootstrap_df):
 
     # Save as PDF
     plt.tight_layout()
-    plt.savefig('figure_combined_coverage.pdf', format='pdf', dpi=300, bbox_inches='tight')
-    plt.close()  # Close the figure to save memory
-    
-    
-    
-def plot_average_combined_coverage(bootstrap_df):
-    """Plot average coverage across levels for Addicted and Non-Addicted groups."""
-    # Preprocess data
-    combined_data = preprocess_combined_addicted_group(bootstrap_df)
-
-    # Compute the average coverage across levels
-    combined_data['average_coverage_normalized'] = combined_data[
-        ['level_1_coverage_normalized', 
-         'level_2_coverage_normalized', 
-         'level_3_coverage_normalized']
-    ].mean(axis=1)
-
-    # Pivot the data for plotting
-    average_pivot = combined_data.pivot(
-        index='month_chronological_order',
-        columns='addiction_group',
-        values='average_coverage_normalized'
-    )
-
-    # Debugging: Check pivot table columns
-    print("Average pivot table columns:", average_pivot.columns)
+    fig.savefig(path, format='pdf', dpi=300, bbox_inches='tight')
+    plt.close(fig)  # Close the figure to save memory
 
+# Function to plot average combined coverage of Addicted vs Non-Addicted (Figure 4)
+@instrument
+def plot_average_combined_coverage(average_pivot, path='figure_average_combined_coverage.pdf'):
+    """Plot average coverage across levels for Addicted and Non-Addicted groups."""
     # Plot settings
     group_order = ['Non-Addicted', 'Addicted']
     colors = ['#2A5580', '#FF6F61']
@@ -387,19 +300,28 @@ def plot_average_combined_coverage(bootstrap_df):
 
     # Save as PDF
     plt.tight_layout()
-    plt.savefig('figure_average_combined_coverage.pdf', format='pdf', dpi=300, bbox_inches='tight')
-    plt.close()  # Close the figure to save memory
-    
-    
-if __name__ == "__main__":
-    merged_data = load_and_merge_data()
-    coverage_ratios = calculate_coverage_ratios(merged_data)
+    fig.savefig(path, format='pdf', dpi=300, bbox_inches='tight')
+    plt.close(fig)  # Close the figure to save memory
+
+def coverage_figure_specs(bootstrap_df, output_dir='.'):
+    """The four coverage figures as FigureSpecs sharing one set of pivots."""
+    pivots = coverage_pivots(bootstrap_df)
+    return [
+        FigureSpec(os.path.join(output_dir, 'figure_bootstrap_coverage.pdf'), plot_bootstrap_coverage, pivots['levels']),
+        FigureSpec(os.path.join(output_dir, 'figure_average_coverage.pdf'), plot_average_coverage, pivots['average']),
+        FigureSpec(os.path.join(output_dir, 'figure_combined_coverage.pdf'), plot_combined_coverage,
+                   pivots['combined_levels']),
+        FigureSpec(os.path.join(output_dir, 'figure_average_combined_coverage.pdf'), plot_average_combined_coverage,
+                   pivots['combined_average']),
+    ]
 
-    # Load bootstrap data
-    bootstrap_data = pd.read_csv('bootstrap_normalized_results.csv')
 
-    # Generate the plots
-    plot_bootstrap_coverage(bootstrap_data)  # Figure 1
-    plot_average_coverage(bootstrap_data)  # Figure 2
-    plot_combined_coverage(bootstrap_data)  # Figure 3
-    plot_average_combined_coverage(bootstrap_data)  # Figure 4
\ No newline at end of file
+if __name__ == "__main__":
+    # Compute (or load cached) bootstrap-normalized coverage
+    cache = AnalysisCache()
+    bootstrap_data = load_or_compute_bootstrap_coverage(cache=cache)
+    print(cache.report())
+    bootstrap_data.to_csv('bootstrap_normalized_results.csv', index=False)
+
+    # Generate Figures 1-4 in parallel, skipping any whose inputs are unchanged
+    render_figures(coverage_figure_specs(bootstrap_data))
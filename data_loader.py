@@ -0,0 +1,183 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import instrument
+
+try:
+    import pyarrow  # noqa: F401
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+PARQUET_CACHE_DIR = 'cache/parquet'
+
+HOUR_COLUMNS = [f'hour_{i}_wt' for i in range(24)]
+TIME_OF_DAY_COLUMNS = ['morning_wt', 'noon_wt', 'afternoon_wt', 'evening_wt', 'midnight_wt']
+
+# Input features of the soft/hard criteria XGBoost models, in training order
+MODEL_FEATURES = [
+    'age', 'gender', 'watch_all_per_day', 'coverage_per_2weeks', 'category_count_unique',
+    'session_all_per_day', 'midnight_wt', 'morning_wt', 'noon_wt', 'afternoon_wt', 'evening_wt',
+    'pid_SHUA_all_per_day', 'pid_watch_all_per_day',
+]
+
+ADDICTION_LABELS = ['Non-Addicted', 'Mildly Addicted', 'Severely Addicted']
+# addiction_group names used by the coverage pipeline, indexed by preds_3_label_criteria
+ADDICTION_GROUPS = ['Non-Addicted', 'Soft Addicted', 'Hard Addicted']
+SOFT_LABELS = ['Non-Addicted', 'Addicted']
+
+# Same gender encoding as the notebooks
+GENDER_CODES = {'M': 0, 'F': 1}
+
+### Schemas: column -> compact dtype ###
+
+MONTHLY_USER_DATA_SCHEMA = {
+    'user_id': 'int32',
+    'window_id': 'int8',
+    'level_1_coverage': 'float32',
+    'level_2_coverage': 'float32',
+    'level_3_coverage': 'float32',
+    'level_1_coverage_norm': 'float32',
+    'level_2_coverage_norm': 'float32',
+    'level_3_coverage_norm': 'float32',
+    **{column: 'float32' for column in HOUR_COLUMNS + TIME_OF_DAY_COLUMNS},
+}
+
+ADDICTION_DATA_SCHEMA = {
+    'user_id': 'int32',
+    'month_chronological_order': 'int8',
+    'preds_soft': 'int8',
+    'preds_hard': 'int8',
+    'preds_3_label_criteria': 'int8',
+}
+
+DATASET_SCHEMA = {
+    'user_id': 'int32',
+    **{column: 'float32' for column in HOUR_COLUMNS},
+    'session_all_per_day': 'float32',
+    'pid_exposed_all_per_day': 'float32',
+    'pid_watch_all_per_day': 'float32',
+    'coverage_per_2weeks': 'float32',
+    'category_count_unique': 'int32',
+    'age': 'int16',
+    'gender': pd.CategoricalDtype(list(GENDER_CODES)),
+    'month_chronological_order': 'int8',
+    'preds_3_label_criteria_label': pd.CategoricalDtype(ADDICTION_LABELS, ordered=True),
+    'preds_soft_label': pd.CategoricalDtype(SOFT_LABELS, ordered=True),
+    'watch_all_per_day_min': 'int32',
+    'midnight_wt_min': 'int32',
+    'morning_wt_min': 'int32',
+    'noon_wt_min': 'int32',
+    'afternoon_wt_min': 'int32',
+    'evening_wt_min': 'int32',
+}
+
+
+def _parquet_cache_path(csv_path, cache_dir, schema):
+    """Cache file for a CSV, keyed on its path, size, modification time and the schema it is read with."""
+    stat = os.stat(csv_path)
+    # repr keeps the categories of CategoricalDtypes, which str() drops
+    schema_source = repr(sorted((column, repr(pd.api.types.pandas_dtype(dtype))) for column, dtype in schema.items()))
+    key_source = f'{os.path.abspath(csv_path)}:{stat.st_size}:{stat.st_mtime_ns}:{schema_source}'
+    key = hashlib.sha256(key_source.encode()).hexdigest()[:16]
+    stem = os.path.splitext(os.path.basename(csv_path))[0]
+    return os.path.join(cache_dir, f'{stem}-{key}.parquet')
+
+
+@instrument
+def read_table(csv_path, schema, columns=None, cache_dir=PARQUET_CACHE_DIR):
+    """Read a CSV with the declared compact dtypes, via a memory-mapped Parquet cache.
+
+    Only columns declared in `schema` (or the `columns` subset of it) are kept.
+    The first read converts the CSV to Parquet; later reads memory-map that file.
+    The file is written under a temporary name and renamed into place, so a
+    concurrent reader never sees it half-written.
+    Without pyarrow the CSV is parsed directly every time.
+    """
+    if HAS_PYARROW and cache_dir is not None:
+        cache_path = _parquet_cache_path(csv_path, cache_dir, schema)
+        if not os.path.exists(cache_path):
+            df = pd.read_csv(csv_path, usecols=lambda column: column in schema,
+                             dtype={column: dtype for column, dtype in schema.items()})
+            os.makedirs(cache_dir, exist_ok=True)
+            temporary_path = f'{cache_path}.{os.getpid()}.tmp'
+            df.to_parquet(temporary_path, index=False)
+            os.replace(temporary_path, cache_path)
+        return pd.read_parquet(cache_path, columns=columns, memory_map=True)
+
+    wanted = schema if columns is None else columns
+    return pd.read_csv(csv_path, usecols=lambda column: column in wanted,
+                       dtype={column: dtype for column, dtype in schema.items() if column in wanted})
+
+
+def load_monthly_user_data(path, columns=None, cache_dir=PARQUET_CACHE_DIR):
+    """Load monthly_user_data.csv and add `month_chronological_order`."""
+    if columns is not None and 'window_id' not in columns:
+        columns = list(columns) + ['window_id']
+    monthly_user_data = read_table(path, MONTHLY_USER_DATA_SCHEMA, columns=columns, cache_dir=cache_dir)
+    monthly_user_data['month_chronological_order'] = (monthly_user_data['window_id'] + 1).astype(np.int8)
+    return monthly_user_data
+
+
+def load_addiction_data(path, columns=None, cache_dir=PARQUET_CACHE_DIR):
+    """Load addiction_data.csv (per user-month addiction labels)."""
+    return read_table(path, ADDICTION_DATA_SCHEMA, columns=columns, cache_dir=cache_dir)
+
+
+def load_dataset(path='dataset.csv', columns=None, cache_dir=PARQUET_CACHE_DIR):
+    """Load the labeled dataset.csv with categorical labels and a numeric gender code."""
+    dataset = read_table(path, DATASET_SCHEMA, columns=columns, cache_dir=cache_dir)
+    if 'gender' in dataset.columns:
+        dataset['gender_code'] = dataset['gender'].cat.codes.astype(np.int8)
+    return dataset
+
+
+### Merge and label ###
+
+USER_MONTH_KEYS = ['user_id', 'month_chronological_order']
+
+
+def _user_month_key(df):
+    """Pack (user_id, month) into one sortable int64 key."""
+    return (df['user_id'].to_numpy(dtype=np.int64) << 8) | df['month_chronological_order'].to_numpy(dtype=np.int64)
+
+
+def label_addiction_groups(preds_3_label_criteria):
+    """Map preds_3_label_criteria to a categorical addiction_group through a lookup array.
+
+    2 -> 'Hard Addicted', 1 -> 'Soft Addicted', anything else -> 'Non-Addicted'.
+    """
+    labels = np.asarray(preds_3_label_criteria)
+    codes = np.where((labels == 1) | (labels == 2), labels, 0).astype(np.int8)
+    return pd.Categorical.from_codes(codes, categories=ADDICTION_GROUPS)
+
+
+@instrument
+def merge_and_label(monthly_user_data, addiction_status):
+    """Inner-join user-month features with addiction labels and add `addiction_group`.
+
+    Both sides are keyed on a packed (user_id, month) integer; the label table is
+    sorted once and rows are matched with a binary search, which assumes one
+    label row per user-month. The result is sorted by (user_id, month).
+    Overlapping non-key columns get pandas' `_x` / `_y` suffixes.
+    """
+    right = addiction_status.iloc[np.argsort(_user_month_key(addiction_status), kind='stable')]
+    right_keys = _user_month_key(right)
+    left = monthly_user_data.iloc[np.argsort(_user_month_key(monthly_user_data), kind='stable')]
+    left_keys = _user_month_key(left)
+
+    # Binary search every left key in the sorted right keys
+    position = np.minimum(np.searchsorted(right_keys, left_keys), max(len(right_keys) - 1, 0))
+    found = right_keys[position] == left_keys if len(right_keys) else np.zeros(len(left_keys), dtype=bool)
+
+    left = left[found].reset_index(drop=True)
+    right = right.iloc[position[found]].drop(columns=USER_MONTH_KEYS).reset_index(drop=True)
+    overlap = left.columns.intersection(right.columns)
+    merged_df = pd.concat([left.rename(columns={c: f'{c}_x' for c in overlap}),
+                           right.rename(columns={c: f'{c}_y' for c in overlap})], axis=1)
+
+    merged_df['addiction_group'] = label_addiction_groups(merged_df['preds_3_label_criteria'])
+    return merged_df
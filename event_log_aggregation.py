@@ -0,0 +1,132 @@
+import argparse
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_loader import HAS_PYARROW
+
+# Same month bucketing as addiction_feature_plot.ipynb
+WEEK_START = pd.Timestamp('2023-09-11')
+NUM_MONTHS = 10
+
+INTERACTION_KEYS = ['user_id', 'root_id', 'p_date']
+LOG_DTYPES = {'user_id': 'int64', 'category_id': 'float64', 'root_id': 'float64', 'p_date': 'int32',
+              'watch_time': 'float32', 'num_interactions': 'int64'}
+
+
+def aggregate_chunk(chunk):
+    """Count interactions per (user_id, root_id, p_date) in one chunk of the event log.
+
+    Raw logs (ks_output.csv) are filtered to watch_time > 0 and their `pid` rows
+    counted; already aggregated files (user_root.csv) have their
+    `num_interactions` summed. Rows without a root category are dropped.
+    """
+    if 'root_id' not in chunk.columns:
+        chunk = chunk.rename(columns={'category_id': 'root_id'})
+    if 'watch_time' in chunk.columns:
+        chunk = chunk[chunk['watch_time'] > 0]
+    chunk = chunk.dropna(subset=['root_id'])
+
+    grouped = chunk.groupby(INTERACTION_KEYS, sort=False)
+    if 'num_interactions' in chunk.columns:
+        counts = grouped['num_interactions'].sum()
+    else:
+        counts = grouped['pid'].count()
+    return counts.rename('num_interactions')
+
+
+def combine_partials(partials):
+    """Merge partial (user_id, root_id, p_date) counts from several chunks."""
+    return pd.concat(partials).groupby(level=INTERACTION_KEYS, sort=False).sum()
+
+
+def stream_aggregate(path, chunksize=5_000_000, max_partial_rows=None):
+    """Aggregate an event log in bounded-memory chunks.
+
+    Each chunk is reduced to partial counts straight away; partials are compacted
+    whenever they exceed `max_partial_rows` (default: 2 * chunksize), so memory
+    stays proportional to the number of distinct keys, not the log length.
+    Returns a frame with user_id, root_id, p_date (int YYYYMMDD), num_interactions.
+    """
+    max_partial_rows = max_partial_rows or 2 * chunksize
+    header = pd.read_csv(path, nrows=0).columns
+    usecols = [c for c in ['user_id', 'category_id', 'root_id', 'p_date', 'pid', 'watch_time', 'num_interactions']
+               if c in header]
+    dtype = {c: LOG_DTYPES[c] for c in usecols if c in LOG_DTYPES}
+
+    partials, partial_rows = [], 0
+    for chunk in pd.read_csv(path, usecols=usecols, dtype=dtype, na_values=['\\N'], chunksize=chunksize):
+        partial = aggregate_chunk(chunk)
+        partials.append(partial)
+        partial_rows += len(partial)
+        if partial_rows > max_partial_rows:
+            partials = [combine_partials(partials)]
+            partial_rows = len(partials[0])
+
+    if not partials:
+        return pd.DataFrame(columns=INTERACTION_KEYS + ['num_interactions'])
+    result = combine_partials(partials).reset_index()
+    result['root_id'] = result['root_id'].astype(np.int64)
+    return result
+
+
+def add_month(interactions, week_start=WEEK_START, num_months=NUM_MONTHS):
+    """Convert p_date to datetime, add the 30-day `month` bucket and keep months 0..num_months-1."""
+    interactions = interactions.copy()
+    interactions['p_date'] = pd.to_datetime(interactions['p_date'].astype(str), format='%Y%m%d')
+    interactions['month'] = ((week_start - interactions['p_date']).dt.days // 30).astype(int)
+    return interactions[(interactions['month'] >= 0) & (interactions['month'] < num_months)].reset_index(drop=True)
+
+
+def build_root_interactions(path, chunksize=5_000_000):
+    """Streaming equivalent of the notebook's ks_output.csv / user_root.csv preprocessing."""
+    return add_month(stream_aggregate(path, chunksize=chunksize))
+
+
+### Day-partitioned store ###
+
+def _partition_path(store_dir, p_date):
+    return os.path.join(store_dir, f'p_date={int(p_date)}.parquet')
+
+
+def append_to_store(path, store_dir, chunksize=5_000_000):
+    """Aggregate a log file and write one partition per day into `store_dir`.
+
+    Days present in the new file replace their existing partitions (so reruns
+    are idempotent); all other days are left untouched. Each input file is
+    therefore expected to contain complete days.
+    Returns the list of p_date values written.
+    """
+    if not HAS_PYARROW:
+        raise ImportError('append_to_store requires pyarrow for the Parquet partitions')
+    aggregated = stream_aggregate(path, chunksize=chunksize)
+    os.makedirs(store_dir, exist_ok=True)
+    for p_date, day in aggregated.groupby('p_date'):
+        day.to_parquet(_partition_path(store_dir, p_date), index=False)
+    return sorted(aggregated['p_date'].unique().tolist())
+
+
+def load_store(store_dir, start=None, end=None):
+    """Read day partitions (optionally limited to start <= p_date <= end, as YYYYMMDD ints) with months added."""
+    paths = []
+    for path in sorted(glob.glob(os.path.join(store_dir, 'p_date=*.parquet'))):
+        p_date = int(os.path.basename(path)[len('p_date='):-len('.parquet')])
+        if (start is None or p_date >= start) and (end is None or p_date <= end):
+            paths.append(path)
+    if not paths:
+        return add_month(pd.DataFrame(columns=INTERACTION_KEYS + ['num_interactions']))
+    return add_month(pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Append event logs to the day-partitioned interaction store.')
+    parser.add_argument('logs', nargs='+', help='ks_output.csv / user_root.csv style files')
+    parser.add_argument('--store', default='cache/root_interactions')
+    parser.add_argument('--chunksize', type=int, default=5_000_000)
+    args = parser.parse_args()
+
+    for log_path in args.logs:
+        days = append_to_store(log_path, args.store, chunksize=args.chunksize)
+        print(f'{log_path}: wrote {len(days)} day partitions to {args.store}')
@@ -0,0 +1,227 @@
+import argparse
+import json
+import os
+from dataclasses import dataclass
+
+import numpy as np
+import pandas as pd
+
+from data_loader import ADDICTION_LABELS, GENDER_CODES, SOFT_LABELS, load_dataset
+from instrumentation import instrument
+
+# Age segments of addiction_feature_plot.ipynb; AGE_BIN_EDGES are the first ages of segments 1..7
+AGE_SEGMENTS = ['0-12', '13-17', '18-24', '25-34', '35-44', '45-54', '55-64', '65+']
+AGE_BIN_EDGES = np.array([13, 18, 25, 35, 45, 55, 65])
+
+CUBE_DIMENSIONS = ['month_chronological_order', 'preds_soft', 'preds_3_label_criteria', 'gender', 'age_segment']
+
+# Columns that are never aggregated as features
+NON_FEATURE_COLUMNS = set(CUBE_DIMENSIONS) | {
+    'user_id', 'window_id', 'month', 'preds_hard', 'gender_code', 'preds_soft_label', 'preds_3_label_criteria_label',
+}
+
+FEATURE_CUBE_PATH = 'cache/feature_cube.npz'
+
+
+def age_segments(age):
+    """Vectorized separate_age: the AGE_SEGMENTS bin of every age as a Categorical.
+
+    Like the notebook, ages past the last edge (and missing ages) fall in '65+'.
+    """
+    codes = np.digitize(np.asarray(age, dtype=np.float64), AGE_BIN_EDGES)
+    return pd.Categorical.from_codes(codes, categories=AGE_SEGMENTS, ordered=True)
+
+
+def _label_codes(df, column, label_column, labels):
+    if column in df.columns:
+        return df[column].to_numpy(dtype=np.float64)
+    return pd.Categorical(df[label_column], categories=labels).codes.astype(np.float64)
+
+
+def dimension_codes(df, dimension):
+    """Integer code (-1 for missing) and the ordered levels of one cube dimension.
+
+    The labels may come as preds_* columns or as the *_label strings of
+    dataset.csv, and gender as 0/1 codes or as 'M' / 'F'.
+    """
+    if dimension == 'month_chronological_order':
+        levels, codes = np.unique(df[dimension].to_numpy(), return_inverse=True)
+        return codes, levels.tolist()
+    if dimension == 'age_segment':
+        return age_segments(df['age']).codes.astype(np.int64), AGE_SEGMENTS
+    if dimension == 'preds_soft':
+        values, levels = _label_codes(df, 'preds_soft', 'preds_soft_label', SOFT_LABELS), [0, 1]
+    elif dimension == 'preds_3_label_criteria':
+        values = _label_codes(df, 'preds_3_label_criteria', 'preds_3_label_criteria_label', ADDICTION_LABELS)
+        levels = [0, 1, 2]
+    elif dimension == 'gender':
+        gender = df['gender']
+        if not pd.api.types.is_numeric_dtype(gender):
+            gender = gender.map(GENDER_CODES).astype('float64')
+        values, levels = gender.to_numpy(dtype=np.float64), sorted(GENDER_CODES.values())
+    else:
+        raise ValueError(f'unknown cube dimension: {dimension}')
+    valid = np.isin(values, levels)
+    return np.where(valid, np.nan_to_num(values), -1).astype(np.int64), levels
+
+
+def default_features(df):
+    return [column for column in df.columns
+            if column not in NON_FEATURE_COLUMNS and pd.api.types.is_numeric_dtype(df[column])]
+
+
+### Cube ###
+
+@dataclass
+class FeatureCube:
+    """Count, sum and sum of squares of every feature over all dimension combinations.
+
+    Arrays have one axis per dimension plus a trailing feature axis. Each
+    dimension axis has one extra, last position holding the total over that
+    dimension, so any slice (a value or "all" for every dimension) is a single
+    index lookup. Sums are taken around the per-feature `shift` (the overall
+    mean) to keep the variance accurate.
+    """
+    dimensions: list
+    levels: dict
+    features: list
+    shift: np.ndarray
+    count: np.ndarray
+    sum: np.ndarray
+    sumsq: np.ndarray
+
+    def _position(self, dimension, value):
+        levels = self.levels[dimension]
+        try:
+            return levels.index(value)
+        except ValueError:
+            raise KeyError(f'{value!r} is not a level of {dimension}: {levels}') from None
+
+    def _index(self, selection, by=()):
+        unknown = set(selection) - set(self.dimensions)
+        if unknown:
+            raise KeyError(f'unknown cube dimensions: {sorted(unknown)}')
+        index = []
+        for dimension in self.dimensions:
+            if dimension in by:
+                index.append(slice(0, len(self.levels[dimension])))
+            elif dimension in selection:
+                index.append(self._position(dimension, selection[dimension]))
+            else:
+                index.append(-1)
+        return tuple(index)
+
+    def _moments(self, index, positions):
+        """count, mean and std at a dimension `index` for the features at `positions`."""
+        count, sums, sumsq = (array[index][..., positions] for array in (self.count, self.sum, self.sumsq))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = self.shift[positions] + sums / count
+            variance = (sumsq - sums ** 2 / count) / (count - 1)
+        std = np.where(count > 1, np.sqrt(np.maximum(variance, 0)), np.nan)
+        return count, np.where(count > 0, mean, np.nan), std
+
+    def stats(self, feature, **selection):
+        """{'count', 'mean', 'std'} of `feature` in one slice, e.g. stats('age', preds_soft=1, gender=0).
+
+        Dimensions left out are taken over all their values; std uses ddof=1 like pandas.
+        """
+        position = self.features.index(feature)
+        count, mean, std = self._moments(self._index(selection), position)
+        return {'count': int(count), 'mean': float(mean), 'std': float(std)}
+
+    def series(self, feature, by='month_chronological_order', stat='mean', **selection):
+        """One statistic of `feature` for every level of `by` within a slice.
+
+        series(item, preds_soft=1) is the notebook's
+        df[df['preds_soft'] == 1].groupby('month_chronological_order')[item].mean(),
+        except that levels without rows are NaN instead of missing.
+        """
+        position = self.features.index(feature)
+        moments = dict(zip(['count', 'mean', 'std'], self._moments(self._index(selection, by=(by,)), position)))
+        return pd.Series(moments[stat], index=pd.Index(self.levels[by], name=by), name=feature)
+
+    def table(self, by, features=None, **selection):
+        """count / mean / std of `features` for every combination of the `by` dimensions, in long format."""
+        by = [by] if isinstance(by, str) else list(by)
+        features = self.features if features is None else list(features)
+        positions = [self.features.index(feature) for feature in features]
+        # The sliced arrays keep the `by` axes in cube order; put them in the requested order
+        in_cube_order = [dimension for dimension in self.dimensions if dimension in by]
+        axes = [in_cube_order.index(dimension) for dimension in by] + [len(by)]
+        count, mean, std = (array.transpose(axes) for array in self._moments(self._index(selection, by=by), positions))
+
+        index = pd.MultiIndex.from_product([self.levels[dimension] for dimension in by] + [features],
+                                           names=by + ['feature'])
+        return pd.DataFrame({'count': count.ravel(), 'mean': mean.ravel(), 'std': std.ravel()},
+                            index=index).reset_index()
+
+    def save(self, path=FEATURE_CUBE_PATH):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        meta = {'dimensions': self.dimensions, 'levels': self.levels, 'features': self.features}
+        np.savez_compressed(path, shift=self.shift, count=self.count, sum=self.sum, sumsq=self.sumsq,
+                            meta=np.array(json.dumps(meta)))
+
+    @classmethod
+    def load(cls, path=FEATURE_CUBE_PATH):
+        with np.load(path) as arrays:
+            meta = json.loads(str(arrays['meta']))
+            return cls(meta['dimensions'], meta['levels'], meta['features'], arrays['shift'],
+                       arrays['count'], arrays['sum'], arrays['sumsq'])
+
+
+def _add_totals(array, num_dimensions):
+    """Append a total position along every dimension axis."""
+    for axis in range(num_dimensions):
+        array = np.concatenate([array, array.sum(axis=axis, keepdims=True)], axis=axis)
+    return array
+
+
+@instrument
+def build_cube(df, features=None, dimensions=CUBE_DIMENSIONS, chunk_rows=250_000):
+    """Aggregate `features` over all `dimensions` in one vectorized pass.
+
+    Every row lands in one cell (the raveled dimension codes); each chunk of
+    rows is added to all cells and features with a single bincount per
+    moment. Rows with a missing dimension value are left out, and NaN feature
+    values only drop out of that feature's count.
+    """
+    features = default_features(df) if features is None else list(features)
+    encoded = [dimension_codes(df, dimension) for dimension in dimensions]
+    codes = np.stack([code for code, _ in encoded])
+    shape = tuple(len(levels) for _, levels in encoded)
+    valid_rows = (codes >= 0).all(axis=0)
+    cells = np.ravel_multi_index(np.where(valid_rows, codes, 0), shape)
+
+    values = df[features]
+    shift = np.nan_to_num(values[valid_rows].mean().to_numpy(dtype=np.float64))
+    num_features, size = len(features), int(np.prod(shape)) * len(features)
+    count, sums, sumsq = np.zeros(size), np.zeros(size), np.zeros(size)
+    feature_offsets = np.arange(num_features)
+
+    for start in range(0, len(df), chunk_rows):
+        rows = valid_rows[start:start + chunk_rows]
+        block = values.iloc[start:start + chunk_rows].to_numpy(dtype=np.float64)[rows] - shift
+        observed = ~np.isnan(block)
+        block = np.where(observed, block, 0.0)
+        slots = (cells[start:start + chunk_rows][rows, None] * num_features + feature_offsets).ravel()
+        count += np.bincount(slots, weights=observed.ravel(), minlength=size)
+        sums += np.bincount(slots, weights=block.ravel(), minlength=size)
+        sumsq += np.bincount(slots, weights=(block ** 2).ravel(), minlength=size)
+
+    count, sums, sumsq = (_add_totals(array.reshape(shape + (num_features,)), len(shape))
+                          for array in (count, sums, sumsq))
+    return FeatureCube(list(dimensions), {dimension: levels for dimension, (_, levels) in zip(dimensions, encoded)},
+                       features, shift, count, sums, sumsq)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Precompute the month x label x gender x age_segment feature cube.')
+    parser.add_argument('data', nargs='?', default='dataset.csv')
+    parser.add_argument('--output', default=FEATURE_CUBE_PATH)
+    args = parser.parse_args()
+
+    cube = build_cube(load_dataset(args.data))
+    cube.save(args.output)
+    print(cube.table('month_chronological_order', features=cube.features[:3], preds_soft=1).to_string(index=False))
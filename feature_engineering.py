@@ -0,0 +1,220 @@
+import argparse
+import glob
+import os
+
+import numpy as np
+import pandas as pd
+
+from data_loader import HAS_PYARROW, HOUR_COLUMNS
+from event_log_aggregation import NUM_MONTHS, WEEK_START
+
+# Raw watch events: one row per video impression
+EVENT_COLUMNS = ['user_id', 'p_date', 'hour', 'session_id', 'pid', 'category_id', 'watch_time']
+EVENT_DTYPES = {'user_id': 'int64', 'p_date': 'int32', 'hour': 'int8', 'session_id': 'int64',
+                'pid': 'int64', 'category_id': 'float64', 'watch_time': 'float32'}
+
+WINDOW_DAYS = 30
+MIN_WATCH_SECONDS = 1
+
+# Hour ranges of the time-of-day buckets (consistent with dataset.csv)
+TIME_OF_DAY_HOURS = {
+    'midnight_wt': range(0, 6),
+    'morning_wt': range(6, 12),
+    'noon_wt': range(12, 14),
+    'afternoon_wt': range(14, 18),
+    'evening_wt': range(18, 24),
+}
+
+FEATURE_COLUMNS = HOUR_COLUMNS + list(TIME_OF_DAY_HOURS) + [
+    'watch_all_per_day', 'session_all_per_day', 'pid_SHUA_all_per_day', 'pid_watch_all_per_day',
+    'coverage_per_2weeks', 'category_count_unique',
+]
+
+# Mergeable partial aggregates of a batch of events (e.g. the chunks of one file)
+PARTIAL_KEYS = {
+    'hour_watch': ['user_id', 'p_date', 'hour'],
+    'pids': ['user_id', 'p_date', 'pid'],
+    'sessions': ['user_id', 'p_date', 'session_id'],
+    'categories': ['user_id', 'p_date', 'category_id'],
+}
+
+# Compact per-day partials kept in the store (see compact_partials)
+DAY_PARTIALS = ['hour_watch', 'daily_counts', 'categories']
+
+
+def month_of(p_date, week_start=WEEK_START):
+    """30-day month bucket of YYYYMMDD dates, counted back from `week_start` (0 = most recent)."""
+    dates = pd.to_datetime(pd.Series(p_date).astype(str), format='%Y%m%d')
+    return ((week_start - dates).dt.days // 30).to_numpy()
+
+
+### Partial aggregates ###
+
+def partial_aggregates(events):
+    """Reduce a batch of raw events to the mergeable partial tables of PARTIAL_KEYS."""
+    watched = events[events['watch_time'] > 0]
+    return {
+        'hour_watch': watched.groupby(PARTIAL_KEYS['hour_watch'], sort=False)['watch_time'].sum().reset_index(),
+        'pids': events.assign(watched=events['watch_time'] >= MIN_WATCH_SECONDS)
+                      .groupby(PARTIAL_KEYS['pids'], sort=False)['watched'].max().reset_index(),
+        'sessions': events[PARTIAL_KEYS['sessions']].drop_duplicates(),
+        'categories': events[PARTIAL_KEYS['categories']].dropna().drop_duplicates(),
+    }
+
+
+def merge_partials(partials_list):
+    """Combine several partial-aggregate dicts into one (sums, maxima and distinct sets)."""
+    merged = {}
+    for name, keys in PARTIAL_KEYS.items():
+        frames = pd.concat([partials[name] for partials in partials_list], ignore_index=True)
+        if name == 'hour_watch':
+            merged[name] = frames.groupby(keys, sort=False)['watch_time'].sum().reset_index()
+        elif name == 'pids':
+            merged[name] = frames.groupby(keys, sort=False)['watched'].max().reset_index()
+        else:
+            merged[name] = frames.drop_duplicates(keys)
+    return merged
+
+
+def compact_partials(partials):
+    """Reduce merged partial aggregates to the per-day DAY_PARTIALS.
+
+    Distinct pids and sessions are only counted within a day, so they shrink
+    to per (user_id, p_date) counts in `daily_counts`; categories stay
+    distinct per user and day since category_count_unique spans the window.
+    """
+    pids = partials['pids'].groupby(['user_id', 'p_date'])['watched'].agg(pids='size', watched_pids='sum')
+    sessions = partials['sessions'].groupby(['user_id', 'p_date']).size().rename('sessions')
+    daily_counts = pids.join(sessions, how='outer').fillna(0).astype(np.int32).reset_index()
+    return {'hour_watch': partials['hour_watch'], 'daily_counts': daily_counts, 'categories': partials['categories']}
+
+
+def finalize_month_features(partials, window_days=WINDOW_DAYS):
+    """Turn one month's DAY_PARTIALS (all its days together) into the per-user model features.
+
+    hour_k_wt is the mean watch time in hour k over the days the user watched in
+    that hour; time-of-day buckets sum their hours. *_per_day features divide
+    window totals by `window_days`, distinct pids/sessions are counted per day,
+    coverage_per_2weeks is active days per 14 days and category_count_unique is
+    the exact number of distinct categories in the window.
+    """
+    hour_watch, daily_counts = partials['hour_watch'], partials['daily_counts']
+    users = pd.Index(np.unique(np.concatenate([
+        hour_watch['user_id'].to_numpy(), daily_counts['user_id'].to_numpy()])), name='user_id')
+    features = pd.DataFrame(index=users)
+
+    # Hour bucketing: one vectorized groupby, then a dense (user x 24) matrix
+    hourly = hour_watch.groupby(['user_id', 'hour'])['watch_time'].agg(['sum', 'count'])
+    hour_wt = (hourly['sum'] / hourly['count']).unstack('hour', fill_value=0.0)
+    hour_wt = hour_wt.reindex(index=users, columns=range(24), fill_value=0.0)
+    features[HOUR_COLUMNS] = hour_wt.to_numpy(dtype=np.float32)
+    for bucket, hours in TIME_OF_DAY_HOURS.items():
+        features[bucket] = hour_wt[list(hours)].sum(axis=1).to_numpy(dtype=np.float32)
+
+    daily_watch = hour_watch.groupby(['user_id', 'p_date'])['watch_time'].sum()
+    features['watch_all_per_day'] = daily_watch.groupby(level='user_id').sum().reindex(users, fill_value=0) / window_days
+    counts = daily_counts.groupby('user_id')[['sessions', 'pids', 'watched_pids']].sum().reindex(users, fill_value=0)
+    features['session_all_per_day'] = counts['sessions'] / window_days
+    features['pid_SHUA_all_per_day'] = counts['pids'] / window_days
+    features['pid_watch_all_per_day'] = counts['watched_pids'] / window_days
+    active_days = daily_watch.groupby(level='user_id').size().reindex(users, fill_value=0)
+    features['coverage_per_2weeks'] = active_days / (window_days / 14)
+    categories = partials['categories'].drop_duplicates(['user_id', 'category_id'])
+    features['category_count_unique'] = categories.groupby('user_id').size().reindex(users, fill_value=0).astype(np.int32)
+
+    return features.reset_index()
+
+
+def build_features(events, window_days=WINDOW_DAYS):
+    """Compute features for every (user_id, month) window of an in-memory event frame."""
+    events = events.assign(month=month_of(events['p_date']))
+    events = events[(events['month'] >= 0) & (events['month'] < NUM_MONTHS)]
+    monthly = []
+    for month, month_events in events.groupby('month'):
+        features = finalize_month_features(compact_partials(partial_aggregates(month_events)), window_days)
+        features.insert(1, 'month', month)
+        monthly.append(features)
+    result = pd.concat(monthly, ignore_index=True)
+    result['month_chronological_order'] = NUM_MONTHS - result['month']
+    return result
+
+
+### Incremental store ###
+
+def _partial_path(store_dir, p_date, name):
+    return os.path.join(store_dir, 'partials', f'p_date={int(p_date)}', f'{name}.parquet')
+
+
+def _feature_path(store_dir, month):
+    return os.path.join(store_dir, 'features', f'month={month}.parquet')
+
+
+def _load_month_partials(store_dir, month):
+    """Concatenate the stored DAY_PARTIALS of every day in `month`."""
+    day_dirs = sorted(glob.glob(os.path.join(store_dir, 'partials', 'p_date=*')))
+    p_dates = [int(os.path.basename(day_dir)[len('p_date='):]) for day_dir in day_dirs]
+    days = [p_date for p_date, day_month in zip(p_dates, month_of(p_dates)) if day_month == month]
+    return {name: pd.concat([pd.read_parquet(_partial_path(store_dir, p_date, name)) for p_date in days],
+                            ignore_index=True)
+            for name in DAY_PARTIALS}
+
+
+def update_feature_store(events_path, store_dir, chunksize=5_000_000, window_days=WINDOW_DAYS):
+    """Fold a new events file into the store and rebuild only the months it touches.
+
+    Events are read in chunks and reduced to partial aggregates, which are
+    compacted to a few small tables per day (DAY_PARTIALS). Days present in
+    the new file replace their stored partials, so reruns are idempotent, and
+    each input file is therefore expected to contain complete days. The
+    feature files of the months those days fall in are then rebuilt from
+    their days' partials; other months are not read at all.
+    Returns the sorted list of months updated.
+    """
+    if not HAS_PYARROW:
+        raise ImportError('update_feature_store requires pyarrow for the Parquet store')
+
+    chunk_partials = []
+    for chunk in pd.read_csv(events_path, usecols=EVENT_COLUMNS, dtype=EVENT_DTYPES, chunksize=chunksize):
+        month = month_of(chunk['p_date'])
+        chunk = chunk[(month >= 0) & (month < NUM_MONTHS)]
+        if len(chunk):
+            chunk_partials.append(partial_aggregates(chunk))
+    if not chunk_partials:
+        return []
+
+    partials = compact_partials(merge_partials(chunk_partials))
+    p_dates = np.unique(partials['daily_counts']['p_date'].to_numpy())
+    by_day = {name: dict(iter(frame.groupby('p_date', sort=False))) for name, frame in partials.items()}
+    for p_date in p_dates:
+        os.makedirs(os.path.dirname(_partial_path(store_dir, p_date, DAY_PARTIALS[0])), exist_ok=True)
+        for name, frame in partials.items():
+            # Days without rows in a table still get an (empty) file, replacing what was stored
+            by_day[name].get(p_date, frame.iloc[:0]).to_parquet(_partial_path(store_dir, p_date, name), index=False)
+
+    months = np.unique(month_of(p_dates))
+    for month in months:
+        features = finalize_month_features(_load_month_partials(store_dir, month), window_days)
+        features.insert(1, 'month', month)
+        features['month_chronological_order'] = NUM_MONTHS - month
+        os.makedirs(os.path.dirname(_feature_path(store_dir, month)), exist_ok=True)
+        features.to_parquet(_feature_path(store_dir, month), index=False)
+
+    return [int(month) for month in months]
+
+
+def load_features(store_dir):
+    """Read every month's feature file from the store."""
+    paths = sorted(glob.glob(os.path.join(store_dir, 'features', 'month=*.parquet')))
+    return pd.concat([pd.read_parquet(path) for path in paths], ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fold raw watch events into the monthly feature store.')
+    parser.add_argument('events', nargs='+', help='event files with columns ' + ', '.join(EVENT_COLUMNS))
+    parser.add_argument('--store', default='cache/features')
+    parser.add_argument('--chunksize', type=int, default=5_000_000)
+    args = parser.parse_args()
+
+    for events_path in args.events:
+        months = update_feature_store(events_path, args.store, chunksize=args.chunksize)
+        print(f'{events_path}: rebuilt months {months}')
@@ -0,0 +1,98 @@
+import hashlib
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+
+from analysis_cache import data_fingerprint, function_fingerprint
+from instrumentation import collect, instrument, merge_records
+
+MANIFEST_NAME = '.figure_manifest.json'
+
+
+@dataclass
+class FigureSpec:
+    """One figure: `render(data, path, **options)` must draw and save it to `path`.
+
+    `render` has to be a module-level function so it can be sent to worker processes.
+    """
+    path: str
+    render: object
+    data: object
+    options: dict = field(default_factory=dict)
+
+
+def spec_fingerprint(spec):
+    """Hash of everything that determines the figure: renderer (including its source), input data and options."""
+    source = '|'.join([function_fingerprint(spec.render), data_fingerprint(spec.data),
+                       repr(sorted(spec.options.items()))])
+    return hashlib.sha256(source.encode()).hexdigest()
+
+
+def _init_worker():
+    import matplotlib
+    matplotlib.use('Agg', force=True)
+
+
+def _render(spec):
+    spec.render(spec.data, spec.path, **spec.options)
+    return spec.path
+
+
+def _render_in_worker(spec):
+    """Render in a pool process and hand its stage records back to the parent."""
+    with collect() as records:
+        _render(spec)
+    return spec.path, records
+
+
+def _load_manifest(path):
+    if os.path.exists(path):
+        with open(path) as manifest_file:
+            return json.load(manifest_file)
+    return {}
+
+
+@instrument
+def render_figures(specs, max_workers=None, manifest_dir='.', force=False):
+    """Render every spec whose input hash changed since the last run, in parallel Agg processes.
+
+    Hashes of rendered figures are kept in `manifest_dir`/.figure_manifest.json;
+    a figure is skipped when its file exists and its hash is unchanged (unless
+    `force`). With max_workers=1 figures are rendered in this process.
+    Returns {path: 'rendered' | 'skipped'}.
+    """
+    manifest_path = os.path.join(manifest_dir, MANIFEST_NAME)
+    manifest = _load_manifest(manifest_path)
+
+    status, pending = {}, []
+    for spec in specs:
+        fingerprint = spec_fingerprint(spec)
+        if not force and manifest.get(spec.path) == fingerprint and os.path.exists(spec.path):
+            status[spec.path] = 'skipped'
+        else:
+            pending.append((spec, fingerprint))
+
+    for spec, _ in pending:
+        directory = os.path.dirname(spec.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    if max_workers == 1 or len(pending) <= 1:
+        rendered = [_render(spec) for spec, _ in pending]
+    else:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker) as executor:
+            rendered = []
+            for path, records in executor.map(_render_in_worker, [spec for spec, _ in pending]):
+                merge_records(records, parent='render_figures')
+                rendered.append(path)
+
+    for (spec, fingerprint), path in zip(pending, rendered):
+        manifest[path] = fingerprint
+        status[path] = 'rendered'
+
+    if pending:
+        os.makedirs(manifest_dir, exist_ok=True)
+        with open(manifest_path, 'w') as manifest_file:
+            json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    return status
@@ -1,31 +1,29 @@
+import argparse
+import os
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 
-### Load Data ###
-monthly_user_data = pd.read_csv('path/to/monthly_user_data.csv')
-addiction_status = pd.read_csv('path/to/addiction_data.csv')
-
-# Add chronological month order to `monthly_user_data`
-monthly_user_data['month_chronological_order'] = monthly_user_data['window_id'] + 1
+from analysis_cache import AnalysisCache, file_fingerprint
+from data_loader import load_addiction_data, load_monthly_user_data, merge_and_label
+from figure_rendering import FigureSpec, render_figures
+from instrumentation import instrument
+from quantile_sketch import QuantileSketches
 
-# Ensure month alignment in `addiction_status`
-if 'month' not in addiction_status.columns:
-    addiction_status['month_chronological_order'] = addiction_status['month_chronological_order']
+COVERAGE_COLUMNS = ['level_1_coverage', 'level_2_coverage', 'level_3_coverage']
 
-# Merge dataframes on `user_id` and `month_chronological_order`
-merged_df = pd.merge(
-    monthly_user_data,
-    addiction_status,
-    on=['user_id', 'month_chronological_order'],
-    how='inner'
-)
+# preds_3_label_criteria value -> group name used in the figures
+GROUP_NAMES = {0: 'Non-Addicted', 1: 'Mildly Addicted', 2: 'Severely Addicted'}
 
-# Use merged data for further processing
-monthly_user_data_ratio = merged_df
+COVERAGE_SKETCH_PATH = 'cache/coverage_sketches.json'
 
 ### Helper Functions ###
 
+@instrument
 def calculate_quantiles(df):
     """Calculate median filter bubble thresholds for each level."""
     return {
@@ -34,163 +32,399 @@ def calculate_quantiles(df):
         'level_3': df['level_3_coverage'].quantile(0.5),
     }
 
-def calculate_filter_bubble_with_bootstrap(df, group_name, quantiles, group_size, num_bootstrap=1000):
-    """Calculate filter bubble percentages for each group with bootstrapping."""
+def assign_filter_bubble_levels(coverage, quantiles):
+    """Assign each user-month to filter bubble level 1, 2 or 3 (0 = no bubble).
+
+    `coverage` is an (n, 3) array of level 1/2/3 coverage values. A user only
+    counts towards the first level whose coverage falls below its threshold.
+    """
+    coverage = np.asarray(coverage)
+    fb_l1 = coverage[:, 0] < quantiles['level_1']
+    fb_l2 = (coverage[:, 1] < quantiles['level_2']) & (~fb_l1)
+    fb_l3 = (coverage[:, 2] < quantiles['level_3']) & (~fb_l1) & (~fb_l2)
+
+    levels = np.zeros(len(coverage), dtype=np.int8)
+    levels[fb_l1] = 1
+    levels[fb_l2] = 2
+    levels[fb_l3] = 3
+    return levels
+
+def bootstrap_filter_bubble_counts(levels, group_size, num_bootstrap=1000, seed=None):
+    """Draw bootstrap counts of users in each filter bubble level.
+
+    Resampling `group_size` users with replacement and counting bubble members
+    is a multinomial draw over the level shares, so every replicate is drawn
+    in one call instead of materialising the resampled rows.
+    Returns a (num_bootstrap, 3) array of level 1/2/3 counts.
+    """
+    rng = np.random.default_rng(seed)
+    shares = np.bincount(levels, minlength=4) / len(levels)
+    counts = rng.multinomial(group_size, shares, size=num_bootstrap)
+    return counts[:, 1:]
+
+@instrument
+def calculate_filter_bubble_with_bootstrap(df, group_name, quantiles, group_size, num_bootstrap=1000,
+                                           seed=None, ci=0.95):
+    """Calculate filter bubble percentages for each group with bootstrapping.
+
+    Returns one row per month with the mean bootstrap proportion of each level
+    plus percentile confidence interval columns ('... CI Lower' / '... CI Upper').
+    `seed` may be an int or a np.random.Generator for reproducible results.
+    """
+    rng = np.random.default_rng(seed)
+    levels = assign_filter_bubble_levels(df[COVERAGE_COLUMNS].to_numpy(), quantiles)
+
     fb_list = []
-    for month in df['month_chronological_order'].unique():
-        df_month = df[df['month_chronological_order'] == month]
-        
-        # Initialize counters for each filter bubble level
-        fb_l1_counts, fb_l2_counts, fb_l3_counts = [], [], []
-        
-        # Bootstrap sampling
-        for _ in range(num_bootstrap):
-            sampled_df = df_month.sample(n=group_size, replace=True)
-            
-            fb_l1 = sampled_df['level_1_coverage'] < quantiles['level_1']
-            fb_l2 = (sampled_df['level_2_coverage'] < quantiles['level_2']) & (~fb_l1)
-            fb_l3 = (sampled_df['level_3_coverage'] < quantiles['level_3']) & (~fb_l1) & (~fb_l2)
-            
-            fb_l1_counts.append(fb_l1.sum())
-            fb_l2_counts.append(fb_l2.sum())
-            fb_l3_counts.append(fb_l3.sum())
-        
-        # Calculate mean proportions
-        fb_pct_l1 = np.mean(fb_l1_counts) / group_size
-        fb_pct_l2 = np.mean(fb_l2_counts) / group_size
-        fb_pct_l3 = np.mean(fb_l3_counts) / group_size
-        
-        fb_list.append(
-            pd.Series([fb_pct_l1, fb_pct_l2, fb_pct_l3],
-                      index=[f'Level 1 - {group_name}', f'Level 2 - {group_name}', f'Level 3 - {group_name}'],
-                      name=month)
-        )
-    
+    for month, index in df.groupby('month_chronological_order', sort=False).indices.items():
+        fb_pct = bootstrap_filter_bubble_counts(levels[index], group_size, num_bootstrap, seed=rng) / group_size
+        fb_list.append(summarize_filter_bubble_bootstrap(fb_pct, group_name, month, ci))
+
     return pd.concat(fb_list, axis=1).T
 
-### Filter Data by Groups ###
-nonaddicted_df = monthly_user_data_ratio[
-    monthly_user_data_ratio['user_id'].isin(
-        addiction_status[addiction_status['preds_3_label_criteria'] == 0]['user_id']
+def filter_bubble_columns(group_name):
+    """Result columns of one group: the three level means, then their CI lower and upper bounds."""
+    columns = [f'Level {i} - {group_name}' for i in (1, 2, 3)]
+    return columns + [f'{c} CI Lower' for c in columns] + [f'{c} CI Upper' for c in columns]
+
+def summarize_filter_bubble_bootstrap(fb_pct, group_name, month, ci=0.95):
+    """Reduce (num_bootstrap, 3) bootstrap proportions to means and percentile CIs."""
+    lower, upper = np.percentile(fb_pct, [50 * (1 - ci), 50 * (1 + ci)], axis=0)
+    return pd.Series(np.concatenate([fb_pct.mean(axis=0), lower, upper]),
+                     index=filter_bubble_columns(group_name), name=month)
+
+### Group Assignment and Statistics ###
+
+def group_membership(monthly_user_data_ratio, assignment='ever', addiction_status=None):
+    """(rows x groups) boolean matrix: whether each row belongs to each GROUP_NAMES group (in that order).
+
+    assignment='ever': all of a user's months go to every group whose label the
+    user had in any month, so a user can land in several groups (the original
+    behaviour of this script). The labels are looked up in `addiction_status`
+    when given, as the original script did; otherwise only the labels of the
+    merged rows count, so a user whose labeled months have no coverage row is
+    not in that label's group.
+    assignment='per_month': each user-month goes only to the group of its own label.
+    """
+    group_labels = np.array(list(GROUP_NAMES))
+    if assignment == 'per_month':
+        return monthly_user_data_ratio['preds_3_label_criteria'].to_numpy()[:, None] == group_labels
+    if assignment != 'ever':
+        raise ValueError(f"assignment must be 'ever' or 'per_month', got {assignment!r}")
+
+    if addiction_status is not None:
+        user_ids = monthly_user_data_ratio['user_id'].to_numpy()
+        status_labels = addiction_status['preds_3_label_criteria'].to_numpy()
+        status_users = addiction_status['user_id'].to_numpy()
+        return np.column_stack([np.isin(user_ids, status_users[status_labels == label]) for label in group_labels])
+
+    user_codes, users = pd.factorize(monthly_user_data_ratio['user_id'])
+    is_label = monthly_user_data_ratio['preds_3_label_criteria'].to_numpy()[:, None] == group_labels
+    has_label = np.zeros((len(users), len(group_labels)), dtype=bool)
+    rows, groups = np.nonzero(is_label)
+    has_label[user_codes[rows], groups] = True
+    return has_label[user_codes]
+
+def partition_by_group(monthly_user_data_ratio, assignment='ever', addiction_status=None):
+    """Return {preds_3_label_criteria: row positions} for every addiction group (see group_membership)."""
+    member = group_membership(monthly_user_data_ratio, assignment, addiction_status)
+    return {label: np.flatnonzero(member[:, i]) for i, label in enumerate(GROUP_NAMES)}
+
+def calculate_group_statistics(monthly_user_data_ratio, member):
+    """Median coverage per level and unique user count for every group of a group_membership matrix.
+
+    Each statistic is reduced straight from one column and one group mask, so
+    no per-group copy of the table is built. Empty groups get NaN medians.
+    """
+    user_codes, users = pd.factorize(monthly_user_data_ratio['user_id'])
+    coverage = {column.replace('_coverage', ''): monthly_user_data_ratio[column].to_numpy(dtype=np.float64)
+                for column in COVERAGE_COLUMNS}
+    stats = {}
+    for i, label in enumerate(GROUP_NAMES):
+        mask = member[:, i]
+        row = {level: np.nanmedian(values[mask]) if mask.any() else np.nan for level, values in coverage.items()}
+        row['user_count'] = np.count_nonzero(np.bincount(user_codes[mask], minlength=len(users)))
+        stats[label] = row
+    return pd.DataFrame.from_dict(stats, orient='index').rename_axis('group')
+
+### Streaming Thresholds ###
+
+def update_coverage_sketches(sketches, monthly_user_data_ratio, assignment='per_month', partition=None):
+    """Add a batch of user-months to the per-group coverage sketches.
+
+    Groups are assigned within the batch (so 'ever' only sees the batch's
+    months). A batch whose `partition` id was already added is skipped;
+    returns whether the batch was added.
+    """
+    group_rows = partition_by_group(monthly_user_data_ratio, assignment)
+    return sketches.update_groups(monthly_user_data_ratio, group_rows, COVERAGE_COLUMNS, partition=partition)
+
+def sketch_thresholds(sketches, q=0.5):
+    """Per-group thresholds from the sketches, shaped like calculate_quantiles: {label: {'level_1': ...}}."""
+    return {
+        group: {column.replace('_coverage', ''): value for column, value in quantiles.items()}
+        for group, quantiles in sketches.quantiles(q).items()
+    }
+
+### Parallel Scheduler ###
+
+def task_seed(base_seed, group_name, month):
+    """Derive a stable seed for one (group, month) bootstrap task.
+
+    The seed depends only on the base seed, group and month, so results do not
+    change with the number of workers or the order tasks are scheduled in.
+    """
+    return np.random.SeedSequence([base_seed, zlib.crc32(group_name.encode()), int(month)])
+
+def _run_bootstrap_task(task):
+    """Worker entry point: bootstrap one (group, month) slice of the shared coverage array."""
+    (shm_name, shape, start, stop, group_name, month,
+     quantiles, group_size, num_bootstrap, base_seed, ci) = task
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        coverage = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        levels = assign_filter_bubble_levels(coverage[start:stop], quantiles)
+        del coverage
+    finally:
+        shm.close()
+
+    counts = bootstrap_filter_bubble_counts(
+        levels, group_size, num_bootstrap, seed=task_seed(base_seed, group_name, month)
     )
-]
+    return group_name, summarize_filter_bubble_bootstrap(counts / group_size, group_name, month, ci)
+
+@instrument
+def calculate_filter_bubble_parallel(monthly_user_data_ratio, assignment='ever', group_size=None,
+                                     num_bootstrap=1000, seed=42, ci=0.95, max_workers=None, thresholds=None,
+                                     addiction_status=None):
+    """Run every (group, month) filter bubble bootstrap on a process pool.
+
+    Users are assigned to groups with `group_membership(assignment, addiction_status)`. Each
+    group's coverage rows are copied once into a shared memory block sorted by
+    month; workers receive only offsets into it. `group_size` defaults to the
+    smallest group's unique user count and `max_workers` to the number of CPUs.
+    `thresholds` ({label: {'level_1': ...}}, e.g. from sketch_thresholds)
+    replaces the exact per-group medians.
+    Returns the combined per-month table (means and CI columns) for all groups;
+    a group without rows (e.g. no severely addicted users in a subset) gets
+    NaN columns and does not count towards the default `group_size`.
+    """
+    member = group_membership(monthly_user_data_ratio, assignment, addiction_status)
+    group_rows = {label: np.flatnonzero(member[:, i]) for i, label in enumerate(GROUP_NAMES) if member[:, i].any()}
+    if not group_rows:
+        raise ValueError('no rows with a preds_3_label_criteria group to compute filter bubbles for')
+    group_stats = calculate_group_statistics(monthly_user_data_ratio, member)
+    if group_size is None:
+        group_size = group_stats.loc[list(group_rows), 'user_count'].min()
+
+    # Lay out all groups' coverage rows back to back, each sorted by month
+    all_coverage = monthly_user_data_ratio[COVERAGE_COLUMNS].to_numpy(dtype=np.float64)
+    all_months = monthly_user_data_ratio['month_chronological_order'].to_numpy()
+    blocks, task_slices, offset = [], [], 0
+    for label, rows in group_rows.items():
+        rows = rows[np.argsort(all_months[rows], kind='stable')]
+        name = GROUP_NAMES[label]
+        if thresholds is not None:
+            quantiles = thresholds[label]
+        else:
+            quantiles = group_stats.loc[label, ['level_1', 'level_2', 'level_3']].to_dict()
+        months, starts = np.unique(all_months[rows], return_index=True)
+        stops = np.append(starts[1:], len(rows))
+        for month, start, stop in zip(months, starts, stops):
+            task_slices.append((offset + start, offset + stop, name, month, quantiles))
+        blocks.append(all_coverage[rows])
+        offset += len(rows)
+    coverage = np.concatenate(blocks)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(coverage.nbytes, 1))
+    try:
+        np.ndarray(coverage.shape, dtype=np.float64, buffer=shm.buf)[:] = coverage
+        tasks = [
+            (shm.name, coverage.shape, start, stop, name, month, quantiles, group_size, num_bootstrap, seed, ci)
+            for start, stop, name, month, quantiles in task_slices
+        ]
+        max_workers = max_workers or os.cpu_count()
+        if max_workers == 1:
+            results = list(map(_run_bootstrap_task, tasks))
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(_run_bootstrap_task, tasks,
+                                            chunksize=max(1, len(tasks) // (4 * max_workers))))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    filter_bubble = []
+    for name in GROUP_NAMES.values():
+        rows = [row for group, row in results if group == name]
+        if rows:
+            filter_bubble.append(pd.concat(rows, axis=1).T)
+    columns = [column for name in GROUP_NAMES.values() for column in filter_bubble_columns(name)]
+    combined_df = pd.concat(filter_bubble, axis=1).reindex(columns=columns)
+    combined_df.index = pd.to_numeric(combined_df.index)
+    return combined_df.sort_index()
+
+### Plotting Functions ###
+
+FILTER_BUBBLE_COLORS = ['#22974F', '#76c8e9', '#e9768f']
+
+@instrument
+def filter_bubble_plot_data(combined_df):
+    """Mean proportions for both figures, computed once (CI columns are dropped).
+
+    Returns {'groups': per-group frame, 'combined': Non-Addicted plus an
+    'Addicted' sum of the Mildly and Severely Addicted proportions}.
+    """
+    # Keep the confidence intervals aside; the plots use the mean proportions
+    groups = combined_df.drop(columns=combined_df.filter(like=' CI ').columns)
+    combined = groups.filter(like='Non-Addicted').copy()
+    for level in (1, 2, 3):
+        combined[f'Level {level} - Addicted'] = (groups[f'Level {level} - Mildly Addicted']
+                                                 + groups[f'Level {level} - Severely Addicted'])
+    return {'groups': groups, 'combined': combined}
+
+@instrument
+def plot_filter_bubble_all_groups(combined_df, path='filter_bubble_ratios_all_groups.pdf'):
+    """Plot 1: stacked level proportions for Non-Addicted, Mildly Addicted and Severely Addicted."""
+    fig, ax = plt.subplots(figsize=(15, 8))
+
+    x = np.arange(len(combined_df.index)) + 1
+    bar_width = 0.25
+
+    colors = FILTER_BUBBLE_COLORS
+
+    # Plot Non-Addicted
+    ax.bar(x - bar_width, combined_df['Level 1 - Non-Addicted'], width=bar_width, color=colors[0], label='Level 1 - Non-Addicted', alpha=0.3)
+    ax.bar(x - bar_width, combined_df['Level 2 - Non-Addicted'], width=bar_width, color=colors[1], bottom=combined_df['Level 1 - Non-Addicted'], alpha=0.3)
+    ax.bar(x - bar_width, combined_df['Level 3 - Non-Addicted'], width=bar_width, color=colors[2], bottom=combined_df['Level 1 - Non-Addicted'] + combined_df['Level 2 - Non-Addicted'], alpha=0.3)
+
+    # Plot Mildly Addicted
+    ax.bar(x, combined_df['Level 1 - Mildly Addicted'], width=bar_width, color=colors[0], label='Level 1 - Mildly Addicted', alpha=0.55)
+    ax.bar(x, combined_df['Level 2 - Mildly Addicted'], width=bar_width, color=colors[1], bottom=combined_df['Level 1 - Mildly Addicted'], alpha=0.55)
+    ax.bar(x, combined_df['Level 3 - Mildly Addicted'], width=bar_width, color=colors[2], bottom=combined_df['Level 1 - Mildly Addicted'] + combined_df['Level 2 - Mildly Addicted'], alpha=0.55)
 
-soft_addicted_df = monthly_user_data_ratio[
-    monthly_user_data_ratio['user_id'].isin(
-        addiction_status[addiction_status['preds_3_label_criteria'] == 1]['user_id']
+    # Plot Severely Addicted
+    ax.bar(x + bar_width, combined_df['Level 1 - Severely Addicted'], width=bar_width, color=colors[0], label='Level 1 - Severely Addicted', alpha=0.99)
+    ax.bar(x + bar_width, combined_df['Level 2 - Severely Addicted'], width=bar_width, color=colors[1], bottom=combined_df['Level 1 - Severely Addicted'], alpha=0.99)
+    ax.bar(x + bar_width, combined_df['Level 3 - Severely Addicted'], width=bar_width, color=colors[2], bottom=combined_df['Level 1 - Severely Addicted'] + combined_df['Level 2 - Severely Addicted'], alpha=0.99)
+
+    ax.set_xlabel('Month', fontsize=16)
+    ax.set_ylabel('Ratio of Users in Filter Bubble', fontsize=16)
+    ax.set_xticks(x)
+    ax.legend(
+        handles=[
+            plt.Line2D([0], [0], color='#22974F', lw=6, alpha=1, label='Level 1'),
+            plt.Line2D([0], [0], color='#76c8e9', lw=6, alpha=1, label='Level 2'),
+            plt.Line2D([0], [0], color='#e9768f', lw=6, alpha=1, label='Level 3'),
+            plt.Line2D([0], [0], color='black', lw=0, label='Non-Addicted', marker='s', markersize=10, alpha=0.3),
+            plt.Line2D([0], [0], color='black', lw=0, label='Mildly Addicted', marker='s', markersize=10, alpha=0.55),
+            plt.Line2D([0], [0], color='black', lw=0, label='Severely Addicted', marker='s', markersize=10, alpha=0.99),
+        ],
+        loc='upper center',
+        bbox_to_anchor=(0.5, 1.2),
+        ncol=2,
+        fontsize=12,
+        title="Levels and Groups"
     )
-]
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+    plt.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+@instrument
+def plot_filter_bubble_combined(combined_df, path='filter_bubble_ratios_combined_addicted.pdf'):
+    """Plot 2: Non-Addicted vs the combined Addicted group."""
+    fig, ax = plt.subplots(figsize=(10, 6))
+
+    x = np.arange(len(combined_df.index)) + 1
+    bar_width = 0.25
+
+    colors = FILTER_BUBBLE_COLORS
 
-hard_addicted_df = monthly_user_data_ratio[
-    monthly_user_data_ratio['user_id'].isin(
-        addiction_status[addiction_status['preds_3_label_criteria'] == 2]['user_id']
+    ax.bar(x - bar_width / 2, combined_df['Level 1 - Non-Addicted'], width=bar_width, color=colors[0], label='Level 1 - Non-Addicted', alpha=0.5)
+    ax.bar(x - bar_width / 2, combined_df['Level 2 - Non-Addicted'], width=bar_width, color=colors[1], bottom=combined_df['Level 1 - Non-Addicted'], alpha=0.5)
+    ax.bar(x - bar_width / 2, combined_df['Level 3 - Non-Addicted'], width=bar_width, color=colors[2], bottom=combined_df['Level 1 - Non-Addicted'] + combined_df['Level 2 - Non-Addicted'], alpha=0.5)
+
+    ax.bar(x + bar_width / 2, combined_df['Level 1 - Addicted'], width=bar_width, color=colors[0], label='Level 1 - Addicted', alpha=0.99)
+    ax.bar(x + bar_width / 2, combined_df['Level 2 - Addicted'], width=bar_width, color=colors[1], bottom=combined_df['Level 1 - Addicted'], alpha=0.99)
+    ax.bar(x + bar_width / 2, combined_df['Level 3 - Addicted'], width=bar_width, color=colors[2], bottom=combined_df['Level 1 - Addicted'] + combined_df['Level 2 - Addicted'], alpha=0.99)
+
+    ax.set_xlabel('Month', fontsize=16)
+    ax.set_ylabel('Ratio of Users in Filter Bubble', fontsize=16)
+    ax.set_xticks(x)
+    ax.legend(
+        handles=[
+            plt.Line2D([0], [0], color='#22974F', lw=6, alpha=1, label='Level 1'),
+            plt.Line2D([0], [0], color='#76c8e9', lw=6, alpha=1, label='Level 2'),
+            plt.Line2D([0], [0], color='#e9768f', lw=6, alpha=1, label='Level 3'),
+            plt.Line2D([0], [0], color='black', lw=0, label='Non-Addicted', marker='s', markersize=10, alpha=0.5),
+            plt.Line2D([0], [0], color='black', lw=0, label='Addicted', marker='s', markersize=10, alpha=0.99),
+        ],
+        loc='upper center',
+        bbox_to_anchor=(0.5, 1.2),
+        ncol=2,
+        fontsize=12,
+        title="Levels and Groups"
     )
-]
-
-# Calculate the smallest group size for bootstrapping
-smallest_group_size = min(
-    nonaddicted_df['user_id'].nunique(),
-    soft_addicted_df['user_id'].nunique(),
-    hard_addicted_df['user_id'].nunique()
-)
-
-### Calculate Quantiles and Filter Bubble Data ###
-q5_nonaddicted = calculate_quantiles(nonaddicted_df)
-q5_soft_addicted = calculate_quantiles(soft_addicted_df)
-q5_hard_addicted = calculate_quantiles(hard_addicted_df)
-
-filter_bubble_nonaddicted = calculate_filter_bubble_with_bootstrap(
-    nonaddicted_df, "Non-Addicted", q5_nonaddicted, group_size=smallest_group_size
-)
-
-filter_bubble_soft_addicted = calculate_filter_bubble_with_bootstrap(
-    soft_addicted_df, "Mildly Addicted", q5_soft_addicted, group_size=smallest_group_size
-)
-
-filter_bubble_hard_addicted = calculate_filter_bubble_with_bootstrap(
-    hard_addicted_df, "Severely Addicted", q5_hard_addicted, group_size=smallest_group_size
-)
-
-# Combine results for plotting
-combined_df = pd.concat([filter_bubble_nonaddicted, filter_bubble_soft_addicted, filter_bubble_hard_addicted], axis=1)
-combined_df.index = pd.to_numeric(combined_df.index)
-combined_df.sort_index(inplace=True)
-
-### Plot 1: Non-Addicted, Mildly Addicted, Severely Addicted ###
-fig, ax = plt.subplots(figsize=(15, 8))
-
-x = np.arange(len(combined_df.index)) + 1
-bar_width = 0.25
-
-colors = ['#22974F', '#76c8e9', '#e9768f']
-
-# Plot Non-Addicted
-ax.bar(x - bar_width, combined_df['Level 1 - Non-Addicted'], width=bar_width, color=colors[0], label='Level 1 - Non-Addicted', alpha=0.3)
-ax.bar(x - bar_width, combined_df['Level 2 - Non-Addicted'], width=bar_width, color=colors[1], bottom=combined_df['Level 1 - Non-Addicted'], alpha=0.3)
-ax.bar(x - bar_width, combined_df['Level 3 - Non-Addicted'], width=bar_width, color=colors[2], bottom=combined_df['Level 1 - Non-Addicted'] + combined_df['Level 2 - Non-Addicted'], alpha=0.3)
-
-# Plot Mildly Addicted
-ax.bar(x, combined_df['Level 1 - Mildly Addicted'], width=bar_width, color=colors[0], label='Level 1 - Mildly Addicted', alpha=0.55)
-ax.bar(x, combined_df['Level 2 - Mildly Addicted'], width=bar_width, color=colors[1], bottom=combined_df['Level 1 - Mildly Addicted'], alpha=0.55)
-ax.bar(x, combined_df['Level 3 - Mildly Addicted'], width=bar_width, color=colors[2], bottom=combined_df['Level 1 - Mildly Addicted'] + combined_df['Level 2 - Mildly Addicted'], alpha=0.55)
-
-# Plot Severely Addicted
-ax.bar(x + bar_width, combined_df['Level 1 - Severely Addicted'], width=bar_width, color=colors[0], label='Level 1 - Severely Addicted', alpha=0.99)
-ax.bar(x + bar_width, combined_df['Level 2 - Severely Addicted'], width=bar_width, color=colors[1], bottom=combined_df['Level 1 - Severely Addicted'], alpha=0.99)
-ax.bar(x + bar_width, combined_df['Level 3 - Severely Addicted'], width=bar_width, color=colors[2], bottom=combined_df['Level 1 - Severely Addicted'] + combined_df['Level 2 - Severely Addicted'], alpha=0.99)
-
-ax.set_xlabel('Month', fontsize=16)
-ax.set_ylabel('Ratio of Users in Filter Bubble', fontsize=16)
-ax.set_xticks(x)
-ax.legend(
-    handles=[
-        plt.Line2D([0], [0], color='#22974F', lw=6, alpha=1, label='Level 1'),
-        plt.Line2D([0], [0], color='#76c8e9', lw=6, alpha=1, label='Level 2'),
-        plt.Line2D([0], [0], color='#e9768f', lw=6, alpha=1, label='Level 3'),
-        plt.Line2D([0], [0], color='black', lw=0, label='Non-Addicted', marker='s', markersize=10, alpha=0.3),
-        plt.Line2D([0], [0], color='black', lw=0, label='Mildly Addicted', marker='s', markersize=10, alpha=0.55),
-        plt.Line2D([0], [0], color='black', lw=0, label='Severely Addicted', marker='s', markersize=10, alpha=0.99),
-    ],
-    loc='upper center',
-    bbox_to_anchor=(0.5, 1.2),
-    ncol=2,
-    fontsize=12,
-    title="Levels and Groups"
-)
-ax.grid(axis='y', linestyle='--', alpha=0.7)
-plt.tight_layout()
-plt.savefig('filter_bubble_ratios_all_groups.pdf')
-
-### Plot 2: Non-Addicted vs Combined Addicted ###
-addicted = combined_df.filter(like='Mildly Addicted').add(combined_df.filter(like='Severely Addicted'), fill_value=0)
-
-fig, ax = plt.subplots(figsize=(10, 6))
-
-ax.bar(x - bar_width / 2, combined_df['Level 1 - Non-Addicted'], width=bar_width, color=colors[0], label='Level 1 - Non-Addicted', alpha=0.5)
-ax.bar(x - bar_width / 2, combined_df['Level 2 - Non-Addicted'], width=bar_width, color=colors[1], bottom=combined_df['Level 1 - Non-Addicted'], alpha=0.5)
-ax.bar(x - bar_width / 2, combined_df['Level 3 - Non-Addicted'], width=bar_width, color=colors[2], bottom=combined_df['Level 1 - Non-Addicted'] + combined_df['Level 2 - Non-Addicted'], alpha=0.5)
-
-ax.bar(x + bar_width / 2, addicted.iloc[:, 0], width=bar_width, color=colors[0], label='Level 1 - Addicted', alpha=0.99)
-ax.bar(x + bar_width / 2, addicted.iloc[:, 1], width=bar_width, color=colors[1], bottom=addicted.iloc[:, 0], alpha=0.99)
-ax.bar(x + bar_width / 2, addicted.iloc[:, 2], width=bar_width, color=colors[2], bottom=addicted.iloc[:, 0] + addicted.iloc[:, 1], alpha=0.99)
-
-ax.set_xlabel('Month', fontsize=16)
-ax.set_ylabel('Ratio of Users in Filter Bubble', fontsize=16)
-ax.set_xticks(x)
-ax.legend(
-    handles=[
-        plt.Line2D([0], [0], color='#22974F', lw=6, alpha=1, label='Level 1'),
-        plt.Line2D([0], [0], color='#76c8e9', lw=6, alpha=1, label='Level 2'),
-        plt.Line2D([0], [0], color='#e9768f', lw=6, alpha=1, label='Level 3'),
-        plt.Line2D([0], [0], color='black', lw=0, label='Non-Addicted', marker='s', markersize=10, alpha=0.5),
-        plt.Line2D([0], [0], color='black', lw=0, label='Addicted', marker='s', markersize=10, alpha=0.99),
-    ],
-    loc='upper center',
-    bbox_to_anchor=(0.5, 1.2),
-    ncol=2,
-    fontsize=12,
-    title="Levels and Groups"
-)
-ax.grid(axis='y', linestyle='--', alpha=0.7)
-plt.tight_layout()
-plt.savefig('filter_bubble_ratios_combined_addicted.pdf')
\ No newline at end of file
+    ax.grid(axis='y', linestyle='--', alpha=0.7)
+    plt.tight_layout()
+    fig.savefig(path)
+    plt.close(fig)
+
+def filter_bubble_figure_specs(combined_df, output_dir='.'):
+    """Both filter bubble figures as FigureSpecs over shared plot data."""
+    plot_data = filter_bubble_plot_data(combined_df)
+    return [
+        FigureSpec(os.path.join(output_dir, 'filter_bubble_ratios_all_groups.pdf'), plot_filter_bubble_all_groups,
+                   plot_data['groups']),
+        FigureSpec(os.path.join(output_dir, 'filter_bubble_ratios_combined_addicted.pdf'), plot_filter_bubble_combined,
+                   plot_data['combined']),
+    ]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Filter bubble ratios per addiction group and month.')
+    parser.add_argument('--sketch-thresholds', action='store_true',
+                        help='use medians from the persisted coverage sketches (updated with this data) '
+                             'instead of exact medians')
+    args = parser.parse_args()
+
+    ### Load Data ###
+    # Typed, column-pruned loads (also adds chronological month order to `monthly_user_data`)
+    input_paths = ['path/to/monthly_user_data.csv', 'path/to/addiction_data.csv']
+    monthly_user_data = load_monthly_user_data(input_paths[0])
+    addiction_status = load_addiction_data(input_paths[1])
+
+    # Ensure month alignment in `addiction_status`
+    if 'month' not in addiction_status.columns:
+        addiction_status['month_chronological_order'] = addiction_status['month_chronological_order']
+
+    # Merge dataframes on `user_id` and `month_chronological_order`
+    merged_df = merge_and_label(monthly_user_data, addiction_status)
+
+    # Use merged data for further processing
+    monthly_user_data_ratio = merged_df
+
+    ### Calculate Filter Bubble Data ###
+    # Users are assigned to a group if they had that label in any month
+    # (use assignment='per_month' to group each user-month by its own label).
+    # Every (group, month) bootstrap runs as an independent task on all cores.
+    # Results are cached on the merged data and parameters, so reruns skip the bootstrap
+    thresholds = None
+    if args.sketch_thresholds:
+        # The sketches persist between runs; each input file pair is added once
+        sketches = QuantileSketches.load(COVERAGE_SKETCH_PATH)
+        update_coverage_sketches(sketches, monthly_user_data_ratio, assignment='ever',
+                                 partition=file_fingerprint(input_paths))
+        sketches.save(COVERAGE_SKETCH_PATH)
+        print(sketches.report())
+        thresholds = sketch_thresholds(sketches)
+
+    cache = AnalysisCache()
+    combined_df = cache.cached(calculate_filter_bubble_parallel, ignore=('max_workers',))(
+        monthly_user_data_ratio, assignment='ever', seed=42, thresholds=thresholds, addiction_status=addiction_status)
+    print(cache.report())
+    combined_df.to_csv('filter_bubble_ratios.csv')
+
+    ### Plot Filter Bubble Data ###
+    # Both figures render in parallel and are skipped when their inputs are unchanged
+    render_figures(filter_bubble_figure_specs(combined_df))
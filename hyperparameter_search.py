@@ -0,0 +1,226 @@
+import argparse
+import hashlib
+import json
+import math
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from data_loader import MODEL_FEATURES
+from model_training import TRAINING_CONFIGS, build_folds, worker_threads
+
+# Grid the search samples from; the remaining keys of TRAINING_CONFIGS stay fixed
+SEARCH_SPACE = {
+    'max_depth': [3, 4, 5, 6, 8],
+    'min_child_weight': [1, 3, 5],
+    'gamma': [0, 1, 2],
+    'eta': [0.01, 0.03, 0.1, 0.3],
+    'subsample': [0.6, 0.7, 0.8, 1.0],
+    'colsample_bytree': [0.6, 0.7, 0.8, 1.0],
+}
+
+SEARCH_STORE_DIR = 'cache/search'
+
+
+def config_key(config):
+    """Stable short hash of a parameter dict."""
+    return hashlib.sha1(json.dumps(config, sort_keys=True).encode()).hexdigest()[:12]
+
+
+def sample_configs(space, num_configs, seed=42):
+    """Draw up to `num_configs` distinct configurations from the grid `space`, reproducibly."""
+    names = list(space)
+    shape = [len(space[name]) for name in names]
+    grid_size = int(np.prod(shape))
+    rng = np.random.default_rng(seed)
+    flat = rng.choice(grid_size, size=min(num_configs, grid_size), replace=False)
+    positions = np.unravel_index(flat, shape)
+    return [{name: space[name][int(pos[i])] for name, pos in zip(names, positions)} for i in range(len(flat))]
+
+
+def hyperband_brackets(min_rounds, max_rounds, reduction=3):
+    """Hyperband schedule: a list of brackets, each a list of (num_configs, num_round) rungs.
+
+    Bracket s starts n configs at max_rounds * reduction**-s rounds and keeps the
+    top 1/reduction at each rung; every bracket spends roughly the same budget.
+    """
+    s_max = int(math.floor(math.log(max_rounds / min_rounds, reduction) + 1e-9))
+    brackets = []
+    for s in range(s_max, -1, -1):
+        num_configs = int(math.ceil((s_max + 1) / (s + 1) * reduction ** s))
+        brackets.append([
+            (max(1, num_configs // reduction ** i), int(round(max_rounds * reduction ** (i - s))))
+            for i in range(s + 1)
+        ])
+    return brackets
+
+
+### Results store ###
+
+class SearchStore:
+    """Append-only JSON-lines record of evaluated (config, rounds) pairs plus the fold boosters.
+
+    Each rung result is written as soon as it is computed and boosters are saved
+    after every rung, so an interrupted search skips finished evaluations and
+    warm-starts the rest from the last saved boosters.
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.results_path = os.path.join(store_dir, 'results.jsonl')
+        os.makedirs(os.path.join(store_dir, 'boosters'), exist_ok=True)
+        self.records = {}
+        if os.path.exists(self.results_path):
+            with open(self.results_path) as results_file:
+                for line in results_file:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.records[(record['config_key'], record['num_round'])] = record
+
+    def get(self, key, num_round):
+        return self.records.get((key, num_round))
+
+    def add(self, record):
+        with open(self.results_path, 'a') as results_file:
+            results_file.write(json.dumps(record) + '\n')
+        self.records[(record['config_key'], record['num_round'])] = record
+
+    def booster_path(self, key, fold_index):
+        return os.path.join(self.store_dir, 'boosters', f'{key}_fold{fold_index}.ubj')
+
+    def to_frame(self):
+        return pd.DataFrame(list(self.records.values()))
+
+
+### Search ###
+
+def _advance_fold(fold, params, num_round, booster_path, early_stopping_rounds, nthread):
+    """Continue one fold's booster up to `num_round` rounds with early stopping on the test AUC.
+
+    Returns (best test AUC, best iteration, stopped early).
+    """
+    bst = xgb.Booster(model_file=booster_path) if os.path.exists(booster_path) else None
+    best_score, best_iteration, stopped = -np.inf, -1, False
+    if bst is not None:
+        best_score = float(bst.attr('best_score') or -np.inf)
+        best_iteration = int(bst.attr('best_iteration') or -1)
+        stopped = bst.attr('stopped') == '1'
+
+    done_rounds = bst.num_boosted_rounds() if bst is not None else 0
+    if not stopped and done_rounds < num_round:
+        fold_params = dict(params, scale_pos_weight=fold.scale_pos_weight, nthread=nthread)
+        bst = xgb.train(fold_params, fold.dtrain, num_round - done_rounds, evals=[(fold.dtest, 'test')],
+                        early_stopping_rounds=early_stopping_rounds, xgb_model=bst, verbose_eval=False)
+        # A resumed session only tracks its own best round, so keep the overall best
+        if float(bst.attr('best_score')) > best_score:
+            best_score, best_iteration = float(bst.attr('best_score')), int(bst.attr('best_iteration'))
+        stopped = bst.num_boosted_rounds() < num_round
+        bst.set_attr(best_score=str(best_score), best_iteration=str(best_iteration), stopped='1' if stopped else '0')
+        bst.save_model(booster_path)
+    return best_score, best_iteration, stopped
+
+
+def evaluate_config(folds, config, base_params, num_round, store, early_stopping_rounds=20, max_workers=None):
+    """Mean fold AUC of `config` at `num_round` rounds, reusing stored results and boosters."""
+    key = config_key(config)
+    record = store.get(key, num_round)
+    if record is not None:
+        return record
+
+    params = dict(base_params, **config)
+    max_workers, nthread = worker_threads(len(folds), max_workers)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        fold_results = list(executor.map(
+            lambda fold: _advance_fold(fold, params, num_round, store.booster_path(key, fold.index),
+                                       early_stopping_rounds, nthread),
+            folds))
+
+    fold_auc, best_iterations, stopped = (list(values) for values in zip(*fold_results))
+    record = {
+        'config_key': key,
+        'num_round': num_round,
+        'params': config,
+        'mean_auc': float(np.mean(fold_auc)),
+        'fold_auc': fold_auc,
+        'best_iterations': best_iterations,
+        'stopped': stopped,
+        'seconds': time.perf_counter() - start,
+    }
+    store.add(record)
+    return record
+
+
+def successive_halving(folds, configs, rungs, base_params, store, early_stopping_rounds=20, max_workers=None):
+    """Run `configs` through the (num_configs, num_round) `rungs`, keeping the best by mean AUC."""
+    survivors = configs
+    records = []
+    for num_configs, num_round in rungs:
+        survivors = survivors[:num_configs]
+        records = [evaluate_config(folds, config, base_params, num_round, store,
+                                   early_stopping_rounds=early_stopping_rounds, max_workers=max_workers)
+                   for config in survivors]
+        order = np.argsort([-record['mean_auc'] for record in records], kind='stable')
+        survivors = [survivors[i] for i in order]
+        records = [records[i] for i in order]
+    return records
+
+
+def search_hyperparameters(df_all, target, features=MODEL_FEATURES, space=SEARCH_SPACE, min_rounds=10,
+                           max_rounds=810, reduction=3, early_stopping_rounds=20, seed=42,
+                           store_dir=SEARCH_STORE_DIR, max_workers=None):
+    """Hyperband search for `target` over `space` on the stratified 5-fold split.
+
+    Folds are built once. Configurations are drawn without replacement for all
+    brackets up front (same `seed` gives the same draws, which is what makes
+    resuming possible), then each bracket runs successive halving with
+    warm-started boosters. Results persist in `store_dir`/`target`.
+    Returns all evaluated (config, rounds) records sorted by mean fold AUC.
+    """
+    base_params, _ = TRAINING_CONFIGS[target]
+    folds = build_folds(df_all, target, features)
+    store = SearchStore(os.path.join(store_dir, target))
+
+    brackets = hyperband_brackets(min_rounds, max_rounds, reduction)
+    configs = sample_configs(space, sum(rungs[0][0] for rungs in brackets), seed=seed)
+    start = 0
+    for rungs in brackets:
+        bracket_configs = configs[start:start + rungs[0][0]]
+        start += rungs[0][0]
+        if bracket_configs:
+            successive_halving(folds, bracket_configs, rungs, base_params, store,
+                               early_stopping_rounds=early_stopping_rounds, max_workers=max_workers)
+
+    return store.to_frame().sort_values('mean_auc', ascending=False).reset_index(drop=True)
+
+
+def best_params(results, target):
+    """Full XGBoost params and num_round of the best search record (rounds = mean best iteration + 1)."""
+    best = results.iloc[0]
+    base_params, _ = TRAINING_CONFIGS[target]
+    return dict(base_params, **best['params']), int(round(np.mean(best['best_iterations']))) + 1
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Hyperband search for the soft/hard criteria XGBoost models.')
+    parser.add_argument('data', help='CSV with the model features and soft_criteria / hard_criteria columns')
+    parser.add_argument('target', choices=list(TRAINING_CONFIGS))
+    parser.add_argument('--min-rounds', type=int, default=10)
+    parser.add_argument('--max-rounds', type=int, default=810)
+    parser.add_argument('--reduction', type=int, default=3)
+    parser.add_argument('--early-stopping-rounds', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--store', default=SEARCH_STORE_DIR)
+    args = parser.parse_args()
+
+    df_all = pd.read_csv(args.data)
+    results = search_hyperparameters(df_all, args.target, min_rounds=args.min_rounds, max_rounds=args.max_rounds,
+                                     reduction=args.reduction, early_stopping_rounds=args.early_stopping_rounds,
+                                     seed=args.seed, store_dir=args.store)
+    params, num_round = best_params(results, args.target)
+    print(results[['config_key', 'num_round', 'mean_auc', 'seconds']].head(10).to_string(index=False))
+    print(f'best: {params} num_round={num_round}  total {results["seconds"].sum():.0f}s')
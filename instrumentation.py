@@ -0,0 +1,251 @@
+import argparse
+import atexit
+import contextlib
+import cProfile
+import datetime
+import functools
+import json
+import os
+import pstats
+import runpy
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# PIPELINE_PROFILE=1 records stage timings; add ",cprofile" and/or ",tracemalloc" for deeper data
+PROFILE_ENV = 'PIPELINE_PROFILE'
+REPORT_ENV = 'PIPELINE_PROFILE_REPORT'
+DEFAULT_REPORT_PATH = 'profile_report.json'
+PROFILE_OPTIONS = {'cprofile', 'tracemalloc'}
+
+
+class _State:
+    enabled = False
+    options = frozenset()
+    report_path = DEFAULT_REPORT_PATH
+    records = []
+    stack = []
+    started = None
+    profile_count = 0
+
+
+_state = _State()
+
+
+def current_rss():
+    """Resident set size of this process in bytes (0 where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def enable(options=(), report_path=None):
+    """Turn instrumentation on for this process; the report is written at exit."""
+    unknown = set(options) - PROFILE_OPTIONS
+    if unknown:
+        raise ValueError(f'unknown profile options: {sorted(unknown)}')
+    if not _state.enabled:
+        atexit.register(write_report)
+    _state.enabled = True
+    _state.options = frozenset(options)
+    _state.report_path = report_path or os.environ.get(REPORT_ENV, DEFAULT_REPORT_PATH)
+    _state.started = time.time()
+    if 'tracemalloc' in _state.options and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+
+def enable_from_env():
+    """Enable instrumentation when PIPELINE_PROFILE is set (e.g. '1' or '1,cprofile,tracemalloc')."""
+    value = os.environ.get(PROFILE_ENV, '').strip()
+    if value and value.lower() not in ('0', 'false', 'no'):
+        enable([option for option in value.lower().split(',') if option in PROFILE_OPTIONS])
+
+
+def is_enabled():
+    return _state.enabled
+
+
+def _count_rows(value):
+    if isinstance(value, (pd.DataFrame, pd.Series, np.ndarray)):
+        return len(value)
+    return None
+
+
+### Stages ###
+
+@contextlib.contextmanager
+def stage(name, rows=None):
+    """Record wall time, CPU time, RSS delta and optional profiles for the enclosed block.
+
+    Yields the stage record (a dict) so callers can set 'rows' once known.
+    Nested stages keep their parent's name; cProfile only runs on the outermost
+    profiled stage since profilers cannot nest, and the tracemalloc top
+    allocations are listed for outermost stages only.
+    """
+    if not _state.enabled:
+        yield {}
+        return
+
+    record = {'stage': name, 'parent': _state.stack[-1]['stage'] if _state.stack else None,
+              'depth': len(_state.stack), 'rows': rows}
+    profiler = None
+    if 'cprofile' in _state.options and not any(entry.get('_profiling') for entry in _state.stack):
+        profiler = cProfile.Profile()
+        record['_profiling'] = True
+    tracing = tracemalloc.is_tracing()
+    if tracing:
+        tracemalloc.reset_peak()
+        record['_traced_start'] = tracemalloc.get_traced_memory()[0]
+        record['_traced_peak'] = 0
+
+    _state.stack.append(record)
+    rss_start = current_rss()
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        record['wall_seconds'] = time.perf_counter() - wall_start
+        record['cpu_seconds'] = time.process_time() - cpu_start
+        record['rss_start_mb'] = rss_start / 1024 ** 2
+        record['rss_delta_mb'] = (current_rss() - rss_start) / 1024 ** 2
+        _state.stack.pop()
+
+        if tracing:
+            peak = max(record.pop('_traced_peak'), tracemalloc.get_traced_memory()[1])
+            record['traced_peak_mb'] = (peak - record.pop('_traced_start')) / 1024 ** 2
+            if _state.stack:
+                _state.stack[-1]['_traced_peak'] = max(_state.stack[-1].get('_traced_peak', 0), peak)
+            else:
+                # Snapshots are slow; taking them inside a parent stage would inflate its timings
+                record['top_allocations'] = [
+                    str(statistic) for statistic in tracemalloc.take_snapshot().statistics('lineno')[:5]]
+            tracemalloc.reset_peak()
+        if profiler is not None:
+            record.pop('_profiling')
+            record['profile_path'], record['top_functions'] = _save_profile(profiler, name)
+        _state.records.append(record)
+
+
+def _save_profile(profiler, name):
+    """Dump a stage's cProfile stats next to the report and return (path, top 10 by cumulative time)."""
+    _state.profile_count += 1
+    profile_dir = os.path.splitext(_state.report_path)[0] + '_profiles'
+    os.makedirs(profile_dir, exist_ok=True)
+    path = os.path.join(profile_dir, f'{_state.profile_count:03d}_{name}.prof')
+    profiler.dump_stats(path)
+
+    stats = pstats.Stats(profiler)
+    top = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:10]
+    return path, [{'function': f'{filename}:{line}({function})', 'calls': calls, 'cumulative_seconds': cumulative}
+                  for (filename, line, function), (_, calls, _, cumulative, _) in top]
+
+
+def instrument(func=None, name=None):
+    """Decorator that runs the function inside stage(); a plain call when instrumentation is off.
+
+    rows is the length of the returned frame / array, or of the first frame argument.
+    """
+    if func is None:
+        return functools.partial(instrument, name=name)
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _state.enabled:
+            return func(*args, **kwargs)
+        with stage(name or func.__name__) as record:
+            result = func(*args, **kwargs)
+            rows = _count_rows(result)
+            if rows is None:
+                rows = next((_count_rows(arg) for arg in args if _count_rows(arg) is not None), None)
+            record['rows'] = rows
+        return result
+    return wrapper
+
+
+@contextlib.contextmanager
+def collect():
+    """Record stages into a fresh list (e.g. inside a worker process) and yield it."""
+    saved = _state.records, _state.stack
+    _state.records, _state.stack = [], []
+    try:
+        yield _state.records
+    finally:
+        _state.records, _state.stack = saved
+
+
+def merge_records(records, parent=None):
+    """Add stage records collected elsewhere (worker processes) to this process's report."""
+    for record in records:
+        _state.records.append(dict(record, parent=record['parent'] or parent, worker=True))
+
+
+### Report ###
+
+def summarize(records=None):
+    """Total wall / CPU seconds, call count and rows per stage name."""
+    records = _state.records if records is None else records
+    if not records:
+        return pd.DataFrame(columns=['calls', 'wall_seconds', 'cpu_seconds', 'rows'])
+    frame = pd.DataFrame(records)
+    return (frame.groupby('stage', sort=False)
+            .agg(calls=('stage', 'size'), wall_seconds=('wall_seconds', 'sum'),
+                 cpu_seconds=('cpu_seconds', 'sum'), rows=('rows', 'sum'))
+            .sort_values('wall_seconds', ascending=False))
+
+
+def write_report(path=None):
+    """Write the run report (metadata, per-call stage records and per-stage summary) as JSON."""
+    if not _state.enabled or not _state.records:
+        return None
+    path = path or _state.report_path
+    report = {
+        'started': datetime.datetime.fromtimestamp(_state.started).isoformat(timespec='seconds'),
+        'wall_seconds': time.time() - _state.started,
+        'argv': sys.argv,
+        'options': sorted(_state.options),
+        'peak_rss_mb': max((r['rss_start_mb'] + max(r['rss_delta_mb'], 0) for r in _state.records), default=None),
+        'summary': summarize().reset_index().to_dict(orient='records'),
+        'stages': _state.records,
+    }
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w') as report_file:
+        json.dump(report, report_file, indent=1, default=str)
+    return path
+
+
+enable_from_env()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run a pipeline script with stage instrumentation enabled.')
+    parser.add_argument('script', help='e.g. coverage_computations_and_plotting.py')
+    parser.add_argument('--cprofile', action='store_true', help='also collect cProfile stats per stage')
+    parser.add_argument('--tracemalloc', action='store_true', help='also trace Python allocations per stage')
+    parser.add_argument('--report', default=DEFAULT_REPORT_PATH)
+    args, script_args = parser.parse_known_args()
+
+    options = [option for option in ('cprofile', 'tracemalloc') if getattr(args, option)]
+    os.environ[PROFILE_ENV] = ','.join(['1'] + options)
+    os.environ[REPORT_ENV] = args.report
+    sys.argv = [args.script] + script_args
+    sys.path.insert(0, os.path.dirname(os.path.abspath(args.script)))
+
+    # The pipeline modules import `instrumentation`, not this __main__ copy, so report through it
+    import instrumentation
+    try:
+        runpy.run_path(args.script, run_name='__main__')
+    finally:
+        instrumentation.write_report()
+        print(instrumentation.summarize().to_string())
@@ -0,0 +1,239 @@
+import argparse
+import re
+
+import numpy as np
+import pandas as pd
+from scipy import special, stats
+
+from data_loader import HOUR_COLUMNS
+
+# Candidate terms of the regression cell in xgboost_models.ipynb
+SCREENING_TERMS = [
+    'age', 'age_survey', 'C(age_segment)', 'C(gender)', 'C(fre_city_level)',
+] + HOUR_COLUMNS + [
+    'morning_wt', 'noon_wt', 'afternoon_wt', 'evening_wt', 'midnight_wt',
+    'watch_all_per_day', 'watch_all_per_week', 'watch_all_per_2weeks', 'watch_all_per_session',
+    'coverage_per_week', 'coverage_per_2weeks', 'category_count_unique', 'root_category_count_unique',
+    'session_all_per_day', 'pid_SHUA_all_per_day', 'pid_watch_all_per_day',
+    'duration_per_day', 'longvideo_count_per_day', 'shortvideo_count_per_day',
+]
+
+RESULT_COLUMNS = ['term', 'parameter', 'coef', 'std_err', 'z', 'p_value', 'llr_pvalue', 'n_obs', 'converged']
+
+_CATEGORICAL_TERM = re.compile(r'^C\((\w+)\)$')
+
+
+def term_column(term):
+    """Column behind a formula term: 'C(gender)' -> 'gender', 'age' -> 'age'."""
+    match = _CATEGORICAL_TERM.match(term)
+    return match.group(1) if match else term
+
+
+def adjust_pvalues(p_values, method='fdr_bh'):
+    """Multiple-testing correction ('fdr_bh' Benjamini-Hochberg or 'bonferroni'); NaNs are left out."""
+    p_values = np.asarray(p_values, dtype=float)
+    adjusted = np.full_like(p_values, np.nan)
+    valid = np.flatnonzero(~np.isnan(p_values))
+    m = len(valid)
+    if m == 0:
+        return adjusted
+    if method == 'bonferroni':
+        adjusted[valid] = np.minimum(p_values[valid] * m, 1.0)
+    elif method == 'fdr_bh':
+        order = valid[np.argsort(p_values[valid])]
+        scaled = p_values[order] * m / np.arange(1, m + 1)
+        adjusted[order] = np.minimum(np.minimum.accumulate(scaled[::-1])[::-1], 1.0)
+    else:
+        raise ValueError(f'unknown correction method: {method}')
+    return adjusted
+
+
+def _null_loglike(successes, n_obs):
+    rate = successes / n_obs
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.nan_to_num(successes * np.log(rate)) + np.nan_to_num((n_obs - successes) * np.log1p(-rate))
+
+
+### Numeric terms ###
+
+def fit_univariate_logits(X, y, max_iter=35, tol=1e-8):
+    """Fit `y ~ x` separately for every column of X with one vectorized Newton/IRLS loop.
+
+    Rows where a column is NaN are dropped for that column only, like patsy.
+    Columns are standardized for the iterations and the coefficients mapped
+    back, so Wald statistics match an unstandardized statsmodels fit.
+    Returns a dict of per-column arrays: intercept, coef, std_err, loglike,
+    null_loglike, n_obs and converged.
+    """
+    X = np.asarray(X, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    mask = ~np.isnan(X)
+    n_obs = mask.sum(axis=0)
+    weights = mask.astype(np.float64)
+
+    mean = np.where(n_obs > 0, np.where(mask, X, 0.0).sum(axis=0) / np.maximum(n_obs, 1), 0.0)
+    Xs = np.where(mask, X - mean, 0.0)
+    scale = np.sqrt((Xs ** 2).sum(axis=0) / np.maximum(n_obs, 1))
+    Xs /= np.where(scale > 0, scale, 1.0)
+
+    successes = weights.T @ y
+    rate = np.clip(successes / np.maximum(n_obs, 1), 1e-10, 1 - 1e-10)
+    b0 = special.logit(rate)
+    b1 = np.zeros(X.shape[1])
+    converged = np.zeros(X.shape[1], dtype=bool)
+
+    for _ in range(max_iter):
+        eta = b0 + Xs * b1
+        p = special.expit(eta)
+        w = p * (1 - p) * weights
+        r = (y[:, None] - p) * weights
+        s0, s1, s2 = w.sum(axis=0), (w * Xs).sum(axis=0), (w * Xs * Xs).sum(axis=0)
+        g0, g1 = r.sum(axis=0), (r * Xs).sum(axis=0)
+        det = s0 * s2 - s1 ** 2
+        with np.errstate(divide='ignore', invalid='ignore'):
+            step0 = np.where(det > 0, (s2 * g0 - s1 * g1) / det, 0.0)
+            step1 = np.where(det > 0, (s0 * g1 - s1 * g0) / det, 0.0)
+        b0 += step0
+        b1 += step1
+        converged = (np.abs(step0) < tol) & (np.abs(step1) < tol) & (det > 0)
+        if converged.all():
+            break
+
+    eta = b0 + Xs * b1
+    p = special.expit(eta)
+    w = p * (1 - p) * weights
+    s0, s1, s2 = w.sum(axis=0), (w * Xs).sum(axis=0), (w * Xs * Xs).sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        se_std = np.sqrt(s0 / (s0 * s2 - s1 ** 2))
+        coef = b1 / scale
+        std_err = se_std / scale
+    loglike = (weights * (y[:, None] * eta - np.logaddexp(0, eta))).sum(axis=0)
+
+    # Separated or constant columns have no finite MLE
+    converged &= (scale > 0) & (np.abs(b1) < 30)
+    return {
+        'intercept': b0 - b1 * mean / np.where(scale > 0, scale, 1.0),
+        'coef': np.where(converged, coef, np.nan),
+        'std_err': np.where(converged, std_err, np.nan),
+        'loglike': loglike,
+        'null_loglike': _null_loglike(successes, n_obs),
+        'n_obs': n_obs,
+        'converged': converged,
+    }
+
+
+def _screen_numeric(df, target, terms, max_batch_elements):
+    y = df[target].to_numpy(dtype=np.float64)
+    batch_size = max(1, max_batch_elements // max(len(df), 1))
+    rows = []
+    for start in range(0, len(terms), batch_size):
+        batch = terms[start:start + batch_size]
+        fit = fit_univariate_logits(df[batch].to_numpy(dtype=np.float64), y)
+        z = fit['coef'] / fit['std_err']
+        llr = 2 * (fit['loglike'] - fit['null_loglike'])
+        rows.append(pd.DataFrame({
+            'term': batch,
+            'parameter': batch,
+            'coef': fit['coef'],
+            'std_err': fit['std_err'],
+            'z': z,
+            'p_value': 2 * stats.norm.sf(np.abs(z)),
+            'llr_pvalue': np.where(fit['converged'], stats.chi2.sf(llr, 1), np.nan),
+            'n_obs': fit['n_obs'],
+            'converged': fit['converged'],
+        }))
+    return rows
+
+
+### Categorical terms ###
+
+def _screen_categorical(df, target, term):
+    """`y ~ C(x)` in closed form: the saturated model's MLE is the per-level logit.
+
+    Treatment coding with the first sorted level as reference, as patsy does.
+    """
+    column = term_column(term)
+    counts = df.groupby(column, observed=True)[target].agg(['sum', 'count']).sort_index()
+    successes, n_obs = counts['sum'].to_numpy(dtype=np.float64), counts['count'].to_numpy(dtype=np.float64)
+    rate = successes / n_obs
+    converged = bool(len(counts) > 1 and np.all((rate > 0) & (rate < 1)))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_odds = special.logit(rate)
+        variance = 1 / (n_obs * rate * (1 - rate))
+        coef = log_odds[1:] - log_odds[0]
+        std_err = np.sqrt(variance[1:] + variance[0])
+    loglike = _null_loglike(successes, n_obs).sum()
+    llr = 2 * (loglike - _null_loglike(successes.sum(), n_obs.sum()))
+    z = coef / std_err
+
+    return pd.DataFrame({
+        'term': term,
+        'parameter': [f'{term}[T.{level}]' for level in counts.index[1:]],
+        'coef': coef if converged else np.nan,
+        'std_err': std_err if converged else np.nan,
+        'z': z if converged else np.nan,
+        'p_value': 2 * stats.norm.sf(np.abs(z)) if converged else np.nan,
+        'llr_pvalue': stats.chi2.sf(llr, len(counts) - 1) if converged else np.nan,
+        'n_obs': int(n_obs.sum()),
+        'converged': converged,
+    })
+
+
+### Screening ###
+
+def screen_terms(df, target, terms=None, correction='fdr_bh', max_batch_elements=2**24):
+    """One `target ~ term` logistic fit per term, as a single coefficient table.
+
+    `terms` uses the notebook's formula syntax (plain columns or C(column));
+    by default every SCREENING_TERMS entry whose column exists in `df`. Rows
+    with a missing target are dropped. p_value is the Wald test of each
+    coefficient, llr_pvalue the likelihood-ratio test of the whole term, and
+    both get a `correction`-adjusted column. Sorted by p_value.
+    """
+    if terms is None:
+        terms = [term for term in SCREENING_TERMS if term_column(term) in df.columns]
+    df = df[df[target].notna()]
+
+    numeric = [term for term in terms if not _CATEGORICAL_TERM.match(term)]
+    tables = _screen_numeric(df, target, numeric, max_batch_elements) if numeric else []
+    tables += [_screen_categorical(df, target, term) for term in terms if _CATEGORICAL_TERM.match(term)]
+
+    result = pd.concat(tables, ignore_index=True)[RESULT_COLUMNS]
+    result['p_value_adjusted'] = adjust_pvalues(result['p_value'], correction)
+    term_pvalues = result.drop_duplicates('term').set_index('term')['llr_pvalue']
+    result['llr_pvalue_adjusted'] = result['term'].map(
+        pd.Series(adjust_pvalues(term_pvalues, correction), index=term_pvalues.index))
+    result.insert(0, 'target', target)
+    return result.sort_values('p_value', kind='stable').reset_index(drop=True)
+
+
+def screen_by_group(df, targets, by=None, terms=None, correction='fdr_bh'):
+    """Run screen_terms for every target and, with `by` (e.g. 'month'), every group separately.
+
+    Corrections are applied within each (target, group) screen.
+    """
+    targets = [targets] if isinstance(targets, str) else list(targets)
+    tables = []
+    groups = df.groupby(by, observed=True) if by is not None else [(None, df)]
+    for group, group_df in groups:
+        for target in targets:
+            table = screen_terms(group_df, target, terms=terms, correction=correction)
+            if by is not None:
+                table.insert(0, by, group)
+            tables.append(table)
+    return pd.concat(tables, ignore_index=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Univariate logistic screening of candidate features.')
+    parser.add_argument('data', help='CSV with the candidate feature columns and the target labels')
+    parser.add_argument('targets', nargs='+', help='binary label columns, e.g. soft_criteria hard_criteria')
+    parser.add_argument('--by', help='screen each value of this column separately (e.g. month)')
+    parser.add_argument('--correction', choices=['fdr_bh', 'bonferroni'], default='fdr_bh')
+    parser.add_argument('--output', default='logistic_screening.csv')
+    args = parser.parse_args()
+
+    results = screen_by_group(pd.read_csv(args.data), args.targets, by=args.by, correction=args.correction)
+    results.to_csv(args.output, index=False)
+    print(results.head(20).to_string(index=False))
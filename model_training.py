@@ -0,0 +1,162 @@
+import os
+import pickle
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.metrics import accuracy_score, f1_score, precision_score, recall_score, roc_auc_score
+from sklearn.model_selection import StratifiedKFold
+
+from data_loader import MODEL_FEATURES
+
+# Hyperparameters used in xgboost_models.ipynb
+SOFT_CRITERIA_PARAMS = {
+    'max_depth': 6, 'min_child_weight': 1, 'gamma': 0, 'eta': 0.1,
+    'colsample_bytree': 0.7, 'subsample': 0.7, 'eval_metric': 'auc',
+    'objective': 'binary:logistic', 'alpha': 0.3, 'lambda': 2.0, 'seed': 42
+}
+HARD_CRITERIA_PARAMS = {
+    'max_depth': 3, 'min_child_weight': 5, 'gamma': 2, 'eta': 0.01,
+    'colsample_bytree': 0.7, 'subsample': 0.6, 'eval_metric': 'auc',
+    'objective': 'binary:logistic', 'alpha': 0.3, 'lambda': 2.0, 'seed': 42
+}
+TRAINING_CONFIGS = {
+    'soft_criteria': (SOFT_CRITERIA_PARAMS, 110),
+    'hard_criteria': (HARD_CRITERIA_PARAMS, 130),
+}
+
+METRICS = ['accuracy', 'precision', 'recall', 'f1_score', 'roc_auc']
+
+
+@dataclass
+class Fold:
+    """DMatrices and labels of one cross-validation fold, built once and reused."""
+    index: int
+    dtrain: xgb.DMatrix
+    dtest: xgb.DMatrix
+    y_train: np.ndarray
+    y_test: np.ndarray
+    scale_pos_weight: float
+
+
+@dataclass
+class CVResult:
+    """Per-fold metrics, their summary, averaged feature importances and the fold boosters."""
+    target: str
+    params: dict
+    num_round: int
+    fold_metrics: pd.DataFrame
+    summary: pd.DataFrame
+    feature_importances: pd.Series
+    boosters: list = field(default_factory=list, repr=False)
+
+
+def training_frame(df_all, target):
+    """Rows used for `target`: all users for soft_criteria, soft-addicted users for hard_criteria."""
+    if target == 'hard_criteria':
+        return df_all[df_all['soft_criteria'] == 1]
+    return df_all
+
+
+def build_folds(df_all, target, features=MODEL_FEATURES, n_splits=5, seed=42):
+    """Split `df_all` with StratifiedKFold and build each fold's DMatrices once."""
+    df = training_frame(df_all, target)
+    X = df[features].to_numpy(dtype=np.float32)
+    y = df[target].to_numpy(dtype=np.int8)
+
+    folds = []
+    skf = StratifiedKFold(n_splits=n_splits, shuffle=True, random_state=seed)
+    for fold_index, (train_index, test_index) in enumerate(skf.split(X, y), start=1):
+        y_train, y_test = y[train_index], y[test_index]
+        pos_count = np.count_nonzero(y_train)
+        folds.append(Fold(
+            index=fold_index,
+            dtrain=xgb.DMatrix(X[train_index], label=y_train, feature_names=list(features)),
+            dtest=xgb.DMatrix(X[test_index], label=y_test, feature_names=list(features)),
+            y_train=y_train,
+            y_test=y_test,
+            scale_pos_weight=(len(y_train) - pos_count) / pos_count,
+        ))
+    return folds
+
+
+def score(y_true, probs, prefix=''):
+    """Classification metrics at a 0.5 threshold plus ROC AUC."""
+    y_pred = (probs >= 0.5).astype(int)
+    return {
+        f'{prefix}accuracy': accuracy_score(y_true, y_pred),
+        f'{prefix}precision': precision_score(y_true, y_pred, zero_division=0),
+        f'{prefix}recall': recall_score(y_true, y_pred),
+        f'{prefix}f1_score': f1_score(y_true, y_pred),
+        f'{prefix}roc_auc': roc_auc_score(y_true, probs),
+    }
+
+
+def worker_threads(num_tasks, max_workers=None):
+    """Pool size for `num_tasks` concurrent trainings and the XGBoost nthread each one gets."""
+    cpu_count = os.cpu_count() or 1
+    max_workers = min(max_workers or cpu_count, num_tasks)
+    return max_workers, max(1, cpu_count // max_workers)
+
+
+def train_fold(fold, params, num_round, nthread):
+    """Train and score one fold; returns (metrics dict, booster)."""
+    fold_params = dict(params, scale_pos_weight=fold.scale_pos_weight, nthread=nthread)
+    bst = xgb.train(fold_params, fold.dtrain, num_round)
+    metrics = {'fold': fold.index}
+    metrics.update(score(fold.y_train, bst.predict(fold.dtrain), prefix='train_'))
+    metrics.update(score(fold.y_test, bst.predict(fold.dtest)))
+    return metrics, bst
+
+
+def cross_validate(folds, params, num_round, target='', max_workers=None, save_dir=None):
+    """Train all folds concurrently and aggregate their metrics and feature importances.
+
+    Folds run on threads (XGBoost releases the GIL) and share the prebuilt
+    DMatrices. Each fold gets cpu_count // workers threads so the pool never
+    oversubscribes the machine. With `save_dir`, fold boosters are pickled as
+    `{target}_xgboost_model_{fold}.pkl` like the notebook.
+    """
+    max_workers, nthread = worker_threads(len(folds), max_workers)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results = list(executor.map(lambda fold: train_fold(fold, params, num_round, nthread), folds))
+
+    fold_metrics = pd.DataFrame([metrics for metrics, _ in results]).set_index('fold')
+    boosters = [bst for _, bst in results]
+
+    test_metrics = fold_metrics[METRICS]
+    summary = pd.DataFrame({
+        'best': test_metrics.max(),
+        'average': test_metrics.mean(),
+        'lowest': test_metrics.min(),
+        'std': test_metrics.std(ddof=0),
+    })
+
+    importances = pd.Series(0.0, index=folds[0].dtrain.feature_names)
+    for bst in boosters:
+        importances = importances.add(pd.Series(bst.get_score(importance_type='weight')), fill_value=0)
+    importances = (importances / len(folds)).sort_values(ascending=False)
+
+    if save_dir is not None:
+        os.makedirs(save_dir, exist_ok=True)
+        for fold, bst in zip(folds, boosters):
+            with open(os.path.join(save_dir, f'{target}_xgboost_model_{fold.index}.pkl'), 'wb') as model_file:
+                pickle.dump(bst, model_file)
+
+    return CVResult(target=target, params=dict(params), num_round=num_round, fold_metrics=fold_metrics,
+                    summary=summary, feature_importances=importances, boosters=boosters)
+
+
+def train_criteria_model(df_all, target, features=MODEL_FEATURES, params=None, num_round=None,
+                         n_splits=5, seed=42, max_workers=None, save_dir=None):
+    """Stratified k-fold training entry point for 'soft_criteria' or 'hard_criteria'.
+
+    `params` / `num_round` default to the notebook's settings for the target.
+    """
+    default_params, default_num_round = TRAINING_CONFIGS[target]
+    folds = build_folds(df_all, target, features, n_splits=n_splits, seed=seed)
+    return cross_validate(folds, params or default_params, num_round or default_num_round,
+                          target=target, max_workers=max_workers, save_dir=save_dir)
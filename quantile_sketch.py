@@ -0,0 +1,247 @@
+import json
+import math
+import os
+
+import numpy as np
+import pandas as pd
+
+SKETCH_K = 200
+
+
+class KLLSketch:
+    """Mergeable streaming quantile sketch (KLL) over float values.
+
+    Level h holds sorted-on-compaction items that each stand for 2**h inputs;
+    level capacities shrink geometrically by `c` from the top, so memory is
+    O(k log(n / k)). A compaction sorts a full level and promotes every other
+    item (random offset) one level up, which moves any rank by at most the
+    level's weight. Those weights are recorded, so the sketch reports the rank
+    error it actually accumulated (rank_error / max_rank_error) rather than an
+    a-priori bound. NaNs are ignored.
+    """
+
+    def __init__(self, k=SKETCH_K, c=2 / 3, seed=0):
+        self.k = k
+        self.c = c
+        self.seed = seed
+        self.levels = [np.empty(0)]
+        self.n = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.num_compactions = 0
+        self.squared_error = 0.0
+        self.worst_error = 0.0
+
+    def __len__(self):
+        return self.n
+
+    def capacity(self, level):
+        return max(2, math.ceil(self.k * self.c ** (len(self.levels) - 1 - level)))
+
+    @property
+    def num_retained(self):
+        return sum(len(items) for items in self.levels)
+
+    def update(self, values):
+        """Add a batch of values (any array-like); returns self."""
+        values = np.asarray(values, dtype=np.float64).ravel()
+        values = values[~np.isnan(values)]
+        if len(values):
+            self.n += len(values)
+            self.min = min(self.min, float(values.min()))
+            self.max = max(self.max, float(values.max()))
+            self.levels[0] = np.concatenate([self.levels[0], values])
+            self._compress()
+        return self
+
+    def merge(self, other):
+        """Fold another sketch (e.g. from another partition or worker) into this one; returns self."""
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.n += other.n
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.num_compactions += other.num_compactions
+        self.squared_error += other.squared_error
+        self.worst_error += other.worst_error
+        self._compress()
+        return self
+
+    def _compact(self, level):
+        items = np.sort(self.levels[level])
+        leftover = len(items) % 2
+        rng = np.random.default_rng([self.seed, self.num_compactions])
+        promoted = items[leftover:][rng.integers(2)::2]
+        if level + 1 == len(self.levels):
+            self.levels.append(np.empty(0))
+        self.levels[level] = items[:leftover]
+        self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+
+        weight = 2.0 ** level
+        self.num_compactions += 1
+        self.squared_error += weight ** 2
+        self.worst_error += weight
+
+    def _compress(self):
+        """Compact the lowest over-full level until everything fits in the total capacity."""
+        while self.num_retained > sum(self.capacity(level) for level in range(len(self.levels))):
+            level = next(level for level in range(len(self.levels))
+                         if len(self.levels[level]) >= self.capacity(level))
+            self._compact(level)
+
+    def _weighted_items(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level_items), 2.0 ** level)
+                                  for level, level_items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        return items[order], np.cumsum(weights[order])
+
+    def quantile(self, q):
+        """Approximate q-quantile(s): the smallest retained item whose cumulative weight reaches q * n."""
+        q = np.asarray(q, dtype=np.float64)
+        if self.n == 0:
+            return np.full(q.shape, np.nan) if q.ndim else math.nan
+        items, cumulative = self._weighted_items()
+        position = np.minimum(np.searchsorted(cumulative, q * cumulative[-1]), len(items) - 1)
+        result = np.where(q <= 0, self.min, np.where(q >= 1, self.max, items[position]))
+        return result if q.ndim else float(result)
+
+    def rank(self, value):
+        """Approximate fraction of inputs <= `value`."""
+        if self.n == 0:
+            return math.nan
+        items, cumulative = self._weighted_items()
+        position = np.searchsorted(items, value, side='right')
+        return float(cumulative[position - 1] / cumulative[-1]) if position else 0.0
+
+    def rank_error(self, confidence=0.99):
+        """Normalized rank error of a single query at `confidence`, from the compactions performed.
+
+        Each compaction at weight w shifts a query's rank by 0 or +-w with a
+        fair coin, so Hoeffding gives sqrt(2 ln(2 / delta) * sum(w^2)) / n,
+        capped at the deterministic max_rank_error.
+        """
+        if self.n == 0:
+            return 0.0
+        hoeffding = math.sqrt(2 * math.log(2 / (1 - confidence)) * self.squared_error) / self.n
+        return min(hoeffding, self.max_rank_error())
+
+    def max_rank_error(self):
+        """Deterministic worst-case normalized rank error (sum of compaction weights / n)."""
+        return self.worst_error / self.n if self.n else 0.0
+
+    def to_dict(self):
+        return {
+            'k': self.k, 'c': self.c, 'seed': self.seed, 'n': self.n, 'min': self.min, 'max': self.max,
+            'num_compactions': self.num_compactions, 'squared_error': self.squared_error,
+            'worst_error': self.worst_error, 'levels': [items.tolist() for items in self.levels],
+        }
+
+    @classmethod
+    def from_dict(cls, state):
+        sketch = cls(state['k'], state['c'], state['seed'])
+        sketch.levels = [np.asarray(items, dtype=np.float64) for items in state['levels']]
+        for name in ('n', 'min', 'max', 'num_compactions', 'squared_error', 'worst_error'):
+            setattr(sketch, name, state[name])
+        return sketch
+
+
+def measured_rank_error(sketch, values, quantiles=(0.1, 0.25, 0.5, 0.75, 0.9)):
+    """Largest |exact rank of the sketch's answer - q| over `quantiles`, for checking a sketch against raw data."""
+    values = np.asarray(values, dtype=np.float64)
+    values = np.sort(values[~np.isnan(values)])
+    quantiles = np.asarray(quantiles, dtype=np.float64)
+    answers = sketch.quantile(quantiles)
+    below = np.searchsorted(values, answers, side='left') / len(values)
+    at_or_below = np.searchsorted(values, answers, side='right') / len(values)
+    # Ties make every rank in [below, at_or_below] exact
+    return float(np.max(np.maximum(0, np.maximum(below - quantiles, quantiles - at_or_below))))
+
+
+### Keyed sketch sets ###
+
+class QuantileSketches:
+    """KLL sketches keyed by (group, column), persisted as one JSON file.
+
+    `partitions` remembers which inputs were already added, so re-running on
+    the same partition does not count it twice.
+    """
+
+    def __init__(self, k=SKETCH_K, seed=0):
+        self.k = k
+        self.seed = seed
+        self.sketches = {}
+        self.partitions = []
+
+    def sketch(self, group, column):
+        # NumPy scalars (e.g. label values) would not survive the JSON round trip
+        key = (group.item() if isinstance(group, np.generic) else group, column)
+        if key not in self.sketches:
+            self.sketches[key] = KLLSketch(self.k, seed=self.seed + len(self.sketches))
+        return self.sketches[key]
+
+    def update(self, group, column, values):
+        self.sketch(group, column).update(values)
+
+    def update_groups(self, df, group_rows, columns, partition=None):
+        """Add `columns` of the rows of every group ({group: row positions}) in `df`.
+
+        Returns False (and adds nothing) when `partition` was already added.
+        """
+        if partition is not None:
+            if partition in self.partitions:
+                return False
+            self.partitions.append(partition)
+        values = df[columns].to_numpy(dtype=np.float64)
+        for group, rows in group_rows.items():
+            for i, column in enumerate(columns):
+                self.update(group, column, values[rows, i])
+        return True
+
+    def merge(self, other):
+        for (group, column), sketch in other.sketches.items():
+            self.sketch(group, column).merge(sketch)
+        self.partitions += [partition for partition in other.partitions if partition not in self.partitions]
+        return self
+
+    def quantiles(self, q=0.5):
+        """{group: {column: q-quantile}}."""
+        result = {}
+        for (group, column), sketch in self.sketches.items():
+            result.setdefault(group, {})[column] = sketch.quantile(q)
+        return result
+
+    def report(self, confidence=0.99):
+        """Per (group, column): inputs, retained items, median and the achieved rank error bounds."""
+        rows = [{'group': group, 'column': column, 'n': sketch.n, 'retained': sketch.num_retained,
+                 'median': sketch.quantile(0.5), 'rank_error': sketch.rank_error(confidence),
+                 'max_rank_error': sketch.max_rank_error()}
+                for (group, column), sketch in self.sketches.items()]
+        return pd.DataFrame(rows, columns=['group', 'column', 'n', 'retained', 'median', 'rank_error',
+                                           'max_rank_error'])
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        state = {'k': self.k, 'seed': self.seed, 'partitions': self.partitions,
+                 'sketches': [{'group': group, 'column': column, 'sketch': sketch.to_dict()}
+                              for (group, column), sketch in self.sketches.items()]}
+        with open(path + '.tmp', 'w') as f:
+            json.dump(state, f)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, k=SKETCH_K, seed=0):
+        """Read a saved set, or start an empty one when `path` does not exist."""
+        if not os.path.exists(path):
+            return cls(k, seed)
+        with open(path) as f:
+            state = json.load(f)
+        sketches = cls(state['k'], state['seed'])
+        sketches.partitions = state['partitions']
+        for entry in state['sketches']:
+            sketches.sketches[(entry['group'], entry['column'])] = KLLSketch.from_dict(entry['sketch'])
+        return sketches
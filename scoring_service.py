@@ -0,0 +1,383 @@
+import argparse
+import http.client
+import json
+import math
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from batch_labeling import HARD_MODEL_PATH, SOFT_MODEL_PATH, load_models, predict_probabilities
+from data_loader import GENDER_CODES, MODEL_FEATURES
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8350
+MAX_BATCH_ROWS = 256
+MAX_WAIT_MS = 2.0
+METRICS_WINDOW = 10_000
+
+
+class FeatureError(ValueError):
+    """A request whose feature vector does not match MODEL_FEATURES."""
+
+
+def feature_row(instance):
+    """Validate one instance and return it as a float32 row in MODEL_FEATURES order.
+
+    An instance is either a list of the 13 values in MODEL_FEATURES order or an
+    object with exactly those keys. null means missing (NaN, which the
+    boosters handle); gender may also be 'M' / 'F'.
+    """
+    if isinstance(instance, dict):
+        missing = [name for name in MODEL_FEATURES if name not in instance]
+        unknown = sorted(set(instance) - set(MODEL_FEATURES))
+        if missing or unknown:
+            raise FeatureError(f'missing features: {missing}, unknown features: {unknown}')
+        values = [instance[name] for name in MODEL_FEATURES]
+    elif isinstance(instance, list):
+        if len(instance) != len(MODEL_FEATURES):
+            raise FeatureError(f'expected {len(MODEL_FEATURES)} values in the order {MODEL_FEATURES}, '
+                               f'got {len(instance)}')
+        values = list(instance)
+    else:
+        raise FeatureError('an instance must be a list of values or an object keyed by feature name')
+
+    gender = MODEL_FEATURES.index('gender')
+    if isinstance(values[gender], str):
+        if values[gender] not in GENDER_CODES:
+            raise FeatureError(f'gender must be one of {list(GENDER_CODES)} or its code')
+        values[gender] = GENDER_CODES[values[gender]]
+
+    row = np.empty(len(MODEL_FEATURES), dtype=np.float32)
+    for i, (name, value) in enumerate(zip(MODEL_FEATURES, values)):
+        if value is None or (isinstance(value, float) and math.isnan(value)):
+            row[i] = np.nan
+            continue
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            # Finite JSON numbers past the float32 range (e.g. 1e40) only become inf after the cast
+            try:
+                with np.errstate(over='ignore'):
+                    row[i] = np.float32(float(value))
+            except OverflowError:
+                row[i] = np.inf
+            if np.isfinite(row[i]):
+                continue
+        raise FeatureError(f'{name} must be a number within float32 range or null, got {value!r}')
+    return row
+
+
+def parse_request(body):
+    """(n, 13) feature array of a /score body: {"instances": [...]} or {"features": ...} for one instance."""
+    try:
+        payload = json.loads(body)
+    except ValueError as error:
+        raise FeatureError(f'invalid JSON: {error}') from None
+    if not isinstance(payload, dict) or ('instances' in payload) == ('features' in payload):
+        raise FeatureError('the body must be an object with either "features" or "instances"')
+    instances = payload['instances'] if 'instances' in payload else [payload['features']]
+    if not isinstance(instances, list) or not instances:
+        raise FeatureError('"instances" must be a non-empty list')
+    return np.stack([feature_row(instance) for instance in instances])
+
+
+### Metrics ###
+
+class ServiceMetrics:
+    """Thread-safe request, latency and batch-size statistics over the last `window` events."""
+
+    def __init__(self, window=METRICS_WINDOW):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.latencies_ms = deque(maxlen=window)
+        self.batch_rows = deque(maxlen=window)
+        self.batch_requests = deque(maxlen=window)
+        self.counts = {'requests': 0, 'rows': 0, 'batches': 0, 'errors': 0}
+
+    def record_request(self, latency_ms, rows, error=False):
+        with self._lock:
+            self.latencies_ms.append(latency_ms)
+            self.counts['requests'] += 1
+            self.counts['rows'] += rows
+            self.counts['errors'] += error
+
+    def record_batch(self, num_requests, num_rows):
+        with self._lock:
+            self.batch_requests.append(num_requests)
+            self.batch_rows.append(num_rows)
+            self.counts['batches'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            latencies = np.array(self.latencies_ms)
+            batch_rows, batch_requests = np.array(self.batch_rows), np.array(self.batch_requests)
+            counts = dict(self.counts)
+
+        def percentiles(values):
+            if not len(values):
+                return {'p50': None, 'p99': None, 'mean': None, 'max': None}
+            p50, p99 = np.percentile(values, [50, 99])
+            return {'p50': float(p50), 'p99': float(p99), 'mean': float(values.mean()), 'max': float(values.max())}
+
+        return {**counts, 'uptime_seconds': time.time() - self.started,
+                'latency_ms': percentiles(latencies), 'batch_rows': percentiles(batch_rows),
+                'batch_requests': percentiles(batch_requests)}
+
+
+### Micro-batching ###
+
+class MicroBatcher:
+    """Groups concurrent requests into one model call.
+
+    A single worker thread takes the first waiting request, then keeps
+    collecting for up to `max_wait_ms` or until `max_batch_rows` rows are
+    queued, stacks them and calls `predict` once. Each submit() returns a
+    Future resolved with that request's slice of the outputs.
+    """
+
+    def __init__(self, predict, max_batch_rows=MAX_BATCH_ROWS, max_wait_ms=MAX_WAIT_MS, metrics=None):
+        self.predict = predict
+        self.max_batch_rows = max_batch_rows
+        self.max_wait = max_wait_ms / 1000
+        self.metrics = metrics or ServiceMetrics()
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='micro-batcher', daemon=True)
+        self._thread.start()
+
+    def submit(self, rows):
+        future = Future()
+        self._queue.put((rows, future))
+        return future
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch, num_rows = [first], len(first[0])
+        deadline = time.perf_counter() + self.max_wait
+        while num_rows < self.max_batch_rows:
+            remaining = deadline - time.perf_counter()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)
+                break
+            batch.append(item)
+            num_rows += len(item[0])
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            features = np.concatenate([rows for rows, _ in batch])
+            try:
+                outputs = self.predict(features)
+            except Exception as error:
+                self._run_separately(batch, error)
+                continue
+            self.metrics.record_batch(len(batch), len(features))
+            offset = 0
+            for rows, future in batch:
+                future.set_result({name: values[offset:offset + len(rows)] for name, values in outputs.items()})
+                offset += len(rows)
+
+    def _run_separately(self, batch, error):
+        """Re-predict a failed batch one request at a time, so only the requests that fail get the error."""
+        if len(batch) == 1:
+            batch[0][1].set_exception(error)
+            return
+        for rows, future in batch:
+            try:
+                future.set_result(self.predict(rows))
+            except Exception as request_error:
+                future.set_exception(request_error)
+            else:
+                self.metrics.record_batch(1, len(rows))
+
+
+def make_predictor(soft_model, hard_model, threshold=0.5):
+    """predict(features) -> soft / hard probabilities and the three label arrays for a batch."""
+    def predict(features):
+        soft_probs, hard_probs = predict_probabilities(features, soft_model, hard_model, threshold)
+        preds_soft = (soft_probs >= threshold).astype(np.int8)
+        preds_hard = (hard_probs >= threshold).astype(np.int8)
+        return {'soft_probability': soft_probs, 'hard_probability': hard_probs, 'preds_soft': preds_soft,
+                'preds_hard': preds_hard, 'preds_3_label_criteria': preds_soft + preds_hard}
+    return predict
+
+
+### HTTP ###
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    """POST /score, GET /metrics and GET /health on a keep-alive HTTP/1.1 connection."""
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send_json(200, self.server.metrics.snapshot())
+        elif self.path == '/health':
+            self._send_json(200, {'status': 'ok', 'features': MODEL_FEATURES})
+        else:
+            self._send_json(404, {'error': f'unknown path {self.path}'})
+
+    def do_POST(self):
+        start = time.perf_counter()
+        if self.path != '/score':
+            self._send_json(404, {'error': f'unknown path {self.path}'})
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        try:
+            features = parse_request(body)
+            outputs = self.server.batcher.submit(features).result()
+        except FeatureError as error:
+            self._send_json(400, {'error': str(error)})
+            self.server.metrics.record_request((time.perf_counter() - start) * 1000, 0, error=True)
+            return
+        except Exception as error:
+            self._send_json(500, {'error': f'{type(error).__name__}: {error}'})
+            self.server.metrics.record_request((time.perf_counter() - start) * 1000, 0, error=True)
+            return
+
+        # NaN hard probabilities (not soft-addicted) become null
+        results = [{name: (None if isinstance(value, float) and math.isnan(value) else value)
+                    for name, value in zip(outputs, row)}
+                   for row in zip(*(values.tolist() for values in outputs.values()))]
+        self._send_json(200, {'predictions': results})
+        self.server.metrics.record_request((time.perf_counter() - start) * 1000, len(features))
+
+
+class ScoringServer(ThreadingHTTPServer):
+    """Threaded HTTP server sharing one MicroBatcher (and so one model call at a time) across connections."""
+    daemon_threads = True
+
+    def __init__(self, address, soft_model, hard_model, max_batch_rows=MAX_BATCH_ROWS, max_wait_ms=MAX_WAIT_MS):
+        super().__init__(address, ScoringHandler)
+        self.metrics = ServiceMetrics()
+        self.batcher = MicroBatcher(make_predictor(soft_model, hard_model), max_batch_rows, max_wait_ms,
+                                    metrics=self.metrics)
+
+    def server_close(self):
+        super().server_close()
+        self.batcher.close()
+
+
+def serve(host=DEFAULT_HOST, port=DEFAULT_PORT, soft_model_path=SOFT_MODEL_PATH, hard_model_path=HARD_MODEL_PATH,
+          max_batch_rows=MAX_BATCH_ROWS, max_wait_ms=MAX_WAIT_MS):
+    """Load both boosters once and serve until interrupted."""
+    soft_model, hard_model = load_models(soft_model_path, hard_model_path)
+    server = ScoringServer((host, port), soft_model, hard_model, max_batch_rows, max_wait_ms)
+    print(f'scoring on http://{host}:{server.server_address[1]} (POST /score, GET /metrics)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+### Load generator ###
+
+def _client_worker(host, port, bodies, latencies):
+    connection = http.client.HTTPConnection(host, port)
+    errors = 0
+    try:
+        for body in bodies:
+            start = time.perf_counter()
+            connection.request('POST', '/score', body=body, headers={'Content-Type': 'application/json'})
+            response = connection.getresponse()
+            response.read()
+            latencies.append((time.perf_counter() - start) * 1000)
+            errors += response.status != 200
+    finally:
+        connection.close()
+    return errors
+
+
+def load_test(host, port, num_requests=5000, concurrency=32, rows_per_request=1, seed=0):
+    """Send `num_requests` random feature vectors from `concurrency` keep-alive clients.
+
+    Returns client-side throughput and latency percentiles plus the server's /metrics.
+    """
+    rng = np.random.default_rng(seed)
+    features = rng.gamma(2.0, 20.0, size=(num_requests * rows_per_request, len(MODEL_FEATURES)))
+    features[:, MODEL_FEATURES.index('age')] = rng.integers(10, 70, len(features))
+    features[:, MODEL_FEATURES.index('gender')] = rng.integers(0, 2, len(features))
+    bodies = [json.dumps({'instances': features[i:i + rows_per_request].tolist()}).encode()
+              for i in range(0, len(features), rows_per_request)]
+
+    latencies = []
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        errors = sum(executor.map(_client_worker, [host] * concurrency, [port] * concurrency,
+                                  [bodies[i::concurrency] for i in range(concurrency)], [latencies] * concurrency))
+    elapsed = time.perf_counter() - start
+
+    connection = http.client.HTTPConnection(host, port)
+    connection.request('GET', '/metrics')
+    server_metrics = json.loads(connection.getresponse().read())
+    connection.close()
+
+    p50, p99 = np.percentile(latencies, [50, 99])
+    return {'requests': num_requests, 'concurrency': concurrency, 'rows_per_request': rows_per_request,
+            'errors': errors, 'seconds': elapsed, 'requests_per_second': num_requests / elapsed,
+            'client_latency_ms': {'p50': float(p50), 'p99': float(p99)}, 'server': server_metrics}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local micro-batching scoring service for the criteria models.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for name in ('serve', 'bench'):
+        subparser = subparsers.add_parser(name)
+        subparser.add_argument('--host', default=DEFAULT_HOST)
+        subparser.add_argument('--port', type=int, default=DEFAULT_PORT)
+        subparser.add_argument('--soft-model', default=SOFT_MODEL_PATH)
+        subparser.add_argument('--hard-model', default=HARD_MODEL_PATH)
+        subparser.add_argument('--max-batch-rows', type=int, default=MAX_BATCH_ROWS)
+        subparser.add_argument('--max-wait-ms', type=float, default=MAX_WAIT_MS)
+    bench = subparsers.choices['bench']
+    bench.add_argument('--requests', type=int, default=5000)
+    bench.add_argument('--concurrency', type=int, default=32)
+    bench.add_argument('--rows-per-request', type=int, default=1)
+    bench.add_argument('--external', action='store_true',
+                       help='load an already running server instead of starting one in this process')
+    args = parser.parse_args()
+
+    if args.command == 'serve':
+        serve(args.host, args.port, args.soft_model, args.hard_model, args.max_batch_rows, args.max_wait_ms)
+    else:
+        server = None
+        if not args.external:
+            soft_model, hard_model = load_models(args.soft_model, args.hard_model)
+            server = ScoringServer((args.host, 0), soft_model, hard_model, args.max_batch_rows, args.max_wait_ms)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+        port = server.server_address[1] if server else args.port
+        try:
+            print(json.dumps(load_test(args.host, port, args.requests, args.concurrency, args.rows_per_request),
+                             indent=1))
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
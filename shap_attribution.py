@@ -0,0 +1,136 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+
+from batch_labeling import HARD_MODEL_PATH, ID_COLUMNS, SOFT_MODEL_PATH, feature_matrix, label_frame, load_models
+from data_loader import ADDICTION_GROUPS, HAS_PYARROW, MODEL_FEATURES, label_addiction_groups
+
+CONTRIBUTION_NAMES = MODEL_FEATURES + ['bias']
+MODELS = ['soft', 'hard']
+
+
+def contributions(model, features):
+    """Exact tree SHAP values from XGBoost's native pred_contribs, as an (n, 14) float32 array.
+
+    The last column is the bias term, so each row sums to the model's log-odds.
+    """
+    dmatrix = xgb.DMatrix(features, feature_names=MODEL_FEATURES)
+    return model.predict(dmatrix, pred_contribs=True).astype(np.float32, copy=False)
+
+
+def attribute_frame(df, soft_model=None, hard_model=None, threshold=0.5):
+    """Labels plus soft and hard model SHAP columns (soft_<feature>, hard_<feature>) for one chunk.
+
+    The hard model only scores rows whose soft probability reaches
+    `threshold` in the labeling cascade, so hard_* values are NaN for every
+    other row. That choice follows the model, not the labels: survey answers
+    that override a month's preds_soft do not change which rows get hard_*.
+    """
+    if soft_model is None or hard_model is None:
+        soft_model, hard_model = load_models()
+    features = feature_matrix(df)
+    labeled = label_frame(df, soft_model, hard_model)
+
+    soft_shap = contributions(soft_model, features)
+    hard_shap = np.full_like(soft_shap, np.nan)
+    soft_probs = soft_model.predict(xgb.DMatrix(features, feature_names=MODEL_FEATURES))
+    addicted = np.flatnonzero(soft_probs >= threshold)
+    if len(addicted):
+        hard_shap[addicted] = contributions(hard_model, features[addicted])
+
+    columns = {}
+    for model, values in zip(MODELS, (soft_shap, hard_shap)):
+        for i, name in enumerate(CONTRIBUTION_NAMES):
+            columns[f'{model}_{name}'] = values[:, i]
+    return pd.concat([labeled, pd.DataFrame(columns)], axis=1)
+
+
+### Aggregation ###
+
+def _chunk_sums(attributions, month_column):
+    """Per (month, addiction_group) count, sum and sum of |value| of every SHAP column."""
+    shap_columns = [f'{model}_{name}' for model in MODELS for name in CONTRIBUTION_NAMES]
+    values = attributions[shap_columns]
+    keys = [attributions[month_column].to_numpy(),
+            label_addiction_groups(attributions['preds_3_label_criteria'])]
+    sums = values.groupby(keys, observed=True).sum()
+    abs_sums = values.abs().groupby(keys, observed=True).sum()
+    counts = values.notna().groupby(keys, observed=True).sum()
+    return pd.concat({'sum': sums, 'abs_sum': abs_sums, 'count': counts}, axis=1)
+
+
+def summarize_attributions(sums):
+    """Turn accumulated sums into a long frame of mean SHAP and mean |SHAP| per model and feature."""
+    sums.index.names = ['month', 'addiction_group']
+    stacked = sums.stack(future_stack=True)
+    summary = pd.DataFrame({
+        'mean_shap': stacked['sum'] / stacked['count'],
+        'mean_abs_shap': stacked['abs_sum'] / stacked['count'],
+        'count': stacked['count'].astype(np.int64),
+    })
+    summary.index.names = ['month', 'addiction_group', 'column']
+    summary = summary.reset_index()
+    summary[['model', 'feature']] = summary['column'].str.split('_', n=1, expand=True)
+    summary['addiction_group'] = pd.Categorical(summary['addiction_group'], categories=ADDICTION_GROUPS)
+    summary = summary[summary['count'] > 0]
+    return (summary[['model', 'month', 'addiction_group', 'feature', 'mean_shap', 'mean_abs_shap', 'count']]
+            .sort_values(['model', 'month', 'addiction_group', 'mean_abs_shap'], ascending=[True, True, True, False])
+            .reset_index(drop=True))
+
+
+def aggregate_attributions(attributions, month_column='month'):
+    """Mean SHAP and mean |SHAP| per model, month, addiction group and feature."""
+    return summarize_attributions(_chunk_sums(attributions, month_column))
+
+
+### Chunked pipeline ###
+
+def attribute_file(input_path, output_path, chunksize=500_000, month_column='month',
+                   soft_model_path=SOFT_MODEL_PATH, hard_model_path=HARD_MODEL_PATH):
+    """Stream a feature CSV through both models and write labels plus float32 SHAP values to Parquet.
+
+    Each chunk becomes one row group and is folded into running per-month /
+    per-group sums on the way, so the summary needs no second pass over the
+    output. Returns the aggregate_attributions() summary.
+    """
+    if not HAS_PYARROW:
+        raise ImportError('attribute_file requires pyarrow for the Parquet output')
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    soft_model, hard_model = load_models(soft_model_path, hard_model_path)
+    wanted = set(ID_COLUMNS + [month_column] + MODEL_FEATURES + ['soft_criteria', 'hard_criteria'])
+
+    writer, sums = None, None
+    try:
+        for chunk in pd.read_csv(input_path, usecols=lambda column: column in wanted, chunksize=chunksize):
+            attributions = attribute_frame(chunk, soft_model, hard_model)
+            if month_column not in attributions.columns:
+                attributions.insert(0, month_column, chunk[month_column].to_numpy())
+            table = pa.Table.from_pandas(attributions, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(output_path, table.schema)
+            writer.write_table(table)
+
+            chunk_sums = _chunk_sums(attributions, month_column)
+            sums = chunk_sums if sums is None else sums.add(chunk_sums, fill_value=0)
+    finally:
+        if writer is not None:
+            writer.close()
+    return summarize_attributions(sums)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Per user-month SHAP values of the soft and hard criteria models.')
+    parser.add_argument('input', help='CSV with user_id, month and the model feature columns')
+    parser.add_argument('output', help='Parquet file for the per-row SHAP values')
+    parser.add_argument('--summary', default='shap_summary.csv', help='CSV for the per-month / per-group summary')
+    parser.add_argument('--chunksize', type=int, default=500_000)
+    parser.add_argument('--month-column', default='month')
+    args = parser.parse_args()
+
+    summary = attribute_file(args.input, args.output, chunksize=args.chunksize, month_column=args.month_column)
+    summary.to_csv(args.summary, index=False)
+    print(f'wrote {args.output} and {args.summary}')
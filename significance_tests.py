@@ -0,0 +1,241 @@
+import argparse
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+import numpy as np
+import pandas as pd
+
+from data_loader import load_dataset
+from feature_cube import CUBE_DIMENSIONS, default_features, dimension_codes
+from instrumentation import instrument
+from logistic_screening import adjust_pvalues
+
+RESULT_COLUMNS = [
+    'month_chronological_order', 'feature', 'group', 'reference', 'n_group', 'n_reference', 'mean_group',
+    'mean_reference', 'difference', 'ci_lower', 'ci_upper', 'p_value', 'p_value_adjusted',
+]
+
+
+def group_codes(df, column):
+    """Integer group code per row (-1 for missing) and the sorted group values.
+
+    preds_soft / preds_3_label_criteria may come as the *_label strings of dataset.csv.
+    """
+    if column in CUBE_DIMENSIONS:
+        return dimension_codes(df, column)
+    codes, levels = pd.factorize(df[column], sort=True)
+    return codes.astype(np.int64), levels.tolist()
+
+
+def _chunk_rows(num_columns, max_elements):
+    return max(1, max_elements // max(num_columns, 1))
+
+
+### Resampling ###
+
+def bootstrap_group_means(values, observed, rng, num_bootstrap, max_elements=2**24):
+    """(num_bootstrap, features) means of bootstrap resamples of one group's rows.
+
+    Each replicate is a row of multinomial resampling counts, so one weight
+    matrix times the data gives every feature's replicate means at once.
+    """
+    n = len(values)
+    sums = np.empty((num_bootstrap, values.shape[1]))
+    counts = np.empty((num_bootstrap, values.shape[1]))
+    step = _chunk_rows(n, max_elements)
+    for start in range(0, num_bootstrap, step):
+        weights = rng.multinomial(n, np.full(n, 1 / n), size=min(step, num_bootstrap - start)).astype(np.float64)
+        sums[start:start + len(weights)] = weights @ values
+        counts[start:start + len(weights)] = weights @ observed
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return sums / counts
+
+
+def permutation_exceedances(values, observed, codes, pairs, rng, num_permutations, max_elements=2**24):
+    """For every (group, reference) pair, how often a label permutation's |mean difference| reaches the observed one.
+
+    One uniform (permutations x rows) matrix per chunk is shared by all pairs:
+    within a pair's rows, the n_group smallest draws of each permutation form
+    the permuted group, and the permuted sums of every feature are one
+    indicator-matrix product. Returns ({pair: exceedance counts per feature},
+    {pair: observed differences}).
+    """
+    exceed, observed_difference, prepared = {}, {}, {}
+    for group, reference in pairs:
+        rows = np.flatnonzero((codes == group) | (codes == reference))
+        in_group = codes[rows] == group
+        pair_values, pair_observed = values[rows], observed[rows]
+        total_sum, total_count = pair_values.sum(axis=0), pair_observed.sum(axis=0)
+        group_sum, group_count = pair_values[in_group].sum(axis=0), pair_observed[in_group].sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            difference = group_sum / group_count - (total_sum - group_sum) / (total_count - group_count)
+        observed_difference[group, reference] = difference
+        exceed[group, reference] = np.zeros(values.shape[1])
+        prepared[group, reference] = (rows, int(in_group.sum()), pair_values, pair_observed, total_sum, total_count)
+
+    step = _chunk_rows(len(values), max_elements)
+    for start in range(0, num_permutations, step):
+        draws = rng.random((min(step, num_permutations - start), len(values)))
+        for pair, (rows, n_group, pair_values, pair_observed, total_sum, total_count) in prepared.items():
+            if n_group == 0 or n_group == len(rows):
+                continue
+            chosen = np.argpartition(draws[:, rows], n_group - 1, axis=1)[:, :n_group]
+            indicator = np.zeros((len(draws), len(rows)))
+            np.put_along_axis(indicator, chosen, 1.0, axis=1)
+            group_sum, group_count = indicator @ pair_values, indicator @ pair_observed
+            with np.errstate(invalid='ignore', divide='ignore'):
+                permuted = group_sum / group_count - (total_sum - group_sum) / (total_count - group_count)
+            # The relative tolerance keeps exact ties (e.g. the identity permutation) counted despite rounding
+            exceed[pair] += (np.abs(permuted) >= np.abs(observed_difference[pair]) * (1 - 1e-10)).sum(axis=0)
+    return exceed, observed_difference
+
+
+def test_month(values, codes, levels, pairs, num_permutations=1000, num_bootstrap=1000, ci=0.95, seed=None,
+               max_elements=2**24):
+    """Permutation p-values and bootstrap percentile CIs of group mean differences for one month.
+
+    `values` is (rows, features) with NaN for missing values, `codes` the
+    group code of every row. Returns one row per pair and feature (features
+    in column order), without the month and feature names.
+    """
+    observed = ~np.isnan(values)
+    values = np.where(observed, values, 0.0)
+    observed = observed.astype(np.float64)
+    permutation_rng, bootstrap_rng = (np.random.default_rng(child)
+                                      for child in np.random.SeedSequence(seed).spawn(2))
+
+    exceed, differences = permutation_exceedances(values, observed, codes, pairs, permutation_rng,
+                                                  num_permutations, max_elements)
+
+    # Bootstrap means per group, shared by every pair the group is in
+    groups_in_pairs = sorted({code for pair in pairs for code in pair})
+    boot_means, means, sizes = {}, {}, {}
+    for code in groups_in_pairs:
+        rows = np.flatnonzero(codes == code)
+        sizes[code] = len(rows)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means[code] = values[rows].sum(axis=0) / observed[rows].sum(axis=0)
+        if len(rows) and num_bootstrap:
+            boot_means[code] = bootstrap_group_means(values[rows], observed[rows], bootstrap_rng, num_bootstrap,
+                                                     max_elements)
+
+    tables = []
+    for group, reference in pairs:
+        if group in boot_means and reference in boot_means:
+            boot_difference = boot_means[group] - boot_means[reference]
+            with np.errstate(invalid='ignore'):
+                lower, upper = np.nanpercentile(boot_difference, [50 * (1 - ci), 50 * (1 + ci)], axis=0)
+        else:
+            lower = upper = np.full(values.shape[1], np.nan)
+        testable = 0 < sizes[group] and 0 < sizes[reference] and num_permutations
+        tables.append(pd.DataFrame({
+            'group': levels[group],
+            'reference': levels[reference],
+            'n_group': sizes[group],
+            'n_reference': sizes[reference],
+            'mean_group': means[group],
+            'mean_reference': means[reference],
+            'difference': differences[group, reference],
+            'ci_lower': lower,
+            'ci_upper': upper,
+            'p_value': np.where(np.isnan(differences[group, reference]) | (not testable), np.nan,
+                                (1 + exceed[group, reference]) / (1 + num_permutations)),
+        }))
+    return pd.concat(tables, ignore_index=True)
+
+
+### Parallel Scheduler ###
+
+def _run_month_task(task):
+    """Worker entry point: test one month's slice of the shared feature array."""
+    (shm_name, shape, start, stop, month, codes, levels, pairs,
+     num_permutations, num_bootstrap, ci, seed, max_elements) = task
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        values = np.array(np.ndarray(shape, dtype=np.float64, buffer=shm.buf)[start:stop])
+    finally:
+        shm.close()
+    table = test_month(values, codes, levels, pairs, num_permutations, num_bootstrap, ci,
+                       seed=[seed, int(month)], max_elements=max_elements)
+    return month, table
+
+
+@instrument
+def test_group_differences(df, group_column='preds_soft', features=None, pairs=None,
+                           month_column='month_chronological_order', num_permutations=1000, num_bootstrap=1000,
+                           ci=0.95, correction='fdr_bh', seed=42, max_workers=None, max_elements=2**24):
+    """Per month, feature and group pair: mean difference, bootstrap CI and permutation p-value.
+
+    `pairs` are (group, reference) value pairs; by default every pair of
+    group values with the higher value as `group` (e.g. addicted vs
+    non-addicted). All features of a month are tested together and the
+    months run as independent tasks on a process pool, reading one shared
+    memory copy of the data. Seeds depend only on `seed` and the month, so
+    results do not depend on `max_workers`; seed=None uses fresh entropy. p_value_adjusted applies
+    `correction` over all tests.
+    """
+    features = default_features(df) if features is None else list(features)
+    if seed is None:
+        # Draw fresh entropy once, so every month still gets its own stream derived from it
+        seed = np.random.SeedSequence().entropy
+    codes, levels = group_codes(df, group_column)
+    present = sorted(set(np.unique(codes[codes >= 0]).tolist()))
+    if pairs is None:
+        pairs = [(group, reference) for reference, group in itertools.combinations(present, 2)]
+    else:
+        pairs = [(levels.index(group), levels.index(reference)) for group, reference in pairs]
+
+    months = df[month_column].to_numpy()
+    order = np.argsort(months, kind='stable')
+    values = df[features].to_numpy(dtype=np.float64)[order]
+    codes, months = codes[order], months[order]
+    month_values, starts = np.unique(months, return_index=True)
+    stops = np.append(starts[1:], len(months))
+
+    shm = shared_memory.SharedMemory(create=True, size=max(values.nbytes, 1))
+    try:
+        np.ndarray(values.shape, dtype=np.float64, buffer=shm.buf)[:] = values
+        tasks = [
+            (shm.name, values.shape, start, stop, month, codes[start:stop], levels, pairs,
+             num_permutations, num_bootstrap, ci, seed, max_elements)
+            for month, start, stop in zip(month_values, starts, stops)
+        ]
+        max_workers = max_workers or os.cpu_count()
+        if max_workers == 1:
+            results = list(map(_run_month_task, tasks))
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                results = list(executor.map(_run_month_task, tasks))
+    finally:
+        shm.close()
+        shm.unlink()
+
+    tables = []
+    for month, table in results:
+        table.insert(0, 'feature', np.tile(features, len(pairs)))
+        table.insert(0, month_column, month)
+        tables.append(table)
+    result = pd.concat(tables, ignore_index=True)
+    result['p_value_adjusted'] = adjust_pvalues(result['p_value'], correction)
+    return result[[month_column] + RESULT_COLUMNS[1:]]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Permutation tests and bootstrap CIs of per-month group differences.')
+    parser.add_argument('data', nargs='?', default='dataset.csv')
+    parser.add_argument('--group', default='preds_soft', help='e.g. preds_soft or preds_3_label_criteria')
+    parser.add_argument('--features', nargs='*', help='default: every numeric feature column')
+    parser.add_argument('--permutations', type=int, default=1000)
+    parser.add_argument('--bootstrap', type=int, default=1000)
+    parser.add_argument('--max-workers', type=int)
+    parser.add_argument('--output', default='group_differences.csv')
+    args = parser.parse_args()
+
+    results = test_group_differences(load_dataset(args.data), args.group, features=args.features,
+                                     num_permutations=args.permutations, num_bootstrap=args.bootstrap,
+                                     max_workers=args.max_workers)
+    results.to_csv(args.output, index=False)
+    print(results.sort_values('p_value_adjusted').head(20).to_string(index=False))
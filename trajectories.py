@@ -0,0 +1,190 @@
+import numpy as np
+import pandas as pd
+
+from event_log_aggregation import NUM_MONTHS
+
+MISSING = -1
+
+SOFT_STATE_NAMES = ['N', 'A']
+TRAJECTORY_TYPES = ['stable', 'onset', 'recovery', 'fluctuating', 'unobserved']
+
+
+def state_matrix(df, column='preds_soft', month_column='month_chronological_order', num_months=NUM_MONTHS):
+    """Encode each user's monthly labels as one row of a (users x months) int8 matrix.
+
+    Column j holds month_chronological_order j + 1; months without a row are
+    MISSING. Returns (user_ids, states).
+    """
+    user_ids, user_index = np.unique(df['user_id'].to_numpy(), return_inverse=True)
+    states = np.full((len(user_ids), num_months), MISSING, dtype=np.int8)
+    states[user_index, df[month_column].to_numpy(dtype=np.int64) - 1] = df[column].to_numpy(dtype=np.int8)
+    return user_ids, states
+
+
+def value_matrix(df, column, user_ids, month_column='month_chronological_order', num_months=NUM_MONTHS):
+    """Dense (users x months) float matrix of `column`, NaN for missing months, aligned with `user_ids`."""
+    values = np.full((len(user_ids), num_months), np.nan)
+    values[np.searchsorted(user_ids, df['user_id'].to_numpy()),
+           df[month_column].to_numpy(dtype=np.int64) - 1] = df[column].to_numpy(dtype=np.float64)
+    return values
+
+
+def previous_states(states, bridge_gaps=False):
+    """State in the month before each cell, MISSING where there is none.
+
+    By default a transition needs both months observed, so a gap breaks the
+    sequence. With `bridge_gaps`, the last observed month before the gap is used.
+    """
+    previous = np.full_like(states, MISSING)
+    if not bridge_gaps:
+        previous[:, 1:] = states[:, :-1]
+        return previous
+    observed_at = np.where(states != MISSING, np.arange(states.shape[1]), -1)
+    last_observed = np.maximum.accumulate(observed_at, axis=1)
+    source = last_observed[:, :-1]
+    previous[:, 1:] = np.where(source >= 0, np.take_along_axis(states, np.maximum(source, 0), axis=1), MISSING)
+    return previous
+
+
+def transition_mask(states, bridge_gaps=False):
+    """(previous, valid) where valid marks cells with both the month and its predecessor observed."""
+    previous = previous_states(states, bridge_gaps)
+    return previous, (previous != MISSING) & (states != MISSING)
+
+
+### Transitions ###
+
+def transition_matrix(states, num_states=None, by_month=False, bridge_gaps=False):
+    """Counts of (from_state, to_state) month-to-month moves.
+
+    Returns a (num_states, num_states) array, or with `by_month` a
+    (num_months, num_states, num_states) array indexed by the month moved into
+    (index 0 is always empty).
+    """
+    num_states = num_states or int(states.max()) + 1
+    previous, valid = transition_mask(states, bridge_gaps)
+    pair_codes = previous.astype(np.int64) * num_states + states
+    if not by_month:
+        return np.bincount(pair_codes[valid], minlength=num_states ** 2).reshape(num_states, num_states)
+    month_codes = np.broadcast_to(np.arange(states.shape[1]), states.shape)[valid]
+    counts = np.bincount(month_codes * num_states ** 2 + pair_codes[valid], minlength=states.shape[1] * num_states ** 2)
+    return counts.reshape(states.shape[1], num_states, num_states)
+
+
+def transition_probabilities(counts):
+    """Row-normalize transition counts (rows with no moves stay NaN)."""
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return counts / counts.sum(axis=-1, keepdims=True)
+
+
+def run_lengths(states, user_ids=None):
+    """Maximal runs of an unchanged, observed state: user_id, state, start_month, length.
+
+    A missing month ends a run. Months are month_chronological_order values.
+    """
+    num_users, num_months = states.shape
+    observed = states != MISSING
+    starts = observed.copy()
+    starts[:, 1:] &= (states[:, 1:] != states[:, :-1]) | ~observed[:, :-1]
+    flat_starts = np.flatnonzero(starts)
+
+    # A run ends before the next start, the next missing month or the row end
+    ends = observed.copy()
+    ends[:, :-1] &= (states[:, 1:] != states[:, :-1]) | ~observed[:, 1:]
+    flat_ends = np.flatnonzero(ends)
+
+    rows, start_columns = np.divmod(flat_starts, num_months)
+    user_ids = np.arange(num_users) if user_ids is None else np.asarray(user_ids)
+    return pd.DataFrame({
+        'user_id': user_ids[rows],
+        'state': states.ravel()[flat_starts],
+        'start_month': start_columns + 1,
+        'length': flat_ends - flat_starts + 1,
+    })
+
+
+def first_transition_month(states, from_states=None, to_states=None, bridge_gaps=False):
+    """Month (month_chronological_order) of each user's first matching transition, 0 if none.
+
+    `from_states` / `to_states` restrict which moves count; by default any change.
+    """
+    previous, valid = transition_mask(states, bridge_gaps)
+    moved = valid & (previous != states)
+    if from_states is not None:
+        moved &= np.isin(previous, from_states)
+    if to_states is not None:
+        moved &= np.isin(states, to_states)
+    return np.where(moved.any(axis=1), moved.argmax(axis=1) + 1, 0)
+
+
+def sequence_codes(states):
+    """Pack each user's sequence into one int64 (base num_states + 1, MISSING -> 0) for pattern counts."""
+    base = int(states.max()) + 2
+    weights = base ** np.arange(states.shape[1] - 1, -1, -1, dtype=np.int64)
+    return (states.astype(np.int64) + 1) @ weights
+
+
+### Per-user summary ###
+
+def summarize_trajectories(states, user_ids, bridge_gaps=False):
+    """One row per user: observed months, transitions, first/last state, first transition, longest run and type.
+
+    trajectory_type is 'stable' (no change), 'onset' (a single move to a higher
+    state, e.g. non -> addicted), 'recovery' (a single move to a lower state),
+    'fluctuating' (two or more moves) or 'unobserved'. stable / onset /
+    recovery with preds_soft are the notebook's user_non|user_add,
+    user_non2add and user_add2non sets, but gaps no longer count as moves.
+    """
+    previous, valid = transition_mask(states, bridge_gaps)
+    moved = valid & (previous != states)
+    num_transitions = moved.sum(axis=1)
+    up = (moved & (states > previous)).any(axis=1)
+
+    observed = states != MISSING
+    num_observed = observed.sum(axis=1)
+    first_column = observed.argmax(axis=1)
+    last_column = states.shape[1] - 1 - observed[:, ::-1].argmax(axis=1)
+    rows = np.arange(len(states))
+
+    trajectory_type = np.select(
+        [num_observed == 0, num_transitions == 0, num_transitions >= 2, up],
+        ['unobserved', 'stable', 'fluctuating', 'onset'], default='recovery')
+
+    runs = run_lengths(states)
+    longest_run = np.zeros(len(states), dtype=np.int64)
+    np.maximum.at(longest_run, runs['user_id'].to_numpy(), runs['length'].to_numpy())
+
+    return pd.DataFrame({
+        'user_id': user_ids,
+        'num_observed': num_observed,
+        'num_transitions': num_transitions,
+        'first_state': np.where(num_observed > 0, states[rows, first_column], MISSING),
+        'last_state': np.where(num_observed > 0, states[rows, last_column], MISSING),
+        'first_transition_month': np.where(num_transitions > 0, moved.argmax(axis=1) + 1, 0),
+        'longest_run': longest_run,
+        'trajectory_type': pd.Categorical(trajectory_type, categories=TRAJECTORY_TYPES),
+    })
+
+
+def transition_deltas(states, values, state_names=SOFT_STATE_NAMES, bridge_gaps=False):
+    """Month-over-month change of a feature for every observed transition, labeled like 'N-A'.
+
+    `values` is a value_matrix() aligned with `states`. This is the data behind
+    the notebook's A-A / A-N / N-A / N-N transition plots.
+    """
+    previous, valid = transition_mask(states, bridge_gaps)
+    if bridge_gaps:
+        observed_at = np.where(states != MISSING, np.arange(states.shape[1]), -1)
+        source = np.maximum(np.maximum.accumulate(observed_at, axis=1)[:, :-1], 0)
+        previous_values = np.full_like(values, np.nan)
+        previous_values[:, 1:] = np.take_along_axis(values, source, axis=1)
+    else:
+        previous_values = np.full_like(values, np.nan)
+        previous_values[:, 1:] = values[:, :-1]
+
+    names = np.asarray(state_names)
+    return pd.DataFrame({
+        'type': np.char.add(np.char.add(names[previous[valid]], '-'), names[states[valid]]),
+        'delta': (values - previous_values)[valid],
+        'month': np.nonzero(valid)[1] + 1,
+    })